@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# .env lido uma única vez, antes de qualquer módulo do app consultar os.getenv
+load_dotenv()
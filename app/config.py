@@ -1,16 +1,62 @@
 import os
 import datetime
-from dotenv import load_dotenv
-
-load_dotenv()
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DEFAULT_SQLITE_PATH = os.path.join(PROJECT_ROOT, "instance", "app.db")
 DEFAULT_SQLALCHEMY_URI = f"sqlite:///{DEFAULT_SQLITE_PATH}"
 
+# =========================
+# Perfil do banco
+# =========================
+# SQLite: aplicado em cada conexão nova (ver app.extensions)
+DB_SQLITE_JOURNAL_MODE = os.getenv("DB_SQLITE_JOURNAL_MODE", "WAL")
+DB_SQLITE_SYNCHRONOUS = os.getenv("DB_SQLITE_SYNCHRONOUS", "NORMAL")
+DB_SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("DB_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_SQLITE_MMAP_BYTES = int(os.getenv("DB_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+# PostgreSQL (e outros bancos servidor): pool por processo do Gunicorn
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes", "y")
+
+
+def normalize_database_url(url: str) -> str:
+    # provedores que ainda exportam o esquema antigo 'postgres://' (não aceito pelo SQLAlchemy 2)
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def sqlite_pragmas() -> dict:
+    return {
+        "journal_mode": DB_SQLITE_JOURNAL_MODE,
+        "synchronous": DB_SQLITE_SYNCHRONOUS,
+        "busy_timeout": DB_SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": DB_SQLITE_MMAP_BYTES,
+    }
+
+
+def engine_options(url: str) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS conforme o banco da URL."""
+    if url.startswith("sqlite"):
+        if ":memory:" in url or url.rstrip("/") == "sqlite:":
+            return {}
+        # threads do Gunicorn compartilham o pool; o timeout do driver casa com o busy_timeout
+        return {"connect_args": {"check_same_thread": False, "timeout": DB_SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
 class BaseConfig:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
-    SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", DEFAULT_SQLALCHEMY_URI)
+    SQLALCHEMY_DATABASE_URI = normalize_database_url(os.getenv("DATABASE_URL", DEFAULT_SQLALCHEMY_URI))
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
     SWAGGER = {"title": "Meus Contatos MS API", "uiversion": 3, "specs_route": "/api/docs"}
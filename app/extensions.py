@@ -1,10 +1,41 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_cors import CORS
+from sqlalchemy import event
+
+from app.config import sqlite_pragmas
 
 db = SQLAlchemy()
-migrate = Migrate()
 
 def cors(app, **kwargs):
     """Wrapper opcional para manter a assinatura anterior."""
-    return CORS(app, **kwargs)
\ No newline at end of file
+    return CORS(app, **kwargs)
+
+
+def apply_sqlite_pragmas(engine, pragmas=None) -> None:
+    """Aplica os PRAGMAs (WAL, synchronous, busy_timeout, mmap) em cada conexão nova do engine."""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas() if pragmas is None else pragmas
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for name, value in pragmas.items():
+                cur.execute(f"PRAGMA {name}={value}")
+        finally:
+            cur.close()
+
+
+def init_db(app) -> None:
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine)
+
+
+def init_migrate(app) -> None:
+    """Flask-Migrate (Alembic) só é necessário nos comandos 'flask db ...'; importá-lo custa ~150 ms no boot."""
+    from flask_migrate import Migrate
+
+    Migrate(app, db)
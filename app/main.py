@@ -1,21 +1,32 @@
 import os
 from flask import Flask, jsonify
-from flasgger import Swagger
 from flask_cors import CORS
 from .config import get_config
 from .swagger.base_spec import base_spec
-from .extensions import db, migrate
+from .swagger.spec_cache import init_swagger
+from .extensions import db, init_db, init_migrate
+from .middleware.admin_auth import require_admin
+from .middleware.compression import register_compression
+from .middleware.memory_diag import register_memory_diag
+from .middleware.profiler import register_profiler
+from .middleware.rate_limit import register_rate_limit
 from .middleware.request_logger import register_request_hooks
-from .models import request_log
+from .middleware.tracing import register_tracing
+from .models import request_log, mail_index, contact_import, mail_dispatch, graph_subscription
+from .services import metrics
+from .services.json_codec import FastJSONProvider
 
 
 def create_app():
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     app.config.from_object(get_config())
     app.secret_key = os.getenv("SECRET_KEY", "dev-secret")
 
-    db.init_app(app)
-    migrate.init_app(app, db)
+    init_db(app)
+    # o Flask marca FLASK_RUN_FROM_CLI em qualquer comando 'flask ...'/manage.py; no Gunicorn não
+    if os.getenv("FLASK_RUN_FROM_CLI") == "true":
+        init_migrate(app)
 
     FRONT_ORIGINS = [
         "http://localhost:5173",
@@ -30,7 +41,8 @@ def create_app():
         resources={r"/*": {"origins": FRONT_ORIGINS}},
         methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
         allow_headers=["Content-Type", "Authorization"],
-        expose_headers=["Content-Type", "Authorization"],
+        expose_headers=["Content-Type", "Authorization", "Retry-After",
+                        "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy"],
     )
 
     if os.getenv("FLASK_ENV") == "development":
@@ -39,7 +51,16 @@ def create_app():
         app.config.setdefault("SESSION_COOKIE_SECURE", False)
 
     from .routes.main import register_routes
+    from .services.graph_webhooks import warn_if_cache_not_shared
     register_routes(app)
+    warn_if_cache_not_shared(app)
+    # primeiros registrados: o span da requisição e o profiling envolvem os demais hooks
+    register_tracing(app)
+    register_profiler(app)
+    register_memory_diag(app)
+    register_rate_limit(app)
+    # after_request roda em ordem inversa: a compressão vê a resposta depois do log
+    register_compression(app)
     register_request_hooks(app)
 
     app.config["SWAGGER"] = {
@@ -62,10 +83,85 @@ def create_app():
         "swagger_ui": True,
         "specs_route": "/api/docs",
     }
-    Swagger(app, template=base_spec, config=swagger_config)
+    init_swagger(app, template=base_spec, config=swagger_config)
 
     @app.get("/api/health")
     def health():
         return jsonify({"status": "ok"})
 
-    return app
\ No newline at end of file
+    @app.get("/api/metrics")
+    def metrics_view():
+        # contadores do planner, do cache e por usuário: só com X-Admin-Token, como /admin
+        denied = require_admin()
+        if denied is not None:
+            return denied
+        data = metrics.snapshot()
+        c = data["counters"]
+        cache_hits = c.get("cache.hits", 0) + c.get("cache.stale_hits", 0)
+        cache_lookups = cache_hits + c.get("cache.misses", 0)
+        data["derived"] = {
+            "planner.parse_failure_rate": metrics.ratio("planner.parse_failures", "planner.requests"),
+            "planner.validation_failure_rate": metrics.ratio("planner.validation_failures", "planner.requests"),
+            "prefetch.hit_rate": metrics.ratio("prefetch.used", "prefetch.started"),
+            "cache.hit_rate": (cache_hits / cache_lookups) if cache_lookups else 0.0,
+        }
+        return jsonify(data)
+
+    return app
+
+# =========================
+# Ciclo de vida dos workers (gunicorn.conf.py)
+# =========================
+_preloaded_apps = []
+
+
+def reset_after_fork() -> None:
+    """
+    No worker recém-criado por fork (preload): conexões herdadas do master não podem ser
+    reutilizadas. Chamado pelo hook post_fork do Gunicorn.
+    """
+    from .services.cache import reset_cache
+    from .services.ratelimit import reset_limiter
+
+    for app in _preloaded_apps:
+        with app.app_context():
+            for engine in db.engines.values():
+                # close=False: não fecha os sockets do master, só esquece o pool herdado
+                engine.dispose(close=False)
+    reset_cache()
+    reset_limiter()
+
+
+def preload_app(app) -> None:
+    """
+    Chamado uma vez no master antes do fork: importa o que foi adiado, monta o que é imutável
+    (mapa de rotas, spec OpenAPI) e congela o heap no GC, para os workers compartilharem essas
+    páginas por copy-on-write em vez de cada um refazer o trabalho.
+    """
+    import gc
+
+    import requests_oauthlib  # noqa: F401  (adiado em ms_oauth)
+
+    app.url_map.bind("localhost").match("/api/health")
+    spec = app.extensions.get("openapi_spec")
+    if spec is not None:
+        spec.get()
+
+    _preloaded_apps.append(app)
+    gc.collect()
+    # objetos do master ficam fora das coletas: o GC dos workers não toca (nem copia) essas páginas
+    gc.freeze()
+
+
+def shutdown_background(app) -> None:
+    """Worker saindo: termina o envio em andamento e processa notificações já aceitas (202) em memória."""
+    from .services import agent_prefetch, graph_webhooks, tracing
+    from .services import mail_dispatch as dispatch_service
+
+    dispatch_service.stop_dispatcher(timeout=10.0)
+    try:
+        graph_webhooks.drain_queue(app)
+    except Exception:
+        app.logger.exception("graph webhooks: falha ao esvaziar a fila na saída")
+    agent_prefetch.shutdown()
+    tracing.flush()
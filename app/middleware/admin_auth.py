@@ -0,0 +1,24 @@
+import hmac
+import os
+
+from flask import jsonify, request
+
+# =========================
+# Config (env)
+# =========================
+# vazio desliga as rotas /admin (respondem 404)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+
+
+def is_admin_request() -> bool:
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def require_admin():
+    """before_request dos blueprints administrativos."""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "not_found", "message": "Rotas administrativas desativadas (ADMIN_TOKEN)."}), 404
+    if not is_admin_request():
+        return jsonify({"error": "admin_unauthorized", "message": "Forneça X-Admin-Token válido."}), 401
+    return None
@@ -0,0 +1,99 @@
+import gzip
+import os
+
+from flask import request
+
+try:  # opcional: sem o pacote brotli só há gzip
+    import brotli
+except ImportError:
+    brotli = None
+
+# =========================
+# Config (env)
+# =========================
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() in ("1", "true", "yes", "y")
+# abaixo disso a compressão custa mais CPU do que economiza de rede
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "5"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/csv",
+}
+
+
+def _accepted(header: str) -> dict:
+    """Accept-Encoding -> {codificação: q}."""
+    out = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[name] = q
+    return out
+
+
+def choose_encoding(header: str) -> str | None:
+    """Melhor codificação suportada pelo cliente (br > gzip), respeitando q=0."""
+    accepted = _accepted(header or "")
+    wildcard = accepted.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for enc in candidates:
+        q = accepted.get(enc, wildcard)
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, encoding: str | None):
+    if (
+        encoding is None
+        or response.direct_passthrough
+        or response.is_streamed
+        or not (200 <= response.status_code < 300)
+        or response.status_code == 204
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    # o ETag foi calculado sobre o corpo sem compressão
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def register_compression(app):
+    """Registrar antes dos demais after_request: roda por último, já com o corpo final."""
+    if not COMPRESS_ENABLED:
+        return
+
+    @app.after_request
+    def compress_view(response):
+        return compress_response(response, choose_encoding(request.headers.get("Accept-Encoding", "")))
@@ -0,0 +1,19 @@
+from flask import current_app
+
+from app.middleware.admin_auth import ADMIN_TOKEN
+from app.services import memory_diag
+
+
+def sync_memory_diag():
+    # diagnóstico nunca pode derrubar a requisição: falha só deixa este worker de fora
+    try:
+        memory_diag.sync()
+    except Exception:
+        current_app.logger.warning("memory diag: falha ao aplicar o comando do admin", exc_info=True)
+
+
+def register_memory_diag(app):
+    """Cada worker aplica o tracemalloc ligado/desligado e os snapshots pedidos pelas rotas /admin/memory."""
+    if not ADMIN_TOKEN:
+        return
+    app.before_request(sync_memory_diag)
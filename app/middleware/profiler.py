@@ -0,0 +1,69 @@
+import random
+import time
+
+from flask import current_app, g, request
+
+from app.middleware.admin_auth import is_admin_request
+from app.services import metrics, profiler
+
+
+def _should_profile() -> bool:
+    # X-Profile: 1 junto com X-Admin-Token perfila qualquer rota, sob demanda
+    if request.headers.get("X-Profile") and is_admin_request():
+        return True
+    if not profiler.wants_path(request.path):
+        return False
+    if profiler.PROFILE_SAMPLE_RATE > 0 and random.random() < profiler.PROFILE_SAMPLE_RATE:
+        return True
+    return profiler.armed_until() > time.time()
+
+
+def start_profile():
+    # profiling nunca pode derrubar a requisição: qualquer falha só deixa de capturar
+    try:
+        if not _should_profile():
+            return
+        session = profiler.start_session()
+    except Exception:
+        current_app.logger.warning("profiler: falha ao iniciar a captura", exc_info=True)
+        metrics.incr("profiler.errors")
+        return
+    if session is None:
+        metrics.incr("profiler.skipped_busy")
+        return
+    g.profile = (session, time.perf_counter())
+
+
+def finish_profile(response):
+    active = g.pop("profile", None)
+    if active is None:
+        return response
+    session, started = active
+    try:
+        data = session.stop()
+        name = profiler.save_capture(data, request.method, request.path, time.perf_counter() - started)
+    except Exception:
+        current_app.logger.warning("profiler: falha ao gravar a captura", exc_info=True)
+        metrics.incr("profiler.errors")
+        return response
+    metrics.incr("profiler.captures")
+    response.headers["X-Profile-Id"] = name
+    return response
+
+
+def discard_profile(exc=None):
+    active = g.pop("profile", None)
+    if active is not None:
+        try:
+            active[0].stop()
+        except Exception:
+            current_app.logger.warning("profiler: falha ao encerrar a captura", exc_info=True)
+
+
+def register_profiler(app):
+    """Registrar antes dos demais hooks: a captura cobre os outros before/after_request."""
+    if not profiler.PROFILE_ENABLED:
+        return
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(discard_profile)
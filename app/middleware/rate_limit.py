@@ -0,0 +1,80 @@
+import math
+
+from flask import current_app, g, jsonify, request, session
+
+from app.services import metrics, ratelimit
+from app.services.singleflight import user_key
+
+
+def client_ip() -> str | None:
+    hops = ratelimit.RATELIMIT_PROXY_HOPS
+    if hops > 0:
+        forwarded = [p.strip() for p in request.headers.get("X-Forwarded-For", "").split(",") if p.strip()]
+        # o último proxy confiável acrescenta o IP de quem falou com ele
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.remote_addr
+
+
+def client_user() -> str | None:
+    """E-mail do usuário logado (sessão) ou hash do token Bearer."""
+    auth = request.headers.get("Authorization", "")
+    if auth[:7].lower() == "bearer ":
+        return user_key(auth[7:].strip())
+    user = session.get("user") or {}
+    email = user.get("mail") or user.get("userPrincipalName")
+    if email:
+        return email.lower()
+    token = (session.get("ms_token") or {}).get("access_token")
+    return user_key(token) if token else None
+
+
+def rate_limit_headers(headers, decision: "ratelimit.Decision") -> None:
+    headers["RateLimit-Limit"] = str(decision.limit.limit)
+    headers["RateLimit-Remaining"] = str(decision.remaining)
+    headers["RateLimit-Reset"] = str(math.ceil(decision.reset))
+    headers["RateLimit-Policy"] = decision.limit.policy
+
+
+def check_request():
+    if request.url_rule is None:
+        return None
+    try:
+        decision = ratelimit.get_limiter().check(
+            request.method, request.url_rule.rule, client_user(), client_ip()
+        )
+    except Exception:
+        # armazenamento indisponível não derruba a API: segue sem limite
+        metrics.incr("ratelimit.errors")
+        current_app.logger.warning("rate limit: falha ao consultar os contadores", exc_info=True)
+        return None
+    if decision is None:
+        return None
+    g.rate_limit = decision
+    if decision.allowed:
+        return None
+
+    metrics.incr("ratelimit.limited")
+    retry_after = max(1, math.ceil(decision.retry_after))
+    resp = jsonify({
+        "error": "rate_limited",
+        "message": f"Limite de {decision.limit.limit} requisições a cada {int(decision.limit.period)}s "
+                   f"excedido. Tente novamente em {retry_after}s.",
+    })
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+def add_headers(response):
+    decision = g.get("rate_limit")
+    if decision is not None:
+        rate_limit_headers(response.headers, decision)
+    return response
+
+
+def register_rate_limit(app):
+    if not ratelimit.RATELIMIT_ENABLED:
+        return
+    app.before_request(check_request)
+    app.after_request(add_headers)
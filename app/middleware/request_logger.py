@@ -1,4 +1,5 @@
 from flask import request, g
+from sqlalchemy.orm import Session
 from app.models.request_log import RequestLog
 from app.extensions import db
 from datetime import datetime
@@ -13,10 +14,14 @@ def register_request_hooks(app):
                 status_code=response.status_code,
                 ip=request.remote_addr,
                 ms_email=getattr(g, "ms_email", None),
-                message=response.get_data(as_text=True)[:1000],
+                trace_id=getattr(g, "trace_id", None),
+                # respostas em streaming não são lidas aqui (seria bufferizar o corpo inteiro)
+                message=None if response.is_streamed else response.get_data(as_text=True)[:1000],
             )
-            db.session.add(log)
-            db.session.commit()
+            # sessão própria e curta: não confirma nem descarta o que a rota deixou pendente em db.session
+            with Session(db.engine) as s:
+                s.add(log)
+                s.commit()
         except Exception:
-            db.session.rollback()
-        return response
\ No newline at end of file
+            pass
+        return response
@@ -0,0 +1,57 @@
+from flask import g, request
+
+from app.services import tracing
+
+_tracer = tracing.get_tracer("app.http")
+
+
+def start_request_span():
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+    # continua o trace de quem chamou (frontend, gateway) se vier traceparent válido
+    parent = tracing.extract(request.headers)
+    attributes = {
+        "http.request.method": request.method,
+        "http.route": route,
+        "url.path": request.path,
+        "client.address": request.remote_addr,
+    }
+    span = _tracer.start_span(
+        f"{request.method} {route}",
+        context=parent,
+        kind=tracing.SpanKind.SERVER,
+        attributes={k: v for k, v in attributes.items() if v is not None},
+    )
+    g.trace_span = span
+    g.trace_token = tracing.activate(span, parent)
+    g.trace_id = tracing.current_trace_id()
+
+
+def finish_request_span(response):
+    span = g.get("trace_span")
+    if span is not None:
+        span.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_status(tracing.StatusCode.ERROR)
+        response.headers["X-Trace-Id"] = g.trace_id
+        tracing.inject(response.headers)
+    return response
+
+
+def end_request_span(exc=None):
+    span = g.pop("trace_span", None)
+    if span is None:
+        return
+    if exc is not None:
+        span.record_exception(exc)
+        span.set_status(tracing.StatusCode.ERROR, type(exc).__name__)
+    span.end()
+    tracing.deactivate(g.pop("trace_token"))
+
+
+def register_tracing(app):
+    """Registrar antes dos demais hooks: o span da requisição envolve todos eles."""
+    if not tracing.TRACING_ENABLED:
+        return
+    app.before_request(start_request_span)
+    app.after_request(finish_request_span)
+    app.teardown_request(end_request_span)
@@ -0,0 +1,24 @@
+from app.extensions import db
+from datetime import datetime
+import uuid
+
+
+class ContactImportJob(db.Model):
+    __tablename__ = "contact_import_jobs"
+
+    id = db.Column(db.String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    owner = db.Column(db.String(255), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default="running")
+    format = db.Column(db.String(10), nullable=False)
+    rows_read = db.Column(db.Integer, nullable=False, default=0)
+    # maior linha N tal que todas as linhas <= N já foram processadas (ponto de retomada)
+    rows_committed = db.Column(db.Integer, nullable=False, default=0)
+    # JSON: linhas > rows_committed enviadas sem confirmação; na retomada só elas (e as > rows_read) são reenviadas
+    rows_pending = db.Column(db.Text, nullable=True)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    invalid = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,20 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class GraphSubscription(db.Model):
+    __tablename__ = "graph_subscriptions"
+
+    # id devolvido pelo Graph
+    id = db.Column(db.String(255), primary_key=True)
+    owner = db.Column(db.String(255), nullable=False, index=True)
+    # contacts | mail
+    category = db.Column(db.String(20), nullable=False)
+    resource = db.Column(db.Text, nullable=False)
+    client_state = db.Column(db.String(255), nullable=False)
+    # active | reauthorization_required | removed
+    status = db.Column(db.String(30), nullable=False, default="active")
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    renewed_at = db.Column(db.DateTime, nullable=True)
+    last_notification_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,36 @@
+from app.extensions import db
+from datetime import datetime
+import uuid
+
+
+class MailDispatchJob(db.Model):
+    __tablename__ = "mail_dispatch_jobs"
+    __table_args__ = (db.UniqueConstraint("owner", "idempotency_key", name="uq_mail_dispatch_jobs_owner_key"),)
+
+    id = db.Column(db.String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    owner = db.Column(db.String(255), nullable=False, index=True)
+    idempotency_key = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    total = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class MailDispatchMessage(db.Model):
+    __tablename__ = "mail_dispatch_messages"
+
+    id = db.Column(db.String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    job_id = db.Column(db.String, db.ForeignKey("mail_dispatch_jobs.id"), nullable=False, index=True)
+    owner = db.Column(db.String(255), nullable=False, index=True)
+    to_address = db.Column(db.String(320), nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    body_html = db.Column(db.Text, nullable=False)
+    # pending -> sending -> sent | failed ("sending" sobrevive a um crash e é reconciliado)
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    draft_id = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,27 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class MailIndexEntry(db.Model):
+    __tablename__ = "mail_index"
+    __table_args__ = (db.UniqueConstraint("owner", "message_id", name="uq_mail_index_owner_message"),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    owner = db.Column(db.String(255), nullable=False, index=True)
+    folder = db.Column(db.String(50), nullable=False)
+    message_id = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.Text, nullable=True)
+    sender = db.Column(db.Text, nullable=True)
+    recipients = db.Column(db.Text, nullable=True)
+    body_preview = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, nullable=True, index=True)
+    indexed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MailSyncState(db.Model):
+    __tablename__ = "mail_sync_state"
+
+    owner = db.Column(db.String(255), primary_key=True)
+    folder = db.Column(db.String(50), primary_key=True)
+    delta_link = db.Column(db.Text, nullable=True)
+    synced_at = db.Column(db.DateTime, nullable=True)
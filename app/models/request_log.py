@@ -12,4 +12,6 @@ class RequestLog(db.Model):
     ip = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     ms_email = db.Column(db.String(255), nullable=True)
-    message = db.Column(db.Text, nullable=True)
\ No newline at end of file
+    message = db.Column(db.Text, nullable=True)
+    # liga a linha ao trace exportado (TRACING_FILE / coletor)
+    trace_id = db.Column(db.String(32), nullable=True, index=True)
\ No newline at end of file
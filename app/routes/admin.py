@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import os
+
+from flask import Blueprint, jsonify, request, send_file
+from app.swagger import swag_from
+
+from app.middleware.admin_auth import require_admin
+from app.services import memory_diag, profiler
+
+bp = Blueprint("admin", __name__)
+bp.before_request(require_admin)
+
+ADMIN_HEADER = {"in": "header", "name": "X-Admin-Token", "schema": {"type": "string"}, "required": True,
+                "description": "Token administrativo (ADMIN_TOKEN)"}
+
+
+@bp.get("/profiles")
+@swag_from({
+  "summary": "Lista as capturas de profiling (mais recentes primeiro)",
+  "tags": ["Admin"],
+  "parameters": [ADMIN_HEADER],
+  "responses": {"200": {"description": "Capturas e estado do profiler"}, "401": {"description": "Token inválido"}}
+})
+def list_profiles():
+    return jsonify({
+        "enabled": profiler.PROFILE_ENABLED,
+        "mode": profiler.PROFILE_MODE,
+        "sample_rate": profiler.PROFILE_SAMPLE_RATE,
+        "paths": list(profiler.PROFILE_PATHS),
+        "armed_until": profiler.armed_until() or None,
+        "items": profiler.list_captures(),
+    })
+
+
+@bp.get("/profiles/<name>")
+@swag_from({
+  "summary": "Baixa uma captura (.collapsed para flamegraph/speedscope, .prof para pstats/snakeviz)",
+  "tags": ["Admin"],
+  "parameters": [ADMIN_HEADER, {"in": "path", "name": "name", "schema": {"type": "string"}, "required": True}],
+  "responses": {"200": {"description": "Arquivo da captura"}, "404": {"description": "Captura inexistente"}}
+})
+def get_profile(name):
+    path = profiler.capture_path(name)
+    if path is None:
+        return jsonify({"error": "not_found", "message": "Captura não encontrada."}), 404
+    mimetype = "text/plain" if name.endswith(".collapsed") else "application/octet-stream"
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=name)
+
+
+@bp.post("/profiles/arm")
+@swag_from({
+  "summary": "Liga o profiling de todas as requisições de PROFILE_PATHS por N segundos (0 desliga)",
+  "tags": ["Admin"],
+  "parameters": [ADMIN_HEADER],
+  "requestBody": {
+    "required": False,
+    "content": {"application/json": {"schema": {"type": "object", "properties": {"seconds": {"type": "number"}}},
+                                     "example": {"seconds": 60}}}
+  },
+  "responses": {"200": {"description": "Prazo da ativação"}, "400": {"description": "Parâmetro inválido"},
+                "409": {"description": "PROFILE_ENABLED desligado"}}
+})
+def arm_profiles():
+    if not profiler.PROFILE_ENABLED:
+        return jsonify({"error": "profiler_disabled",
+                        "message": "Defina PROFILE_ENABLED=true para registrar os hooks de profiling."}), 409
+    body = request.get_json(silent=True) or {}
+    seconds = body.get("seconds", 60)
+    if not isinstance(seconds, (int, float)) or isinstance(seconds, bool) or not 0 <= seconds <= 3600:
+        return jsonify({"error": "validation_error", "message": "seconds deve ser um número entre 0 e 3600."}), 400
+    until = profiler.arm(float(seconds))
+    return jsonify({"armed_until": until or None})
+
+
+# =========================
+# Memória (tracemalloc): ligar/desligar e snapshots valem para todos os workers (MEMORY_DIR);
+# RSS e memória rastreada são do worker que respondeu (campo pid)
+# =========================
+def _group_and_limit():
+    group_by = request.args.get("group_by", "lineno")
+    if group_by not in memory_diag.GROUP_BY:
+        return None, None, (jsonify({"error": "validation_error",
+                                     "message": f"group_by deve ser um de: {', '.join(memory_diag.GROUP_BY)}."}), 400)
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 200)
+    except ValueError:
+        return None, None, (jsonify({"error": "validation_error", "message": "limit deve ser inteiro."}), 400)
+    return group_by, limit, None
+
+
+def _snapshot_not_found(sid):
+    return jsonify({"error": "not_found",
+                    "message": f"Snapshot {sid} não encontrado (pode ter sido descartado: MEMORY_MAX_SNAPSHOTS)."}), 404
+
+
+@bp.get("/memory")
+@swag_from({
+  "summary": "Estado da memória do worker (RSS, tracemalloc) e snapshots de todos os workers",
+  "tags": ["Admin"],
+  "parameters": [ADMIN_HEADER],
+  "responses": {"200": {"description": "Estado"}}
+})
+def memory_status():
+    return jsonify(memory_diag.status())
+
+
+@bp.post("/memory/tracemalloc")
+@swag_from({
+  "summary": "Liga ou desliga o tracemalloc em todos os workers (cada um aplica na próxima requisição)",
+  "tags": ["Admin"],
+  "parameters": [ADMIN_HEADER],
+  "requestBody": {
+    "required": True,
+    "content": {"application/json": {"schema": {"type": "object", "properties": {
+      "action": {"type": "string", "enum": ["start", "stop"]}, "frames": {"type": "integer"}}},
+      "example": {"action": "start", "frames": 10}}}
+  },
+  "responses": {"200": {"description": "Estado"}, "400": {"description": "Parâmetro inválido"}}
+})
+def memory_tracemalloc():
+    body = request.get_json(silent=True) or {}
+    action = body.get("action")
+    frames = body.get("frames", memory_diag.MEMORY_TRACE_FRAMES)
+    if action not in ("start", "stop") or not isinstance(frames, int) or not 1 <= frames <= 100:
+        return jsonify({"error": "validation_error",
+                        "message": "action deve ser 'start' ou 'stop'; frames entre 1 e 100."}), 400
+    memory_diag.set_tracing(action == "start", frames)
+    return jsonify(memory_diag.status())
+
+
+@bp.post("/memory/snapshots")
+@swag_from({
+  "summary": "Snapshot do tracemalloc neste worker; os demais gravam o seu na próxima requisição",
+  "tags": ["Admin"],
+  "parameters": [ADMIN_HEADER],
+  "requestBody": {
+    "required": False,
+    "content": {"application/json": {"schema": {"type": "object", "properties": {"label": {"type": "string"}}},
+                                     "example": {"label": "depois de 1000 /mail/inbox"}}}
+  },
+  "responses": {"201": {"description": "Snapshot"}, "409": {"description": "tracemalloc desligado"}}
+})
+def memory_take_snapshot():
+    body = request.get_json(silent=True) or {}
+    try:
+        snap = memory_diag.request_snapshots(str(body.get("label") or "")[:200])
+    except RuntimeError as e:
+        return jsonify({"error": "tracemalloc_off", "message": str(e)}), 409
+    return jsonify(snap), 201
+
+
+@bp.get("/memory/snapshots/<sid>")
+@swag_from({
+  "summary": "Maiores alocadores vivos no snapshot",
+  "tags": ["Admin"],
+  "parameters": [
+    ADMIN_HEADER,
+    {"in": "path", "name": "sid", "schema": {"type": "string"}, "required": True},
+    {"in": "query", "name": "group_by", "schema": {"type": "string", "enum": ["lineno", "filename", "traceback"]}},
+    {"in": "query", "name": "limit", "schema": {"type": "integer"}},
+  ],
+  "responses": {"200": {"description": "Alocadores"}, "404": {"description": "Snapshot inexistente"}}
+})
+def memory_snapshot_top(sid):
+    group_by, limit, err = _group_and_limit()
+    if err:
+        return err
+    try:
+        return jsonify(memory_diag.top(sid, group_by, limit))
+    except memory_diag.SnapshotNotFound:
+        return _snapshot_not_found(sid)
+
+
+@bp.get("/memory/compare")
+@swag_from({
+  "summary": "Diferença entre dois snapshots (o que cresceu de 'a' para 'b')",
+  "tags": ["Admin"],
+  "parameters": [
+    ADMIN_HEADER,
+    {"in": "query", "name": "a", "schema": {"type": "string"}, "required": True},
+    {"in": "query", "name": "b", "schema": {"type": "string"}, "required": True},
+    {"in": "query", "name": "group_by", "schema": {"type": "string", "enum": ["lineno", "filename", "traceback"]}},
+    {"in": "query", "name": "limit", "schema": {"type": "integer"}},
+  ],
+  "responses": {"200": {"description": "Diferença"}, "404": {"description": "Snapshot inexistente"}}
+})
+def memory_compare():
+    group_by, limit, err = _group_and_limit()
+    if err:
+        return err
+    a, b = request.args.get("a", ""), request.args.get("b", "")
+    try:
+        return jsonify(memory_diag.compare(a, b, group_by, limit))
+    except memory_diag.SnapshotNotFound as e:
+        return _snapshot_not_found(e.args[0])
+
+
+@bp.get("/memory/objects")
+@swag_from({
+  "summary": "Contagem de objetos por tipo (percorre o heap: pode levar centenas de ms)",
+  "tags": ["Admin"],
+  "parameters": [ADMIN_HEADER, {"in": "query", "name": "limit", "schema": {"type": "integer"}}],
+  "responses": {"200": {"description": "Tipos mais numerosos"}}
+})
+def memory_objects():
+    _, limit, err = _group_and_limit()
+    if err:
+        return err
+    return jsonify({"pid": os.getpid(), "rss_bytes": memory_diag.rss_bytes(),
+                    "items": memory_diag.object_counts(limit)})
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from flask import Blueprint, request, jsonify
-from flasgger import swag_from
+from app.swagger import swag_from
 from app.services.ai_chat import ai_chat
 
 bp = Blueprint("ai", __name__)
@@ -1,18 +1,46 @@
 from __future__ import annotations
-from flask import Blueprint, request, jsonify, session
-from flasgger import swag_from
-from typing import Any, Dict, List
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from flask import Blueprint, Response, current_app, request, jsonify, session
+from app.swagger import swag_from
+from typing import Any, Dict, Iterator, List, Tuple
 
+from app.services import tracing
+from app.services.agent_prefetch import Prefetcher
+from app.services.ai_plan_graph import PlanReferenceError, resolve_refs, step_dependencies
 from app.services.ai_toolplanner import plan_action
+from app.services.ai_validation import MULTI_STEP_ACTION, validate_step_params
+from app.services.html_text import MAIL_TEXT_MAX_CHARS, body_as_text
+from app.services.mail_index import (
+    MAIL_INDEX_ENABLED,
+    search_mail_index,
+    sync_mail_index,
+)
+from app.services.mail_summary import summarize_inbox, summarize_messages
 from app.services.ms_oauth import (
     graph_get,
     create_contact as graph_create_contact,
     send_email as graph_send_email,
     list_sent_emails as graph_list_sent,
+    resolve_owner,
 )
 
 bp = Blueprint("ai_agent", __name__)
 
+AGENT_MAX_PARALLEL_STEPS = int(os.getenv("AGENT_MAX_PARALLEL_STEPS", "4"))
+AGENT_STEP_TIMEOUT = float(os.getenv("AGENT_STEP_TIMEOUT", "30"))
+AGENT_BATCH_MAX_ITEMS = int(os.getenv("AGENT_BATCH_MAX_ITEMS", "100"))
+AGENT_BATCH_CONCURRENCY = int(os.getenv("AGENT_BATCH_CONCURRENCY", "4"))
+PREFETCH_CONTACTS_TOP = 100
+# ações sem efeito colateral: no lote, leituras idênticas são feitas uma vez só
+READ_ACTIONS = {"list_contacts", "get_contact", "list_inbox", "list_sent", "search_mail", "summarize_inbox",
+                "get_message_detail"}
+PREFETCH_INBOX_TOP = 25
+
 def _get_ms_access_token_from_request() -> str | None:
     auth_header = request.headers.get("Authorization", "")
     if auth_header.lower().startswith("bearer "):
@@ -40,6 +68,30 @@ def _flatten_contacts(access_token: str, top: int = 200) -> List[Dict[str, Any]]
         })
     return items
 
+def _list_inbox(access_token: str, top: int = 25) -> Dict[str, Any]:
+    return graph_get(
+        "/me/mailFolders/Inbox/messages",
+        access_token,
+        params={
+            "$top": str(top),
+            "$select": "id,subject,from,receivedDateTime,bodyPreview,toRecipients,isRead,webLink",
+            "$orderby": "receivedDateTime desc"
+        }
+    )
+
+def _slice_inbox(data: Dict[str, Any], top: int) -> Dict[str, Any]:
+    out = {k: v for k, v in data.items() if k != "@odata.nextLink"}
+    out["value"] = (data.get("value") or [])[:top]
+    return out
+
+def _prefetch_fetchers(access_token: str) -> Dict[str, tuple]:
+    """Leituras especulativas: as mesmas chamadas que o executor faria com os tops padrão."""
+    return {
+        "contacts": (PREFETCH_CONTACTS_TOP, lambda: _flatten_contacts(access_token, top=PREFETCH_CONTACTS_TOP),
+                     lambda items, top: items[:top]),
+        "inbox": (PREFETCH_INBOX_TOP, lambda: _list_inbox(access_token, top=PREFETCH_INBOX_TOP), _slice_inbox),
+    }
+
 def _filter_by_domain(items: List[Dict[str, Any]], domain: str) -> List[Dict[str, Any]]:
     domain = domain.lower().strip()
     out = []
@@ -105,88 +157,433 @@ def ai_agent():
             "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."
         }), 401
 
+    # leituras prováveis rodam em paralelo com o LLM; descartadas se o plano não usar
+    prefetch = Prefetcher.start(user_prompt, access_token, _prefetch_fetchers(access_token))
+    try:
+        return _plan_and_execute(user_prompt, access_token, prefetch)
+    finally:
+        prefetch.close()
+
+
+def _plan_and_execute(user_prompt: str, access_token: str, prefetch: Prefetcher | None = None):
     try:
         plan = plan_action(user_prompt)
     except Exception as e:
         return jsonify({"error": "planning_failed", "message": str(e)}), 400
+    if prefetch is not None:
+        prefetch.plan_ready()
+    payload, status = _execute_plan(plan, access_token, prefetch)
+    return jsonify(payload), status
+
 
+def _execute_plan(
+    plan: Dict[str, Any],
+    access_token: str,
+    prefetch: Prefetcher | None = None,
+    reads: "_SharedReads | None" = None,
+) -> Tuple[Dict[str, Any], int]:
+    """Executa um plano já validado; devolve (payload, status HTTP)."""
     action = plan.get("action")
     params = plan.get("params") or {}
 
     try:
-        if action == "list_contacts":
-            top = max(1, min(int(params.get("top") or 100), 999))
-            items = _flatten_contacts(access_token, top=top)
-            if params.get("domain"):
-                items = _filter_by_domain(items, params["domain"])
-            if params.get("query"):
-                items = _filter_by_query(items, params["query"])
-            result = {"count": len(items), "items": items}
-
-        elif action == "get_contact":
-            cid = params.get("contact_id")
-            if not cid:
-                return jsonify({"error": "validation_error", "message": "contact_id é obrigatório."}), 400
-            result = graph_get(
-                f"/me/contacts/{cid}",
-                access_token,
-                params={
-                    "$select": ",".join([
-                        "id","displayName","givenName","surname",
-                        "emailAddresses","businessPhones","homePhones","mobilePhone",
-                        "companyName","jobTitle","department","officeLocation",
-                        "imAddresses","birthday","personalNotes","categories",
-                        "createdDateTime","lastModifiedDateTime"
-                    ])
-                }
-            )
-
-        elif action == "create_contact":
-            created = graph_create_contact(
-                access_token,
-                givenName=params.get("givenName"),
-                surname=params.get("surname"),
-                email=params.get("email"),
-                businessPhones=params.get("businessPhones"),
-                extra=params.get("extra"),
-            )
-            result = created
-
-        elif action == "list_inbox":
-            top = max(1, min(int(params.get("top") or 25), 100))
-            result = graph_get(
-                "/me/mailFolders/Inbox/messages",
-                access_token,
-                params={
-                    "$top": str(top),
-                    "$select": "id,subject,from,receivedDateTime,bodyPreview,toRecipients,isRead,webLink",
-                    "$orderby": "receivedDateTime desc"
-                }
-            )
-
-        elif action == "list_sent":
-            top = max(1, min(int(params.get("top") or 25), 100))
-            result = graph_list_sent(access_token, top=top)
-
-        elif action == "send_mail":
-            subject = params.get("subject")
-            body_html = params.get("body_html")
-            to = params.get("to") or []
-            if not subject or not body_html or not isinstance(to, list) or not to:
-                return jsonify({"error": "validation_error",
-                                "message": "subject, body_html e to[] são obrigatórios."}), 400
-            result = graph_send_email(access_token, subject=subject, body_html=body_html, to_recipients=to)
-
+        if action == MULTI_STEP_ACTION:
+            result = _execute_steps(plan.get("steps") or [], access_token, prefetch)
+        elif reads is not None and action in READ_ACTIONS:
+            result = reads.run((action, json.dumps(params, sort_keys=True, default=str)),
+                               lambda: _execute_action(action, params, access_token, prefetch))
         else:
-            return jsonify({"error": "unknown_action", "plan": plan}), 400
+            result = _execute_action(action, params, access_token, prefetch)
+        return {"plan": plan, "result": result}, 200
 
-        return jsonify({"plan": plan, "result": result}), 200
+    except _ActionError as e:
+        payload = dict(e.payload)
+        if e.status == 400 and payload.get("error") == "unknown_action":
+            payload["plan"] = plan
+        return payload, e.status
 
     except Exception as e:
         msg = str(e)
         if "401" in msg or "Unauthorized" in msg:
-            return jsonify({
+            return {
                 "error": "ms_token_invalid_or_expired",
                 "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."
-            }), 401
-        return jsonify({"error": "execution_failed", "message": msg, "plan": plan}), 502
\ No newline at end of file
+            }, 401
+        return {"error": "execution_failed", "message": msg, "plan": plan}, 502
+
+
+class _ActionError(Exception):
+    """Erro de execução com resposta HTTP definida (ex.: validação -> 400)."""
+
+    def __init__(self, status: int, payload: Dict[str, Any]):
+        super().__init__(payload.get("message") or payload.get("error"))
+        self.status = status
+        self.payload = payload
+
+
+def _execute_action(action: str, params: Dict[str, Any], access_token: str, prefetch: Prefetcher | None = None) -> Any:
+    if action == "list_contacts":
+        top = max(1, min(int(params.get("top") or 100), 999))
+        items = prefetch.take("contacts", top) if prefetch is not None else None
+        if items is None:
+            items = _flatten_contacts(access_token, top=top)
+        if params.get("domain"):
+            items = _filter_by_domain(items, params["domain"])
+        if params.get("query"):
+            items = _filter_by_query(items, params["query"])
+        return {"count": len(items), "items": items}
+
+    if action == "get_contact":
+        cid = params.get("contact_id")
+        if not cid:
+            raise _ActionError(400, {"error": "validation_error", "message": "contact_id é obrigatório."})
+        return graph_get(
+            f"/me/contacts/{cid}",
+            access_token,
+            params={
+                "$select": ",".join([
+                    "id","displayName","givenName","surname",
+                    "emailAddresses","businessPhones","homePhones","mobilePhone",
+                    "companyName","jobTitle","department","officeLocation",
+                    "imAddresses","birthday","personalNotes","categories",
+                    "createdDateTime","lastModifiedDateTime"
+                ])
+            }
+        )
+
+    if action == "create_contact":
+        return graph_create_contact(
+            access_token,
+            givenName=params.get("givenName"),
+            surname=params.get("surname"),
+            email=params.get("email"),
+            businessPhones=params.get("businessPhones"),
+            extra=params.get("extra"),
+        )
+
+    if action == "list_inbox":
+        top = max(1, min(int(params.get("top") or 25), 100))
+        data = prefetch.take("inbox", top) if prefetch is not None else None
+        return data if data is not None else _list_inbox(access_token, top=top)
+
+    if action == "list_sent":
+        top = max(1, min(int(params.get("top") or 25), 100))
+        return graph_list_sent(access_token, top=top)
+
+    if action == "search_mail":
+        if not MAIL_INDEX_ENABLED:
+            raise _ActionError(503, {"error": "mail_index_disabled",
+                                     "message": "Índice local de e-mails desabilitado (MAIL_INDEX_ENABLED)."})
+        owner = resolve_owner(access_token)
+        sync = sync_mail_index(access_token, owner)
+        top = max(1, min(int(params.get("top") or 25), 100))
+        result = search_mail_index(owner, params.get("query") or "", limit=top)
+        # sync.incomplete: o índice ainda está sendo preenchido e o resultado pode estar parcial
+        result["sync"] = sync
+        return result
+
+    if action == "summarize_inbox":
+        top = max(1, min(int(params.get("top") or 20), 50))
+        return summarize_inbox(access_token, resolve_owner(access_token), top=top,
+                               unread_only=bool(params.get("unread_only")))
+
+    if action == "get_message_detail":
+        mid = params.get("message_id")
+        if not mid:
+            raise _ActionError(400, {"error": "validation_error", "message": "message_id é obrigatório."})
+        select_fields = ["id", "subject", "from", "toRecipients", "ccRecipients", "conversationId",
+                         "receivedDateTime", "isRead", "bodyPreview", "webLink"]
+        # o modelo nunca recebe o HTML bruto por padrão: texto limpo e limitado (MAIL_TEXT_MAX_CHARS)
+        body_format = (params.get("body_format") or "text") if params.get("include_body") else ""
+        if body_format:
+            select_fields += ["body", "lastModifiedDateTime"]
+        data = graph_get(f"/me/messages/{mid}", access_token, params={"$select": ",".join(select_fields)})
+        if body_format in ("text", "summary"):
+            data["body"] = body_as_text(data.get("body"))
+        if body_format == "summary":
+            summary = summarize_messages(resolve_owner(access_token), [data],
+                                         texts={data.get("id"): data["body"]["content"]}, overview=False,
+                                         source=f"body:{MAIL_TEXT_MAX_CHARS}")
+            data["body"] = {"contentType": "summary", "content": summary["items"][0]["summary"]}
+        return data
+
+    if action == "send_mail":
+        subject = params.get("subject")
+        body_html = params.get("body_html")
+        to = params.get("to") or []
+        if not subject or not body_html or not isinstance(to, list) or not to:
+            raise _ActionError(400, {"error": "validation_error",
+                                     "message": "subject, body_html e to[] são obrigatórios."})
+        return graph_send_email(access_token, subject=subject, body_html=body_html, to_recipients=to)
+
+    raise _ActionError(400, {"error": "unknown_action", "message": f"Ação não suportada: {action}"})
+
+
+def _run_step(app, step: Dict[str, Any], params: Dict[str, Any], access_token: str, prefetch: Prefetcher | None) -> Any:
+    with app.app_context():
+        return _execute_action(step["action"], params, access_token, prefetch)
+
+
+def _execute_steps(steps: List[Dict[str, Any]], access_token: str, prefetch: Prefetcher | None = None) -> Dict[str, Any]:
+    """
+    Executa um plano multi-passo como DAG: passos cujas dependências já terminaram
+    rodam em paralelo (até AGENT_MAX_PARALLEL_STEPS); leituras têm AGENT_STEP_TIMEOUT,
+    escritas são aguardadas até o fim (limitadas pelos timeouts HTTP).
+    Falha ou timeout de um passo marca seus dependentes como 'skipped'; passos
+    independentes seguem normalmente.
+    """
+    app = current_app._get_current_object()
+    deps = {s["id"]: step_dependencies(s) for s in steps}
+    by_id = {s["id"]: s for s in steps}
+    outputs: Dict[str, Any] = {}
+    report: Dict[str, Dict[str, Any]] = {}
+    running: Dict[Future, tuple] = {}
+    pending = [s["id"] for s in steps]
+
+    def settle(sid: str, status: str, **extra: Any) -> None:
+        report[sid] = {"action": by_id[sid]["action"], "status": status, **extra}
+
+    pool = ThreadPoolExecutor(max_workers=AGENT_MAX_PARALLEL_STEPS)
+    try:
+        while pending or running:
+            for sid in list(pending):
+                if any(d in report and report[d]["status"] != "ok" for d in deps[sid]):
+                    pending.remove(sid)
+                    settle(sid, "skipped", error="dependência falhou")
+                    continue
+                if not all(d in outputs for d in deps[sid]):
+                    continue
+                pending.remove(sid)
+                try:
+                    resolved = resolve_refs(by_id[sid]["params"], outputs)
+                except PlanReferenceError as e:
+                    settle(sid, "error", error=str(e))
+                    continue
+                ok, msg, clean = validate_step_params(by_id[sid]["action"], resolved)
+                if not ok:
+                    settle(sid, "error", error=msg)
+                    continue
+                fut = pool.submit(tracing.wrap(_run_step), app, by_id[sid], clean, access_token, prefetch)
+                # escritas não têm prazo: uma thread não pode ser interrompida, e reportar "timeout"
+                # de um send_mail que ainda vai acontecer engana o cliente; o limite delas são os
+                # timeouts HTTP do Graph/Gemini (GRAPH_READ_TIMEOUT, GEMINI_READ_TIMEOUT)
+                deadline = time.monotonic() + AGENT_STEP_TIMEOUT if by_id[sid]["action"] in READ_ACTIONS else math.inf
+                running[fut] = (sid, deadline, clean)
+
+            if not running:
+                if pending and not any(
+                    all(d in outputs for d in deps[sid]) for sid in pending
+                ):
+                    # nada executável restante (deveria ser impossível após check_dag)
+                    for sid in pending:
+                        settle(sid, "skipped", error="dependências não satisfeitas")
+                    pending.clear()
+                continue
+
+            nearest = min(deadline for _, deadline, _ in running.values())
+            timeout = None if nearest == math.inf else max(0.0, nearest - time.monotonic())
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for fut in done:
+                sid, _, clean = running.pop(fut)
+                try:
+                    outputs[sid] = fut.result()
+                    settle(sid, "ok", params=clean, result=outputs[sid])
+                except _ActionError as e:
+                    settle(sid, "error", params=clean, error=e.payload.get("message") or e.payload.get("error"))
+                except Exception as e:
+                    settle(sid, "error", params=clean, error=str(e))
+            for fut, (sid, deadline, clean) in list(running.items()):
+                if deadline <= now:
+                    # só leituras chegam aqui: a thread termina sozinha, sem efeito colateral
+                    running.pop(fut)
+                    settle(sid, "timeout", params=clean, error=f"passo excedeu {AGENT_STEP_TIMEOUT:g}s")
+    finally:
+        # não espera leituras que estouraram o prazo; escritas já terminaram (ou falharam) acima
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    ordered = [{"id": s["id"], **report[s["id"]]} for s in steps]
+    return {
+        "ok": all(r["status"] == "ok" for r in ordered),
+        "steps": ordered,
+    }
+
+
+# =========================
+# Lote de prompts
+# =========================
+class _SharedReads:
+    """Leituras idênticas dentro do lote: a primeira executa, as demais aguardam o mesmo resultado."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._futures: Dict[tuple, Future] = {}
+
+    def run(self, key: tuple, fn) -> Any:
+        with self._lock:
+            fut = self._futures.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._futures[key] = Future()
+        if owner:
+            try:
+                fut.set_result(fn())
+            except BaseException as e:
+                fut.set_exception(e)
+        return fut.result()
+
+
+def _batch_items() -> List[Dict[str, Any]]:
+    """
+    Aceita JSON (lista ou {"prompts": [...]}) ou NDJSON (uma linha por item).
+    Cada item é uma string ou {"prompt": "...", "id": "..."}.
+    """
+    ctype = (request.mimetype or "").lower()
+    raw: List[Any] = []
+    if ctype in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+        for n, line in enumerate(request.stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw.append(json.loads(line))
+            except ValueError:
+                raise ValueError(f"Linha {n} não é JSON válido.")
+            if len(raw) > AGENT_BATCH_MAX_ITEMS:
+                break
+    else:
+        body = request.get_json(silent=True)
+        raw = body.get("prompts") if isinstance(body, dict) else body
+        if not isinstance(raw, list):
+            raise ValueError("Envie uma lista de prompts (JSON ou NDJSON).")
+
+    if not raw:
+        raise ValueError("Nenhum prompt enviado.")
+    if len(raw) > AGENT_BATCH_MAX_ITEMS:
+        raise ValueError(f"Máximo de {AGENT_BATCH_MAX_ITEMS} prompts por lote.")
+
+    items = []
+    for i, it in enumerate(raw):
+        if isinstance(it, str):
+            it = {"prompt": it}
+        if not isinstance(it, dict):
+            raise ValueError(f"Item {i} inválido: use string ou objeto com 'prompt'.")
+        items.append({"index": i, "id": it.get("id"), "prompt": str(it.get("prompt") or "").strip()})
+    return items
+
+
+def _run_batch_prompt(app, prompt: str, access_token: str, reads: _SharedReads) -> Tuple[Dict[str, Any], int]:
+    with app.app_context():
+        try:
+            plan = plan_action(prompt)
+        except Exception as e:
+            return {"error": "planning_failed", "message": str(e)}, 400
+        return _execute_plan(plan, access_token, reads=reads)
+
+
+def _stream_batch(app, items: List[Dict[str, Any]], access_token: str) -> Iterator[str]:
+    # prompts idênticos são planejados e executados uma vez; o resultado vale para todos
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for it in items:
+        groups.setdefault(it["prompt"], []).append(it)
+
+    reads = _SharedReads()
+    ok = failed = 0
+    pool = ThreadPoolExecutor(max_workers=max(1, AGENT_BATCH_CONCURRENCY), thread_name_prefix="ai-batch")
+    try:
+        futures: Dict[Future, str] = {}
+        for prompt, members in groups.items():
+            if not prompt:
+                for it in members:
+                    failed += 1
+                    yield json.dumps({**it, "status": 400, "error": "validation_error",
+                                      "message": "Campo 'prompt' é obrigatório."}, ensure_ascii=False) + "\n"
+                continue
+            futures[pool.submit(tracing.wrap(_run_batch_prompt), app, prompt, access_token, reads)] = prompt
+
+        for fut in as_completed(futures):
+            try:
+                payload, status = fut.result()
+            except Exception as e:
+                payload, status = {"error": "execution_failed", "message": str(e)}, 502
+            members = groups[futures[fut]]
+            for n, it in enumerate(members):
+                line = {**it, "status": status, **payload}
+                if n:
+                    line["duplicate_of"] = members[0]["index"]
+                if status == 200:
+                    ok += 1
+                else:
+                    failed += 1
+                yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+    finally:
+        # cliente desconectou: não inicia o que ainda não começou
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    yield json.dumps({"done": True, "total": len(items), "unique_prompts": len(groups),
+                      "ok": ok, "failed": failed}) + "\n"
+
+
+@bp.post("/batch")
+@swag_from({
+  "summary": "Planeja e executa vários prompts em paralelo (resposta NDJSON)",
+  "description": "Corpo: lista JSON de prompts, {\"prompts\": [...]} ou NDJSON (application/x-ndjson). "
+                 "Cada linha da resposta traz index, id, status e plan/result ou error; a última linha "
+                 "traz o resumo ({\"done\": true, ...}). Prompts idênticos são executados uma vez só e "
+                 "leituras idênticas ao Graph são compartilhadas dentro do lote.",
+  "tags": ["AI Agent"],
+  "parameters": [
+    {
+      "in": "header",
+      "name": "Authorization",
+      "schema": {"type": "string"},
+      "required": False,
+      "description": "Access Token do Microsoft Graph (Bearer <token>)"
+    }
+  ],
+  "requestBody": {
+    "required": True,
+    "content": {
+      "application/json": {
+        "schema": {
+          "type": "object",
+          "properties": {
+            "prompts": {
+              "type": "array",
+              "items": {
+                "oneOf": [
+                  {"type": "string"},
+                  {"type": "object", "properties": {"id": {"type": "string"}, "prompt": {"type": "string"}}}
+                ]
+              }
+            }
+          }
+        },
+        "example": {"prompts": ["Liste 10 contatos do domínio gmail.com", {"id": "a1", "prompt": "Últimos 5 e-mails"}]}
+      },
+      "application/x-ndjson": {"schema": {"type": "string"}}
+    }
+  },
+  "responses": {
+    "200": {"description": "Stream NDJSON com um resultado por prompt"},
+    "400": {"description": "Entrada inválida"},
+    "401": {"description": "Token ausente"}
+  }
+})
+def ai_agent_batch():
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({
+            "error": "ms_not_authenticated",
+            "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."
+        }), 401
+    try:
+        items = _batch_items()
+    except ValueError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 400
+
+    app = current_app._get_current_object()
+    resp = Response(_stream_batch(app, items, access_token), mimetype="application/x-ndjson")
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
@@ -1,12 +1,28 @@
 from __future__ import annotations
 
-from flask import Blueprint, jsonify, request, session
-from flasgger import swag_from
+import json
 
+from flask import Blueprint, Response, current_app, jsonify, request, session, stream_with_context
+from app.swagger import swag_from
+
+from app.extensions import db
+from app.models.contact_import import ContactImportJob
+from app.services.contact_import import IMPORT_FORMATS, claim_job, iter_import, iter_rows, job_to_dict
+from app.services.json_codec import raw_json_response
 from app.services.ms_oauth import (
     fetch_contacts_grouped_by_domain,
     create_contact as graph_create_contact,
     graph_get,
+    graph_get_raw,
+    resolve_owner,
+)
+from app.services.pagination import (
+    CONTACT_FIELDS,
+    CursorError,
+    attach_next_cursor,
+    conditional_json,
+    decode_cursor,
+    parse_fields,
 )
 
 bp = Blueprint("contacts", __name__)
@@ -19,6 +35,9 @@ def _get_ms_access_token_from_request() -> str | None:
     return ms_token.get("access_token")
 
 
+CONTACTS_ENDPOINT = "/me/contacts"
+
+
 @bp.get("/")
 @swag_from({
   "summary": "Lista contatos do Microsoft 365 agrupados por domínio",
@@ -34,13 +53,71 @@ def _get_ms_access_token_from_request() -> str | None:
     {
       "in": "query",
       "name": "top",
-      "schema": {"type": "integer", "default": 100, "minimum": 1, "maximum": 999},
+      "schema": {"type": "integer", "default": 100, "minimum": 1, "maximum": 10000},
+      "required": False,
+      "description": "Quantidade máxima de contatos a ler do Graph, paginando se necessário (default 100)"
+    },
+    {
+      "in": "query",
+      "name": "view",
+      "schema": {"type": "string", "enum": ["full", "counts"], "default": "full"},
+      "required": False,
+      "description": "'counts' retorna apenas a quantidade de contatos por domínio"
+    },
+    {
+      "in": "query",
+      "name": "domain",
+      "schema": {"type": "string"},
+      "required": False,
+      "description": "Restringe o resultado a um único domínio (ex: gmail.com)"
+    },
+    {
+      "in": "query",
+      "name": "limit",
+      "schema": {"type": "integer", "minimum": 1, "maximum": 1000},
+      "required": False,
+      "description": "Se informado, retorna uma fatia paginada por domínio: { total, offset, limit, items }"
+    },
+    {
+      "in": "query",
+      "name": "offset",
+      "schema": {"type": "integer", "default": 0, "minimum": 0},
+      "required": False,
+      "description": "Deslocamento da fatia por domínio (usado com 'limit')"
+    },
+    {
+      "in": "query",
+      "name": "page_size",
+      "schema": {"type": "integer", "minimum": 1, "maximum": 999},
+      "required": False,
+      "description": "Modo paginado: retorna { value: [...], next_cursor } sem agrupar por domínio"
+    },
+    {
+      "in": "query",
+      "name": "cursor",
+      "schema": {"type": "string"},
+      "required": False,
+      "description": "Cursor opaco retornado em 'next_cursor' (modo paginado)"
+    },
+    {
+      "in": "query",
+      "name": "fields",
+      "schema": {"type": "string"},
       "required": False,
-      "description": "Quantidade máxima de contatos a retornar do Graph (default 100)"
+      "description": "Campos a retornar no modo paginado, separados por vírgula (allowlist)"
+    },
+    {
+      "in": "header",
+      "name": "If-None-Match",
+      "schema": {"type": "string"},
+      "required": False,
+      "description": "ETag de uma resposta anterior; retorna 304 se nada mudou"
     }
   ],
   "responses": {
-    "200": {"description": "Mapa domínio → lista de contatos"},
+    "200": {"description": "Mapa domínio → lista de contatos (ou contagem / fatia paginada / página com cursor)"},
+    "304": {"description": "Não modificado (ETag)"},
+    "400": {"description": "Parâmetros inválidos"},
     "401": {"description": "Token ausente ou inválido"},
     "502": {"description": "Falha ao consultar o Microsoft Graph"}
   }
@@ -53,10 +130,62 @@ def list_contacts():
             "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."
         }), 401
 
-    top = request.args.get("top", default=100, type=int) or 100
+    cursor = request.args.get("cursor")
+    page_size = request.args.get("page_size", type=int)
+    if cursor or page_size:
+        return _list_contacts_page(access_token, cursor, page_size or 100)
+
+    top = max(1, min(request.args.get("top", default=100, type=int) or 100, 10000))
+    view = (request.args.get("view") or "full").strip().lower()
+    if view not in ("full", "counts"):
+        return jsonify({"error": "validation_error", "message": "Parâmetro 'view' deve ser 'full' ou 'counts'."}), 400
+    domain = (request.args.get("domain") or "").strip() or None
+    limit = request.args.get("limit", type=int)
+    if limit is not None:
+        limit = max(1, min(limit, 1000))
+    offset = max(0, request.args.get("offset", default=0, type=int) or 0)
+
     try:
-        data = fetch_contacts_grouped_by_domain(access_token, top=top)
-        return jsonify(data)
+        data = fetch_contacts_grouped_by_domain(
+            access_token,
+            top=top,
+            counts_only=(view == "counts"),
+            offset=offset,
+            limit=limit,
+            domain=domain,
+        )
+        return conditional_json(data)
+    except Exception as e:
+        msg = str(e)
+        if "401" in msg or "Unauthorized" in msg:
+            return jsonify({
+                "error": "ms_token_invalid_or_expired",
+                "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."
+            }), 401
+        return jsonify({
+            "error": "graph_error",
+            "message": "Falha ao consultar o Microsoft Graph.",
+            "detail": msg
+        }), 502
+
+
+def _list_contacts_page(access_token: str, cursor: str | None, page_size: int):
+    select_param, err = parse_fields(
+        request.args.get("fields"), CONTACT_FIELDS, "id,displayName,emailAddresses"
+    )
+    if err:
+        return jsonify({"error": "validation_error", "message": err}), 400
+    try:
+        if cursor:
+            params = decode_cursor(cursor, CONTACTS_ENDPOINT, current_app.secret_key)
+        else:
+            params = {"$top": str(max(1, min(page_size, 999))), "$select": select_param, "$orderby": "displayName"}
+    except CursorError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 400
+
+    try:
+        data = graph_get(CONTACTS_ENDPOINT, access_token, params=params)
+        return conditional_json(attach_next_cursor(data, CONTACTS_ENDPOINT, current_app.secret_key))
     except Exception as e:
         msg = str(e)
         if "401" in msg or "Unauthorized" in msg:
@@ -161,6 +290,178 @@ def create_contact():
         }), 502
 
 
+def _import_format() -> str | None:
+    fmt = (request.args.get("format") or "").strip().lower()
+    if not fmt:
+        ctype = (request.mimetype or "").lower()
+        if ctype in ("text/csv", "application/csv"):
+            fmt = "csv"
+        elif ctype in ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"):
+            fmt = "ndjson"
+    return fmt if fmt in IMPORT_FORMATS else None
+
+
+@bp.post("/import")
+@swag_from({
+  "summary": "Importa contatos em massa (CSV ou NDJSON) via Graph $batch",
+  "description": "Resposta NDJSON: a primeira linha ({\"event\": \"job\", \"job_id\": ...}) sai antes do "
+                 "import começar; seguem linhas 'progress' e, no fim, 'done' ou 'error'. Se a conexão cair, "
+                 "acompanhe em GET /contacts/import/{job_id} e retome reenviando o arquivo com ?job_id=.",
+  "tags": ["Contacts"],
+  "parameters": [
+    {
+      "in": "header",
+      "name": "Authorization",
+      "schema": {"type": "string"},
+      "required": False,
+      "description": "Access Token do Microsoft Graph (Bearer <token>)"
+    },
+    {
+      "in": "query",
+      "name": "format",
+      "schema": {"type": "string", "enum": ["csv", "ndjson"]},
+      "required": False,
+      "description": "Formato do corpo; se omitido, deduzido do Content-Type (text/csv ou application/x-ndjson)"
+    },
+    {
+      "in": "query",
+      "name": "job_id",
+      "schema": {"type": "string"},
+      "required": False,
+      "description": "Retoma um import interrompido: reenvie o mesmo arquivo; linhas já processadas são puladas"
+    }
+  ],
+  "requestBody": {
+    "required": True,
+    "content": {
+      "text/csv": {
+        "schema": {"type": "string"},
+        "example": "givenName,surname,email,businessPhones,companyName\nFulano,da Silva,fulano@exemplo.com,+55 11 99999-0000,Conecta\n"
+      },
+      "application/x-ndjson": {
+        "schema": {"type": "string"},
+        "example": "{\"givenName\": \"Fulano\", \"email\": \"fulano@exemplo.com\"}\n"
+      }
+    }
+  },
+  "responses": {
+    "200": {"description": "Stream NDJSON com job_id, progresso e resumo final (criados, falhas, inválidas, erros)"},
+    "400": {"description": "Formato inválido"},
+    "401": {"description": "Token ausente ou inválido"},
+    "404": {"description": "job_id não encontrado"},
+    "409": {"description": "Job já concluído ou ainda em execução"}
+  }
+})
+def import_contacts():
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({
+            "error": "ms_not_authenticated",
+            "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."
+        }), 401
+
+    fmt = _import_format()
+    if not fmt:
+        return jsonify({
+            "error": "validation_error",
+            "message": "Formato não suportado. Use ?format=csv|ndjson ou Content-Type text/csv / application/x-ndjson."
+        }), 400
+
+    try:
+        owner = resolve_owner(access_token)
+    except Exception as e:
+        return jsonify({
+            "error": "ms_token_invalid_or_expired",
+            "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login.",
+            "detail": str(e)
+        }), 401
+
+    job_id = (request.args.get("job_id") or "").strip()
+    if job_id:
+        job = db.session.get(ContactImportJob, job_id)
+        if job is None or job.owner != owner:
+            return jsonify({"error": "not_found", "message": f"Job {job_id} não encontrado."}), 404
+        if job.status == "completed":
+            return jsonify({"error": "conflict", "message": "Job já concluído.", "job": job_to_dict(job)}), 409
+        if not claim_job(job_id, owner):
+            db.session.refresh(job)
+            return jsonify({"error": "conflict",
+                            "message": "Job ainda em execução; acompanhe em GET /contacts/import/<job_id>.",
+                            "job": job_to_dict(job)}), 409
+        db.session.refresh(job)
+    else:
+        job = ContactImportJob(owner=owner, format=fmt, status="running")
+        db.session.add(job)
+        db.session.commit()
+
+    rows = iter_rows(request.stream, fmt)
+
+    def generate():
+        # o job_id sai antes de qualquer trabalho: mesmo que o worker morra, o cliente pode retomar
+        yield json.dumps({"event": "job", **job_to_dict(job)}, ensure_ascii=False) + "\n"
+        try:
+            for progress in iter_import(job, rows, access_token):
+                yield json.dumps({"event": "progress", **progress}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            msg = str(e)
+            yield json.dumps({
+                "event": "error",
+                "error": "ms_token_invalid_or_expired" if ("401" in msg or "Unauthorized" in msg) else "import_interrupted",
+                "message": "Import interrompido; reenvie o arquivo com ?job_id= para retomar.",
+                "detail": msg,
+                **job_to_dict(job),
+            }, ensure_ascii=False) + "\n"
+            return
+        yield json.dumps({"event": "done", **job_to_dict(job)}, ensure_ascii=False) + "\n"
+
+    resp = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Job-Id"] = job.id
+    return resp
+
+
+@bp.get("/import/<job_id>")
+@swag_from({
+  "summary": "Status de um import de contatos",
+  "tags": ["Contacts"],
+  "parameters": [
+    {"in": "path", "name": "job_id", "schema": {"type": "string"}, "required": True},
+    {
+      "in": "header",
+      "name": "Authorization",
+      "schema": {"type": "string"},
+      "required": False,
+      "description": "Access Token do Microsoft Graph (Bearer <token>)"
+    }
+  ],
+  "responses": {
+    "200": {"description": "Progresso do job"},
+    "401": {"description": "Token ausente ou inválido"},
+    "404": {"description": "Job não encontrado"}
+  }
+})
+def import_status(job_id: str):
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({
+            "error": "ms_not_authenticated",
+            "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."
+        }), 401
+    try:
+        owner = resolve_owner(access_token)
+    except Exception:
+        return jsonify({
+            "error": "ms_token_invalid_or_expired",
+            "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."
+        }), 401
+
+    job = db.session.get(ContactImportJob, job_id)
+    if job is None or job.owner != owner:
+        return jsonify({"error": "not_found", "message": f"Job {job_id} não encontrado."}), 404
+    return jsonify(job_to_dict(job)), 200
+
+
 @bp.get("/<contact_id>")
 @swag_from({
   "summary": "Detalhes de um contato do Microsoft 365",
@@ -213,12 +514,13 @@ def get_contact_details(contact_id: str):
     select_param = request.args.get("$select", default_select)
 
     try:
-        data = graph_get(
+        # sem transformação: repassa os bytes do Graph (ou do cache) direto
+        data = graph_get_raw(
             f"/me/contacts/{contact_id}",
             access_token,
             params={"$select": select_param}
         )
-        return jsonify(data), 200
+        return raw_json_response(data)
     except Exception as e:
         msg = str(e)
         if "404" in msg or "Not Found" in msg:
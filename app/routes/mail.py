@@ -1,12 +1,53 @@
 from __future__ import annotations
 
-from flask import Blueprint, jsonify, request, session
-from flasgger import swag_from
+import requests
+from flask import Blueprint, Response, current_app, jsonify, request, send_file, session
+from app.swagger import swag_from
 
 from app.services.ms_oauth import (
     send_email as graph_send_email,
     list_sent_emails as graph_list_sent,
     graph_get,
+    graph_get_raw,
+    graph_open_stream,
+    resolve_owner,
+)
+from app.services.attachments import (
+    ATTACHMENT_CACHE_DIR,
+    ATTACHMENT_CHUNK_SIZE,
+    FILE_ATTACHMENT,
+    cache_lookup,
+    content_disposition,
+    get_attachment_meta,
+    iter_range,
+    list_attachments,
+    tee_to_cache,
+)
+from app.extensions import db
+from app.models.mail_dispatch import MailDispatchJob
+from app.services.mail_dispatch import (
+    MAIL_BULK_MAX_RECIPIENTS,
+    TemplateRenderError,
+    activate_job,
+    enqueue_job,
+    job_status,
+    render_bulk,
+)
+from app.services.html_text import BODY_FORMATS, MAIL_TEXT_MAX_CHARS, body_as_text
+from app.services.json_codec import raw_json_response
+from app.services.mail_index import (
+    MAIL_INDEX_ENABLED,
+    search_mail_index,
+    sync_mail_index,
+)
+from app.services.mail_summary import MAIL_SUMMARY_MAX_MESSAGES, summarize_inbox, summarize_messages
+from app.services.pagination import (
+    MESSAGE_FIELDS,
+    CursorError,
+    attach_next_cursor,
+    conditional_json,
+    decode_cursor,
+    parse_fields,
 )
 
 bp = Blueprint("mail", __name__)
@@ -19,6 +60,19 @@ def _get_ms_access_token_from_request() -> str | None:
     return ms_token.get("access_token")
 
 
+INBOX_ENDPOINT = "/me/mailFolders/Inbox/messages"
+SENT_ENDPOINT = "/me/mailFolders/SentItems/messages"
+
+PAGINATION_PARAMS = [
+    {"in": "query", "name": "cursor", "schema": {"type": "string"}, "required": False,
+     "description": "Cursor opaco retornado em 'next_cursor' da página anterior"},
+    {"in": "query", "name": "fields", "schema": {"type": "string"}, "required": False,
+     "description": "Campos a retornar, separados por vírgula (validados contra allowlist)"},
+    {"in": "header", "name": "If-None-Match", "schema": {"type": "string"}, "required": False,
+     "description": "ETag de uma resposta anterior; retorna 304 se nada mudou"},
+]
+
+
 @bp.post("/send")
 @swag_from({
   "summary": "Envia um e-mail em nome do usuário autenticado (Microsoft 365)",
@@ -36,7 +90,9 @@ def _get_ms_access_token_from_request() -> str | None:
           "properties": {
             "subject": {"type": "string"},
             "body_html": {"type": "string"},
-            "to": {"type": "array", "items": {"type": "string"}}
+            "to": {"type": "array", "items": {"type": "string"}},
+            "queue": {"type": "boolean", "default": False,
+                      "description": "Se true, enfileira o envio (fila persistente) e responde na hora com o job_id"}
           },
           "required": ["subject", "body_html", "to"]
         },
@@ -70,6 +126,10 @@ def send_mail():
         return jsonify({"error": "validation_error",
                         "message": "Campos obrigatórios: subject, body_html, to (array com pelo menos 1 email)."}), 400
 
+    if body.get("queue") is True:
+        # um job com um destinatário por mensagem, como no envio em massa
+        return _enqueue(access_token, [(r, subject, body_html) for r in to], body.get("idempotency_key"))
+
     try:
         res = graph_send_email(access_token, subject=subject, body_html=body_html, to_recipients=to)
         return jsonify(res), 202
@@ -83,6 +143,164 @@ def send_mail():
                         "detail": msg}), 502
 
 
+def _enqueue(access_token: str, rendered, idempotency_key=None):
+    idempotency_key = (request.headers.get("Idempotency-Key") or idempotency_key or "").strip() or None
+    try:
+        owner = resolve_owner(access_token)
+    except Exception as e:
+        return jsonify({"error": "ms_token_invalid_or_expired",
+                        "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login.",
+                        "detail": str(e)}), 401
+
+    job, created = enqueue_job(owner, rendered, idempotency_key=idempotency_key)
+    if job.status != "completed":
+        activate_job(current_app._get_current_object(), job.id, access_token)
+    return jsonify({**job_status(job), "created": created}), 202
+
+
+@bp.post("/send-bulk")
+@swag_from({
+  "summary": "Envio em massa (mail-merge) via fila persistente com limite por caixa",
+  "tags": ["Mail"],
+  "parameters": [
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"},
+    {"in": "header", "name": "Idempotency-Key", "schema": {"type": "string"}, "required": False,
+     "description": "Reenvios com a mesma chave devolvem o job existente em vez de enfileirar de novo"}
+  ],
+  "requestBody": {
+    "required": True,
+    "content": {
+      "application/json": {
+        "schema": {
+          "type": "object",
+          "properties": {
+            "subject": {"type": "string", "description": "Template Jinja2 do assunto"},
+            "body_html": {"type": "string", "description": "Template Jinja2 do corpo (variáveis são escapadas)"},
+            "recipients": {
+              "type": "array",
+              "items": {
+                "type": "object",
+                "properties": {"email": {"type": "string"}, "vars": {"type": "object"}}
+              }
+            },
+            "idempotency_key": {"type": "string"}
+          },
+          "required": ["subject", "body_html", "recipients"]
+        },
+        "example": {
+          "subject": "Olá {{ nome }}, sua fatura chegou",
+          "body_html": "<p>Oi {{ nome }},</p><p>O valor é {{ valor }}.</p>",
+          "recipients": [
+            {"email": "ana@exemplo.com", "vars": {"nome": "Ana", "valor": "R$ 10"}},
+            {"email": "bruno@exemplo.com", "vars": {"nome": "Bruno", "valor": "R$ 20"}}
+          ]
+        }
+      }
+    }
+  },
+  "responses": {
+    "202": {"description": "Job enfileirado (job_id e contadores)"},
+    "400": {"description": "Payload ou template inválido"},
+    "401": {"description": "Token ausente ou inválido"}
+  }
+})
+def send_bulk():
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({"error": "ms_not_authenticated",
+                        "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
+
+    body = request.get_json(silent=True) or {}
+    subject = body.get("subject") or ""
+    body_html = body.get("body_html") or ""
+    recipients = body.get("recipients") or []
+    if not subject.strip() or not body_html or not isinstance(recipients, list) or not recipients:
+        return jsonify({"error": "validation_error",
+                        "message": "Campos obrigatórios: subject, body_html, recipients (array não vazio)."}), 400
+    if len(recipients) > MAIL_BULK_MAX_RECIPIENTS:
+        return jsonify({"error": "validation_error",
+                        "message": f"Máximo de {MAIL_BULK_MAX_RECIPIENTS} destinatários por job."}), 400
+
+    try:
+        rendered = render_bulk(subject, body_html, recipients)
+    except TemplateRenderError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 400
+
+    return _enqueue(access_token, rendered, body.get("idempotency_key"))
+
+
+def _owned_dispatch_job(job_id: str, access_token: str):
+    try:
+        owner = resolve_owner(access_token)
+    except Exception:
+        return None, (jsonify({"error": "ms_token_invalid_or_expired",
+                               "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."}), 401)
+    job = db.session.get(MailDispatchJob, job_id)
+    if job is None or job.owner != owner:
+        return None, (jsonify({"error": "not_found", "message": f"Job {job_id} não encontrado."}), 404)
+    return job, None
+
+
+@bp.get("/jobs/<job_id>")
+@swag_from({
+  "summary": "Status de um job de envio (fila)",
+  "tags": ["Mail"],
+  "parameters": [
+    {"in": "path", "name": "job_id", "schema": {"type": "string"}, "required": True},
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"}
+  ],
+  "responses": {
+    "200": {"description": "Contadores por estado (pending, sending, sent, failed) e erros"},
+    "401": {"description": "Token ausente ou inválido"},
+    "404": {"description": "Job não encontrado"}
+  }
+})
+def dispatch_job_status(job_id: str):
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({"error": "ms_not_authenticated",
+                        "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
+    job, err = _owned_dispatch_job(job_id, access_token)
+    if err:
+        return err
+    return jsonify(job_status(job)), 200
+
+
+@bp.post("/jobs/<job_id>/resume")
+@swag_from({
+  "summary": "Retoma um job de envio pausado (token expirado ou processo reiniciado)",
+  "tags": ["Mail"],
+  "parameters": [
+    {"in": "path", "name": "job_id", "schema": {"type": "string"}, "required": True},
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"}
+  ],
+  "responses": {
+    "202": {"description": "Job reativado"},
+    "401": {"description": "Token ausente ou inválido"},
+    "404": {"description": "Job não encontrado"},
+    "409": {"description": "Job já concluído"}
+  }
+})
+def resume_dispatch_job(job_id: str):
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({"error": "ms_not_authenticated",
+                        "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
+    job, err = _owned_dispatch_job(job_id, access_token)
+    if err:
+        return err
+    if job.status == "completed":
+        return jsonify({"error": "conflict", "message": "Job já concluído.", "job": job_status(job)}), 409
+    if job.status == "paused":
+        job.status = "running"
+        db.session.commit()
+    activate_job(current_app._get_current_object(), job.id, access_token)
+    return jsonify(job_status(job)), 202
+
+
 @bp.get("/inbox")
 @swag_from({
   "summary": "Lista e-mails da caixa de entrada (Inbox) do usuário",
@@ -91,12 +309,15 @@ def send_mail():
     {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
      "description": "Access Token do Microsoft Graph (Bearer <token>)"},
     {"in": "query", "name": "top", "schema": {"type": "integer", "default": 25, "minimum": 1, "maximum": 100},
-     "required": False, "description": "Quantidade de mensagens (1-100)"},
+     "required": False, "description": "Quantidade de mensagens por página (1-100)"},
     {"in": "query", "name": "$select", "schema": {"type": "string"}, "required": False,
-     "description": "Campos a retornar (default cobre os mais úteis)."}
+     "description": "Alias legado de 'fields' (mesma allowlist); ignorado se 'fields' vier junto."},
+    *PAGINATION_PARAMS,
   ],
   "responses": {
-    "200": {"description": "Lista de mensagens da Inbox"},
+    "200": {"description": "Página de mensagens da Inbox (com 'next_cursor')"},
+    "304": {"description": "Não modificado (ETag)"},
+    "400": {"description": "Parâmetros inválidos"},
     "401": {"description": "Token ausente ou inválido"},
     "502": {"description": "Falha ao consultar o Graph"}
   }
@@ -107,17 +328,27 @@ def list_inbox():
         return jsonify({"error": "ms_not_authenticated",
                         "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
 
-    top = request.args.get("top", default=25, type=int) or 25
-    select_default = "id,subject,from,receivedDateTime,bodyPreview,toRecipients,isRead,webLink"
-    select_param = request.args.get("$select", select_default)
+    top = max(1, min(request.args.get("top", default=25, type=int) or 25, 100))
+    # $select (legado) passa pela mesma allowlist de 'fields'; nada do cliente vai cru ao Graph
+    select_param, err = parse_fields(
+        request.args.get("fields") or request.args.get("$select"), MESSAGE_FIELDS,
+        "id,subject,from,receivedDateTime,bodyPreview,toRecipients,isRead,webLink",
+    )
+    if err:
+        return jsonify({"error": "validation_error", "message": err}), 400
 
+    cursor = request.args.get("cursor")
     try:
-        data = graph_get(
-            "/me/mailFolders/Inbox/messages",
-            access_token,
-            params={"$top": str(top), "$select": select_param, "$orderby": "receivedDateTime desc"}
-        )
-        return jsonify(data), 200
+        if cursor:
+            params = decode_cursor(cursor, INBOX_ENDPOINT, current_app.secret_key)
+        else:
+            params = {"$top": str(top), "$select": select_param, "$orderby": "receivedDateTime desc"}
+    except CursorError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 400
+
+    try:
+        data = graph_get(INBOX_ENDPOINT, access_token, params=params)
+        return conditional_json(attach_next_cursor(data, INBOX_ENDPOINT, current_app.secret_key))
     except Exception as e:
         msg = str(e)
         if "401" in msg or "Unauthorized" in msg:
@@ -136,10 +367,13 @@ def list_inbox():
     {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
      "description": "Access Token do Microsoft Graph (Bearer <token>)"},
     {"in": "query", "name": "top", "schema": {"type": "integer", "default": 25, "minimum": 1, "maximum": 100},
-     "required": False, "description": "Quantidade de mensagens (1-100)"}
+     "required": False, "description": "Quantidade de mensagens por página (1-100)"},
+    *PAGINATION_PARAMS,
   ],
   "responses": {
-    "200": {"description": "Lista de mensagens enviadas"},
+    "200": {"description": "Página de mensagens enviadas (com 'next_cursor')"},
+    "304": {"description": "Não modificado (ETag)"},
+    "400": {"description": "Parâmetros inválidos"},
     "401": {"description": "Token ausente ou inválido"},
     "502": {"description": "Falha ao consultar o Graph"}
   }
@@ -150,10 +384,20 @@ def list_sent():
         return jsonify({"error": "ms_not_authenticated",
                         "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
 
-    top = request.args.get("top", default=25, type=int) or 25
+    top = max(1, min(request.args.get("top", default=25, type=int) or 25, 100))
+    select_param, err = parse_fields(request.args.get("fields"), MESSAGE_FIELDS, None)
+    if err:
+        return jsonify({"error": "validation_error", "message": err}), 400
+
+    cursor = request.args.get("cursor")
     try:
-        data = graph_list_sent(access_token, top=top)
-        return jsonify(data), 200
+        page_params = decode_cursor(cursor, SENT_ENDPOINT, current_app.secret_key) if cursor else None
+    except CursorError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 400
+
+    try:
+        data = graph_list_sent(access_token, top=top, select=select_param, page_params=page_params)
+        return conditional_json(attach_next_cursor(data, SENT_ENDPOINT, current_app.secret_key))
     except Exception as e:
         msg = str(e)
         if "401" in msg or "Unauthorized" in msg:
@@ -173,7 +417,13 @@ def list_sent():
     {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
      "description": "Access Token do Microsoft Graph (Bearer <token>)"},
     {"in": "query", "name": "include_body", "schema": {"type": "boolean", "default": False}, "required": False,
-     "description": "Se true, inclui body (HTML) além do bodyPreview."}
+     "description": "Se true, inclui body (HTML) além do bodyPreview. Equivale a body_format=html."},
+    {"in": "query", "name": "body_format", "schema": {"type": "string", "enum": ["html", "text", "summary"]},
+     "required": False,
+     "description": "html: corpo original; text: texto limpo (sem estilos, histórico citado, assinatura e "
+                    "pixels de rastreio) limitado a max_chars; summary: resumo de uma frase gerado pela IA."},
+    {"in": "query", "name": "max_chars", "schema": {"type": "integer", "minimum": 100}, "required": False,
+     "description": "Limite do texto para body_format=text|summary (padrão MAIL_TEXT_MAX_CHARS)."}
   ],
   "responses": {
     "200": {"description": "Mensagem encontrada"},
@@ -189,20 +439,41 @@ def get_message_detail(message_id: str):
                         "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
 
     include_body = str(request.args.get("include_body", "false")).lower() in ("1", "true", "yes", "y")
+    body_format = (request.args.get("body_format") or ("html" if include_body else "")).strip().lower()
+    if body_format and body_format not in BODY_FORMATS:
+        return jsonify({"error": "validation_error",
+                        "message": f"body_format deve ser um de: {', '.join(BODY_FORMATS)}."}), 400
+    max_chars = request.args.get("max_chars", type=int)
+    if max_chars is not None:
+        max_chars = max(100, max_chars)
     select_fields = [
         "id","subject","from","sender","toRecipients","ccRecipients","bccRecipients",
         "replyTo","conversationId","receivedDateTime","sentDateTime","isRead",
         "bodyPreview","webLink"
     ]
-    if include_body:
-        select_fields.append("body")
+    if body_format:
+        select_fields += ["body", "lastModifiedDateTime"]
 
     try:
+        if body_format in ("", "html"):
+            # sem transformação: repassa os bytes do Graph (ou do cache) direto
+            return raw_json_response(graph_get_raw(
+                f"/me/messages/{message_id}",
+                access_token,
+                params={"$select": ",".join(select_fields)}
+            ))
         data = graph_get(
             f"/me/messages/{message_id}",
             access_token,
             params={"$select": ",".join(select_fields)}
         )
+        if body_format in ("text", "summary"):
+            data["body"] = body_as_text(data.get("body"), max_chars=max_chars)
+        if body_format == "summary":
+            summary = summarize_messages(resolve_owner(access_token), [data],
+                                         texts={data.get("id"): data["body"]["content"]}, overview=False,
+                                         source=f"body:{max_chars or MAIL_TEXT_MAX_CHARS}")
+            data["body"] = {"contentType": "summary", "content": summary["items"][0]["summary"]}
         return jsonify(data), 200
     except Exception as e:
         msg = str(e)
@@ -213,4 +484,270 @@ def get_message_detail(message_id: str):
                             "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."}), 401
         return jsonify({"error": "graph_error",
                         "message": "Falha ao consultar mensagem no Microsoft Graph.",
-                        "detail": msg}), 502
\ No newline at end of file
+                        "detail": msg}), 502
+
+
+@bp.get("/search")
+@swag_from({
+  "summary": "Busca full-text no índice local de e-mails (Inbox + Enviados)",
+  "tags": ["Mail"],
+  "parameters": [
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"},
+    {"in": "query", "name": "q", "schema": {"type": "string"}, "required": True,
+     "description": "Texto a buscar em assunto, remetente, destinatários e bodyPreview"},
+    {"in": "query", "name": "limit", "schema": {"type": "integer", "default": 25, "minimum": 1, "maximum": 100},
+     "required": False},
+    {"in": "query", "name": "offset", "schema": {"type": "integer", "default": 0, "minimum": 0},
+     "required": False},
+    {"in": "query", "name": "refresh", "schema": {"type": "boolean", "default": False}, "required": False,
+     "description": "Força sincronização (delta) com o Graph antes da busca"}
+  ],
+  "responses": {
+    "200": {"description": "Mensagens ordenadas por relevância ('sync.incomplete': índice ainda parcial)"},
+    "400": {"description": "Parâmetro 'q' ausente"},
+    "401": {"description": "Token ausente ou inválido"},
+    "502": {"description": "Falha ao sincronizar com o Graph"},
+    "503": {"description": "Índice local desabilitado"}
+  }
+})
+def search_mail():
+    if not MAIL_INDEX_ENABLED:
+        return jsonify({"error": "mail_index_disabled",
+                        "message": "Índice local de e-mails desabilitado (MAIL_INDEX_ENABLED)."}), 503
+
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({"error": "ms_not_authenticated",
+                        "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
+
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "validation_error", "message": "Parâmetro 'q' é obrigatório."}), 400
+    limit = request.args.get("limit", default=25, type=int) or 25
+    offset = request.args.get("offset", default=0, type=int) or 0
+    refresh = str(request.args.get("refresh", "false")).lower() in ("1", "true", "yes", "y")
+
+    try:
+        owner = resolve_owner(access_token)
+        sync = sync_mail_index(access_token, owner, force=refresh)
+    except Exception as e:
+        msg = str(e)
+        if "401" in msg or "Unauthorized" in msg:
+            return jsonify({"error": "ms_token_invalid_or_expired",
+                            "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."}), 401
+        return jsonify({"error": "graph_error",
+                        "message": "Falha ao sincronizar o índice de e-mails.",
+                        "detail": msg}), 502
+
+    result = search_mail_index(owner, q, limit=limit, offset=offset)
+    result["sync"] = sync
+    return jsonify(result), 200
+
+
+def _attachment_error(e: Exception, what: str):
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    msg = str(e)
+    if status == 404 or "404" in msg:
+        return jsonify({"error": "not_found", "message": f"{what} não encontrado."}), 404
+    if status == 401 or "401" in msg or "Unauthorized" in msg:
+        return jsonify({"error": "ms_token_invalid_or_expired",
+                        "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."}), 401
+    return jsonify({"error": "graph_error",
+                    "message": "Falha ao consultar anexos no Microsoft Graph.",
+                    "detail": msg}), 502
+
+
+@bp.get("/messages/<message_id>/attachments")
+@swag_from({
+  "summary": "Lista os anexos de uma mensagem (somente metadados)",
+  "tags": ["Mail"],
+  "parameters": [
+    {"in": "path", "name": "message_id", "schema": {"type": "string"}, "required": True},
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"}
+  ],
+  "responses": {
+    "200": {"description": "Anexos (id, name, contentType, size, isInline) com URL de download"},
+    "401": {"description": "Token ausente ou inválido"},
+    "404": {"description": "Mensagem não encontrada"},
+    "502": {"description": "Falha ao consultar o Graph"}
+  }
+})
+def list_message_attachments(message_id: str):
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({"error": "ms_not_authenticated",
+                        "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
+    try:
+        data = list_attachments(access_token, message_id)
+    except Exception as e:
+        return _attachment_error(e, "Mensagem")
+
+    items = []
+    for a in data.get("value", []) or []:
+        item = {k: a.get(k) for k in ("id", "name", "contentType", "size", "isInline", "lastModifiedDateTime")}
+        item["type"] = (a.get("@odata.type") or "").rsplit(".", 1)[-1] or None
+        if a.get("@odata.type") == FILE_ATTACHMENT:
+            item["content_url"] = f"{request.script_root}/mail/messages/{message_id}/attachments/{a.get('id')}/content"
+        items.append(item)
+    return jsonify({"count": len(items), "items": items}), 200
+
+
+@bp.get("/messages/<message_id>/attachments/<attachment_id>/content")
+@swag_from({
+  "summary": "Baixa o conteúdo de um anexo (streaming, com suporte a Range)",
+  "description": "Repassa os bytes do Graph ao cliente em blocos, sem carregar o arquivo em memória. "
+                 "Aceita Range de um intervalo (206 Partial Content).",
+  "tags": ["Mail"],
+  "parameters": [
+    {"in": "path", "name": "message_id", "schema": {"type": "string"}, "required": True},
+    {"in": "path", "name": "attachment_id", "schema": {"type": "string"}, "required": True},
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"},
+    {"in": "header", "name": "Range", "schema": {"type": "string"}, "required": False,
+     "description": "Ex.: bytes=0-1048575"}
+  ],
+  "responses": {
+    "200": {"description": "Conteúdo completo"},
+    "206": {"description": "Intervalo solicitado"},
+    "401": {"description": "Token ausente ou inválido"},
+    "404": {"description": "Anexo não encontrado"},
+    "409": {"description": "Anexo sem conteúdo binário (item ou referência)"},
+    "416": {"description": "Intervalo inválido"},
+    "502": {"description": "Falha ao consultar o Graph"}
+  }
+})
+def download_attachment(message_id: str, attachment_id: str):
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({"error": "ms_not_authenticated",
+                        "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
+    try:
+        meta = get_attachment_meta(access_token, message_id, attachment_id)
+        owner = resolve_owner(access_token) if ATTACHMENT_CACHE_DIR else None
+    except Exception as e:
+        return _attachment_error(e, "Anexo")
+    if meta.get("@odata.type") not in (None, FILE_ATTACHMENT):
+        return jsonify({"error": "unsupported_attachment",
+                        "message": "Só anexos de arquivo têm conteúdo para download."}), 409
+
+    content_type = meta.get("contentType") or "application/octet-stream"
+    if owner:
+        hit = cache_lookup(owner, message_id, attachment_id)
+        if hit:
+            path, cached = hit
+            # send_file trata Range/If-Range/ETag a partir do arquivo local
+            resp = send_file(path, mimetype=cached.get("content_type") or content_type, conditional=True,
+                             etag=cached["sha256"], max_age=0)
+            resp.headers["Content-Disposition"] = content_disposition(cached.get("name") or meta.get("name"))
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+
+    # só um intervalo é suportado; pedidos com vários intervalos recebem o arquivo inteiro
+    rng = request.range if request.range and len(request.range.ranges) == 1 else None
+    upstream_headers = {"Range": request.headers["Range"]} if rng else None
+    try:
+        r = graph_open_stream(f"/me/messages/{message_id}/attachments/{attachment_id}/$value",
+                              access_token, extra_headers=upstream_headers)
+    except requests.HTTPError as e:
+        if getattr(e.response, "status_code", None) == 416:
+            return jsonify({"error": "range_not_satisfiable", "message": "Intervalo inválido."}), 416
+        return _attachment_error(e, "Anexo")
+    except Exception as e:
+        return _attachment_error(e, "Anexo")
+
+    headers = {
+        "Content-Type": content_type,
+        "Content-Disposition": content_disposition(meta.get("name")),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-store",
+        "X-Accel-Buffering": "no",
+    }
+    upstream_length = r.headers.get("Content-Length")
+    chunks = r.iter_content(ATTACHMENT_CHUNK_SIZE)
+    status = 200
+
+    if r.status_code == 206:
+        # o Graph já recortou: repassa como veio
+        status = 206
+        headers["Content-Range"] = r.headers.get("Content-Range", "")
+        if upstream_length:
+            headers["Content-Length"] = upstream_length
+        body = chunks
+    elif rng is not None:
+        total = int(upstream_length) if upstream_length else int(meta.get("size") or 0)
+        bounds = rng.range_for_length(total) if total else None
+        if bounds is None:
+            r.close()
+            resp = jsonify({"error": "range_not_satisfiable", "message": "Intervalo inválido."})
+            resp.headers["Content-Range"] = f"bytes */{total}"
+            return resp, 416
+        start, stop = bounds
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{total}"
+        headers["Content-Length"] = str(stop - start)
+        body = iter_range(chunks, start, stop)
+    else:
+        if upstream_length:
+            headers["Content-Length"] = upstream_length
+        body = tee_to_cache(chunks, owner, message_id, attachment_id, meta) if owner else chunks
+
+    def generate():
+        try:
+            yield from body
+        finally:
+            close = getattr(body, "close", None)
+            if close:
+                close()
+            r.close()
+
+    return Response(generate(), status=status, headers=headers, direct_passthrough=True)
+
+
+@bp.get("/summary")
+@swag_from({
+  "summary": "Resumo da caixa de entrada gerado pela IA (um resumo por mensagem + visão geral)",
+  "description": "Mensagens são agrupadas em lotes por orçamento de tokens (uma chamada ao Gemini por lote, "
+                 "lotes em paralelo). Resumos ficam em cache por id + lastModifiedDateTime: repetir o pedido "
+                 "só processa e-mails novos ou alterados.",
+  "tags": ["Mail"],
+  "parameters": [
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"},
+    {"in": "query", "name": "top", "schema": {"type": "integer", "default": 20, "minimum": 1, "maximum": 50},
+     "required": False},
+    {"in": "query", "name": "unread_only", "schema": {"type": "boolean", "default": False}, "required": False},
+    {"in": "query", "name": "overview", "schema": {"type": "boolean", "default": True}, "required": False,
+     "description": "Inclui visão geral em tópicos"},
+    {"in": "query", "name": "source", "schema": {"type": "string", "enum": ["preview", "body"], "default": "preview"},
+     "required": False, "description": "preview: bodyPreview (mais barato); body: corpo limpo, sem histórico citado"}
+  ],
+  "responses": {
+    "200": {"description": "Resumos (campos new/cached/llm_calls indicam o custo)"},
+    "401": {"description": "Token ausente ou inválido"},
+    "502": {"description": "Falha ao consultar o Graph ou a IA"}
+  }
+})
+def mail_summary():
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return jsonify({"error": "ms_not_authenticated",
+                        "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401
+
+    top = max(1, min(request.args.get("top", default=20, type=int), MAIL_SUMMARY_MAX_MESSAGES))
+    unread_only = str(request.args.get("unread_only", "false")).lower() in ("1", "true", "yes", "y")
+    overview = str(request.args.get("overview", "true")).lower() in ("1", "true", "yes", "y")
+    try:
+        owner = resolve_owner(access_token)
+        data = summarize_inbox(access_token, owner, top=top, unread_only=unread_only, overview=overview,
+                               use_body=request.args.get("source") == "body")
+        return jsonify(data), 200
+    except Exception as e:
+        msg = str(e)
+        if "401" in msg or "Unauthorized" in msg:
+            return jsonify({"error": "ms_token_invalid_or_expired",
+                            "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."}), 401
+        return jsonify({"error": "summary_failed",
+                        "message": "Falha ao resumir e-mails.",
+                        "detail": msg}), 502
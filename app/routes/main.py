@@ -3,10 +3,14 @@ from .contacts import bp as contacts_bp
 from .mail import bp as mail_bp
 from .ai import bp as ai_bp
 from .ai_agent import bp as ai_agent_bp
+from .webhooks import bp as webhooks_bp
+from .admin import bp as admin_bp
 
 def register_routes(app):
     app.register_blueprint(auth_bp, url_prefix="/auth")
     app.register_blueprint(contacts_bp, url_prefix="/contacts")
     app.register_blueprint(mail_bp, url_prefix="/mail")
     app.register_blueprint(ai_bp, url_prefix="/ai")
-    app.register_blueprint(ai_agent_bp, url_prefix="/ai")
\ No newline at end of file
+    app.register_blueprint(ai_agent_bp, url_prefix="/ai")
+    app.register_blueprint(webhooks_bp, url_prefix="/webhooks")
+    app.register_blueprint(admin_bp, url_prefix="/admin")
\ No newline at end of file
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import json
+import secrets
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, Response, current_app, jsonify, request, session
+from app.swagger import swag_from
+
+from app.extensions import db
+from app.models.graph_subscription import GraphSubscription
+from app.services.graph_webhooks import (
+    RESOURCES,
+    QueueFull,
+    SubscriptionError,
+    accept_notifications,
+    create_subscriptions,
+    delete_subscription,
+    ensure_webhook_worker,
+    renew_expiring,
+    simulated_notification,
+    subscription_to_dict,
+)
+from app.services.ms_oauth import resolve_owner
+
+bp = Blueprint("webhooks", __name__, cli_group="graph-webhooks")
+
+def _get_ms_access_token_from_request() -> str | None:
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.lower().startswith("bearer "):
+        return auth_header.split(" ", 1)[1].strip()
+    ms_token = session.get("ms_token") or {}
+    return ms_token.get("access_token")
+
+
+def _owner_or_error():
+    access_token = _get_ms_access_token_from_request()
+    if not access_token:
+        return None, None, (jsonify({"error": "ms_not_authenticated",
+                                     "message": "Forneça Authorization: Bearer <MS_ACCESS_TOKEN> ou faça login em /auth/login."}), 401)
+    try:
+        return access_token, resolve_owner(access_token), None
+    except Exception:
+        return None, None, (jsonify({"error": "ms_token_invalid_or_expired",
+                                     "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."}), 401)
+
+
+def _graph_error(e: Exception):
+    msg = str(e)
+    if "401" in msg or "Unauthorized" in msg:
+        return jsonify({"error": "ms_token_invalid_or_expired",
+                        "message": "Access token Microsoft inválido/expirado. Gere outro em /auth/login."}), 401
+    return jsonify({"error": "graph_error", "message": "Falha ao gerenciar assinatura no Microsoft Graph.",
+                    "detail": msg}), 502
+
+
+@bp.post("/graph")
+@swag_from({
+  "summary": "Receptor de notificações de alteração do Microsoft Graph",
+  "description": "Chamado pelo Graph. Responde ao handshake (?validationToken=...) e confirma "
+                 "notificações com 202 imediatamente; o processamento (invalidação de cache e "
+                 "marcação do índice de e-mail para delta-sync) acontece em segundo plano.",
+  "tags": ["Webhooks"],
+  "parameters": [
+    {"in": "query", "name": "validationToken", "schema": {"type": "string"}, "required": False}
+  ],
+  "responses": {
+    "200": {"description": "Handshake de validação (eco do token em text/plain)"},
+    "202": {"description": "Notificações aceitas"},
+    "400": {"description": "Corpo inválido"},
+    "503": {"description": "Fila cheia (o Graph tenta novamente)"}
+  }
+})
+def graph_notifications():
+    token = request.args.get("validationToken")
+    if token is not None:
+        # o Graph exige o token de volta, sem alteração, em text/plain e em até 10s
+        return Response(token, status=200, mimetype="text/plain")
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("value"), list):
+        return jsonify({"error": "validation_error", "message": "Corpo de notificação inválido."}), 400
+
+    ensure_webhook_worker(current_app._get_current_object())
+    try:
+        accepted, rejected = accept_notifications(payload)
+    except QueueFull:
+        resp = jsonify({"error": "busy", "message": "Fila de notificações cheia."})
+        resp.headers["Retry-After"] = "5"
+        return resp, 503
+    return jsonify({"accepted": accepted, "rejected": rejected}), 202
+
+
+@bp.get("/subscriptions")
+@swag_from({
+  "summary": "Lista as assinaturas de notificação do usuário",
+  "tags": ["Webhooks"],
+  "parameters": [
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"}
+  ],
+  "responses": {"200": {"description": "Assinaturas"}, "401": {"description": "Token ausente ou inválido"}}
+})
+def list_subscriptions():
+    _, owner, err = _owner_or_error()
+    if err:
+        return err
+    subs = GraphSubscription.query.filter_by(owner=owner).order_by(GraphSubscription.created_at).all()
+    return jsonify({"items": [subscription_to_dict(s) for s in subs]})
+
+
+@bp.post("/subscriptions")
+@swag_from({
+  "summary": "Cria (ou renova) assinaturas de contatos e/ou e-mails do usuário",
+  "tags": ["Webhooks"],
+  "parameters": [
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"}
+  ],
+  "requestBody": {
+    "required": False,
+    "content": {
+      "application/json": {
+        "schema": {
+          "type": "object",
+          "properties": {"categories": {"type": "array", "items": {"type": "string", "enum": ["contacts", "mail"]}}}
+        },
+        "example": {"categories": ["contacts", "mail"]}
+      }
+    }
+  },
+  "responses": {
+    "201": {"description": "Assinaturas ativas"},
+    "400": {"description": "Categoria inválida"},
+    "401": {"description": "Token ausente ou inválido"},
+    "502": {"description": "Falha no Graph"},
+    "503": {"description": "GRAPH_WEBHOOK_URL não configurada"}
+  }
+})
+def create_subscriptions_view():
+    access_token, owner, err = _owner_or_error()
+    if err:
+        return err
+    body = request.get_json(silent=True) or {}
+    categories = body.get("categories") or list(RESOURCES)
+    if not isinstance(categories, list) or any(c not in RESOURCES for c in categories):
+        return jsonify({"error": "validation_error",
+                        "message": f"categories deve conter apenas: {', '.join(RESOURCES)}."}), 400
+    try:
+        subs = create_subscriptions(access_token, owner, dict.fromkeys(categories))
+    except SubscriptionError as e:
+        return jsonify({"error": "webhooks_disabled", "message": str(e)}), 503
+    except Exception as e:
+        db.session.rollback()
+        return _graph_error(e)
+    return jsonify({"items": [subscription_to_dict(s) for s in subs]}), 201
+
+
+@bp.post("/subscriptions/renew")
+@swag_from({
+  "summary": "Renova as assinaturas do usuário que estão perto de vencer",
+  "tags": ["Webhooks"],
+  "parameters": [
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"},
+    {"in": "query", "name": "within_hours", "schema": {"type": "integer", "default": 12}}
+  ],
+  "responses": {"200": {"description": "Assinaturas renovadas"}, "401": {"description": "Token ausente ou inválido"}}
+})
+def renew_subscriptions_view():
+    access_token, owner, err = _owner_or_error()
+    if err:
+        return err
+    within = max(1, min(request.args.get("within_hours", default=12, type=int), 24 * 7))
+    try:
+        subs = renew_expiring(access_token, owner, within=timedelta(hours=within))
+    except Exception as e:
+        db.session.rollback()
+        return _graph_error(e)
+    return jsonify({"renewed": [subscription_to_dict(s) for s in subs]})
+
+
+@bp.delete("/subscriptions/<sub_id>")
+@swag_from({
+  "summary": "Remove uma assinatura do usuário",
+  "tags": ["Webhooks"],
+  "parameters": [
+    {"in": "header", "name": "Authorization", "schema": {"type": "string"}, "required": False,
+     "description": "Access Token do Microsoft Graph (Bearer <token>)"},
+    {"in": "path", "name": "sub_id", "schema": {"type": "string"}, "required": True}
+  ],
+  "responses": {"204": {"description": "Removida"}, "404": {"description": "Não encontrada"}}
+})
+def delete_subscription_view(sub_id: str):
+    access_token, owner, err = _owner_or_error()
+    if err:
+        return err
+    sub = db.session.get(GraphSubscription, sub_id)
+    if sub is None or sub.owner != owner:
+        return jsonify({"error": "not_found", "message": "Assinatura não encontrada."}), 404
+    try:
+        delete_subscription(access_token, sub)
+    except Exception as e:
+        db.session.rollback()
+        return _graph_error(e)
+    return "", 204
+
+
+# =========================
+# Simulador local (flask graph-webhooks ...)
+# =========================
+@bp.cli.command("fake-subscription")
+@click.option("--owner", required=True, help="Id do usuário (/me id)")
+@click.option("--category", type=click.Choice(sorted(RESOURCES)), default="mail")
+def fake_subscription(owner: str, category: str):
+    """Cria uma assinatura só local (sem Graph) para testar o receptor."""
+    sub = GraphSubscription(
+        id=f"local-{uuid.uuid4()}",
+        owner=owner,
+        category=category,
+        resource=RESOURCES[category],
+        client_state=secrets.token_urlsafe(32),
+        status="active",
+        expires_at=datetime.utcnow() + timedelta(days=2),
+    )
+    db.session.add(sub)
+    db.session.commit()
+    click.echo(sub.id)
+
+
+@bp.cli.command("simulate")
+@click.argument("subscription_id")
+@click.option("--change-type", type=click.Choice(["created", "updated", "deleted"]), default="updated")
+@click.option("--lifecycle", type=click.Choice(["missed", "reauthorizationRequired", "subscriptionRemoved"]))
+@click.option("--bad-client-state", is_flag=True, help="Envia clientState errado (deve ser rejeitado)")
+@click.option("--url", help="POST para um servidor rodando; sem isso usa o test client")
+def simulate(subscription_id: str, change_type: str, lifecycle: str | None, bad_client_state: bool, url: str | None):
+    """Envia ao receptor uma notificação no formato do Graph."""
+    sub = db.session.get(GraphSubscription, subscription_id)
+    if sub is None:
+        raise click.ClickException("Assinatura não encontrada.")
+    body = simulated_notification(
+        sub, change_type=change_type, lifecycle_event=lifecycle,
+        client_state="invalido" if bad_client_state else None,
+    )
+    if url:
+        import requests
+        r = requests.post(url, json=body, timeout=10)
+        click.echo(f"{r.status_code} {r.text}")
+        return
+    with current_app.test_client() as c:
+        r = c.post("/webhooks/graph", json=body)
+        click.echo(f"{r.status_code} {json.dumps(r.get_json())}")
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from app.services import metrics, tracing
+
+# =========================
+# Config (env)
+# =========================
+AGENT_PREFETCH_ENABLED = os.getenv("AGENT_PREFETCH_ENABLED", "true").strip().lower() in ("1", "true", "yes", "y")
+# chamadas especulativas por usuário por minuto (token bucket)
+AGENT_PREFETCH_BUDGET = int(os.getenv("AGENT_PREFETCH_BUDGET", "6"))
+AGENT_PREFETCH_WORKERS = int(os.getenv("AGENT_PREFETCH_WORKERS", "4"))
+
+# Palavras que sugerem qual leitura o planner vai pedir.
+_HINTS: Dict[str, re.Pattern] = {
+    "contacts": re.compile(r"contat|contact|dom[ií]nio|domain|@[\w-]+\.\w+|agenda|pessoas", re.IGNORECASE),
+    "inbox": re.compile(r"inbox|caixa de entrada|recebid|[uú]ltim[oa]s? (e-?mail|mensag)|e-?mails?|mensage", re.IGNORECASE),
+}
+
+_pool = ThreadPoolExecutor(max_workers=max(1, AGENT_PREFETCH_WORKERS), thread_name_prefix="agent-prefetch")
+
+
+def shutdown() -> None:
+    """Descarta leituras especulativas ainda na fila (saída do processo)."""
+    _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def guess_reads(prompt: str) -> Set[str]:
+    """Leituras prováveis para o pedido, por palavras-chave."""
+    return {kind for kind, rx in _HINTS.items() if rx.search(prompt or "")}
+
+
+# =========================
+# Orçamento por usuário
+# =========================
+_budget_lock = threading.Lock()
+_buckets: Dict[str, Tuple[float, float]] = {}
+
+
+def _take_budget(user_key: str, cost: int = 1) -> bool:
+    if AGENT_PREFETCH_BUDGET <= 0:
+        return False
+    rate = AGENT_PREFETCH_BUDGET / 60.0
+    now = time.monotonic()
+    with _budget_lock:
+        tokens, last = _buckets.get(user_key, (float(AGENT_PREFETCH_BUDGET), now))
+        tokens = min(float(AGENT_PREFETCH_BUDGET), tokens + (now - last) * rate)
+        if tokens < cost:
+            _buckets[user_key] = (tokens, now)
+            return False
+        _buckets[user_key] = (tokens - cost, now)
+        return True
+
+
+# =========================
+# Prefetch de uma requisição
+# =========================
+Slicer = Callable[[Any, int], Any]
+
+
+class _Entry:
+    __slots__ = ("future", "top", "slicer", "started", "finished")
+
+    def __init__(self, top: int, slicer: Slicer, started: float):
+        self.future: Optional[Future] = None
+        self.top = top
+        self.slicer = slicer
+        self.started = started
+        self.finished: Optional[float] = None
+
+
+class Prefetcher:
+    """
+    Dispara leituras baratas do Graph enquanto o planner roda.
+    take() devolve o resultado se o plano pedir a mesma leitura (com top <= o pré-carregado);
+    close() descarta o que não foi usado.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, _Entry] = {}
+        self._used: Set[str] = set()
+        self._lock = threading.Lock()
+        self._plan_done_at: Optional[float] = None
+
+    @classmethod
+    def start(
+        cls,
+        prompt: str,
+        access_token: str,
+        fetchers: Dict[str, Tuple[int, Callable[[], Any], Slicer]],
+        kinds: Optional[Iterable[str]] = None,
+    ) -> "Prefetcher":
+        """
+        fetchers: { tipo: (top, função_sem_args, fatiador(resultado, top)) }
+        """
+        self = cls()
+        if not AGENT_PREFETCH_ENABLED:
+            return self
+        wanted = set(kinds) if kinds is not None else guess_reads(prompt)
+        user_key = hashlib.sha256(access_token.encode()).hexdigest()[:16]
+        for kind in sorted(wanted & set(fetchers)):
+            if not _take_budget(user_key):
+                metrics.incr("prefetch.budget_exhausted")
+                continue
+            top, fn, slicer = fetchers[kind]
+            entry = _Entry(top, slicer, time.monotonic())
+
+            def run(fn=fn, entry=entry):
+                try:
+                    return fn()
+                finally:
+                    entry.finished = time.monotonic()
+
+            entry.future = _pool.submit(tracing.wrap(run))
+            self._entries[kind] = entry
+            metrics.incr("prefetch.started")
+            metrics.incr(f"prefetch.started.{kind}")
+        return self
+
+    def plan_ready(self) -> None:
+        """Marca o fim do planejamento (base para medir a latência economizada)."""
+        self._plan_done_at = time.monotonic()
+
+    def take(self, kind: str, top: int) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(kind)
+            if entry is None or kind in self._used or top > entry.top:
+                return None
+            self._used.add(kind)
+        try:
+            result = entry.future.result()
+        except Exception:
+            metrics.incr("prefetch.failed")
+            return None
+        waited_from = self._plan_done_at or time.monotonic()
+        finished = entry.finished or time.monotonic()
+        duration = finished - entry.started
+        # o que teríamos gasto chamando o Graph agora, menos o que esperamos pelo prefetch
+        saved = max(0.0, duration - max(0.0, finished - waited_from))
+        metrics.incr("prefetch.used")
+        metrics.incr(f"prefetch.used.{kind}")
+        metrics.observe("prefetch.saved_seconds", saved)
+        return entry.slicer(result, top)
+
+    def close(self) -> None:
+        with self._lock:
+            unused = [k for k in self._entries if k not in self._used]
+        for kind in unused:
+            self._entries[kind].future.cancel()
+            metrics.incr("prefetch.discarded")
+            metrics.incr(f"prefetch.discarded.{kind}")
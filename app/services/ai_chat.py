@@ -1,25 +1,40 @@
 from __future__ import annotations
 import os, re, requests
-from dotenv import load_dotenv
 
-load_dotenv()
+from app.services import tracing, transport
+from app.services.cache import get_cache
+from app.services.singleflight import SingleFlight, make_key
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
 GEMINI_MODEL   = os.getenv("GEMINI_MODEL", "gemini-2.5-flash").strip()
 
 API_VERSIONS = ["v1", "v1beta"]
+# lista de modelos muda raramente; evita um GET extra a cada prompt
+GEMINI_MODELS_TTL = float(os.getenv("GEMINI_MODELS_TTL", "3600"))
+# (conexão, leitura) em segundos para generateContent
+GEMINI_TIMEOUT = (float(os.getenv("GEMINI_CONNECT_TIMEOUT", "5")), float(os.getenv("GEMINI_READ_TIMEOUT", "60")))
+
+# prompts idênticos em voo ao mesmo tempo compartilham a mesma chamada ao Gemini
+_chat_flight = SingleFlight("gemini")
 
 def _url(version: str, path: str) -> str:
     return f"https://generativelanguage.googleapis.com/{version}/{path}?key={GEMINI_API_KEY}"
 
-def _payload(prompt: str) -> dict:
-    return {"contents": [{"parts": [{"text": prompt}]}]}
+def _payload(prompt: str, generation_config: dict | None = None) -> dict:
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    if generation_config:
+        payload["generationConfig"] = generation_config
+    return payload
 
-def _list_models(version: str) -> list[str]:
-    r = requests.get(_url(version, "models"), timeout=20)
+@tracing.traced("gemini.list_models", record_args=("version",))
+def _fetch_models(version: str) -> list[str]:
+    r = transport.get(_url(version, "models"), timeout=(GEMINI_TIMEOUT[0], 20))
     r.raise_for_status()
     return [m.get("name","") for m in r.json().get("models",[])]
 
+def _list_models(version: str) -> list[str]:
+    return get_cache().get_or_load("gemini", ("models", version), GEMINI_MODELS_TTL, lambda: _fetch_models(version))
+
 def _normalize(name: str) -> str:
     return name.split("/", 1)[-1]
 
@@ -58,13 +73,27 @@ def _pick_model(version: str, desired: str) -> str | None:
 
     return names[0]
 
-def ai_chat(prompt: str) -> str:
+@tracing.traced("ai_chat")
+def ai_chat(prompt: str, generation_config: dict | None = None) -> str:
+    """
+    generation_config: repassado como 'generationConfig' (temperature, maxOutputTokens,
+    responseMimeType, responseSchema...). Com responseSchema, tenta v1beta primeiro,
+    onde saída estruturada é suportada.
+    """
     if not GEMINI_API_KEY:
         raise RuntimeError("GEMINI_API_KEY ausente no .env.")
+    key = make_key(GEMINI_MODEL, prompt, generation_config or {})
+    return _chat_flight.do(key, lambda: _generate(prompt, generation_config))
+
+@tracing.traced("gemini.generate")
+def _generate(prompt: str, generation_config: dict | None) -> str:
+    versions = API_VERSIONS
+    if generation_config and "responseSchema" in generation_config:
+        versions = ["v1beta"] + [v for v in API_VERSIONS if v != "v1beta"]
 
     last_err = None
     tried = []
-    for ver in API_VERSIONS:
+    for ver in versions:
         try:
             model_path = _pick_model(ver, GEMINI_MODEL)
         except requests.HTTPError as e:
@@ -82,8 +111,10 @@ def ai_chat(prompt: str) -> str:
 
         url = _url(ver, f"{model_path}:generateContent")
         tried.append(f"{ver}:{_normalize(model_path)}")
+        tracing.get_current_span().set_attributes({"gemini.api_version": ver, "gemini.model": _normalize(model_path),
+                                                   "gemini.prompt_chars": len(prompt)})
         try:
-            r = requests.post(url, json=_payload(prompt), timeout=60)
+            r = transport.post(url, json=_payload(prompt, generation_config), timeout=GEMINI_TIMEOUT)
             r.raise_for_status()
             data = r.json()
             return data["candidates"][0]["content"]["parts"][0]["text"]
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional, Set
+
+# =========================
+# Referências entre passos
+# =========================
+# Um parâmetro pode apontar para a saída de um passo anterior:
+#   "$s1.value[0].subject"         -> valor inteiro
+#   "$s2.items[*].emails[0]"       -> lista (um item por elemento de items)
+#   "Assunto: ${s1.value[0].subject}" -> interpolado dentro de uma string
+_PATH = r"[A-Za-z_][\w-]*(?:\.[A-Za-z_@][\w@-]*|\[(?:\d+|\*)\])*"
+FULL_REF_RE = re.compile(r"^\$(" + _PATH + r")$")
+INLINE_REF_RE = re.compile(r"\$\{(" + _PATH + r")\}")
+_TOKEN_RE = re.compile(r"\.([A-Za-z_@][\w@-]*)|\[(\d+|\*)\]")
+
+MAX_STEPS = 8
+
+
+class PlanReferenceError(ValueError):
+    """Referência para passo/caminho inexistente."""
+
+
+def _split(ref: str) -> tuple[str, str]:
+    m = re.match(r"[A-Za-z_][\w-]*", ref)
+    return m.group(0), ref[m.end():]
+
+
+def find_refs(value: Any) -> Set[str]:
+    """Ids de passos referenciados (recursivo em listas/objetos)."""
+    found: Set[str] = set()
+    if isinstance(value, str):
+        m = FULL_REF_RE.match(value)
+        if m:
+            found.add(_split(m.group(1))[0])
+        for im in INLINE_REF_RE.finditer(value):
+            found.add(_split(im.group(1))[0])
+    elif isinstance(value, list):
+        for v in value:
+            found |= find_refs(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            found |= find_refs(v)
+    return found
+
+
+def is_ref(value: Any) -> bool:
+    return bool(find_refs(value))
+
+
+def _walk(obj: Any, tokens: List[tuple]) -> Any:
+    if not tokens:
+        return obj
+    (key, idx), rest = tokens[0], tokens[1:]
+    if key:
+        if not isinstance(obj, dict) or key not in obj:
+            raise PlanReferenceError(f"campo '{key}' inexistente")
+        return _walk(obj[key], rest)
+    if not isinstance(obj, list):
+        raise PlanReferenceError("índice aplicado a um valor que não é lista")
+    if idx == "*":
+        out = []
+        for item in obj:
+            try:
+                out.append(_walk(item, rest))
+            except PlanReferenceError:
+                continue
+        return out
+    i = int(idx)
+    if i >= len(obj):
+        raise PlanReferenceError(f"índice {i} fora do intervalo ({len(obj)} itens)")
+    return _walk(obj[i], rest)
+
+
+def _lookup(ref: str, outputs: Dict[str, Any]) -> Any:
+    step_id, path = _split(ref)
+    if step_id not in outputs:
+        raise PlanReferenceError(f"passo '{step_id}' sem resultado")
+    tokens = [(m.group(1), m.group(2)) for m in _TOKEN_RE.finditer(path)]
+    try:
+        return _walk(outputs[step_id], tokens)
+    except PlanReferenceError as e:
+        raise PlanReferenceError(f"${ref}: {e}") from e
+
+
+def resolve_refs(value: Any, outputs: Dict[str, Any]) -> Any:
+    """Substitui referências pelos valores das saídas já calculadas."""
+    if isinstance(value, str):
+        m = FULL_REF_RE.match(value)
+        if m:
+            return _lookup(m.group(1), outputs)
+        if "${" in value:
+            return INLINE_REF_RE.sub(lambda im: str(_lookup(im.group(1), outputs)), value)
+        return value
+    if isinstance(value, list):
+        return [resolve_refs(v, outputs) for v in value]
+    if isinstance(value, dict):
+        return {k: resolve_refs(v, outputs) for k, v in value.items()}
+    return value
+
+
+# =========================
+# Grafo
+# =========================
+def step_dependencies(step: Dict[str, Any]) -> Set[str]:
+    deps = set(step.get("depends_on") or [])
+    deps |= find_refs(step.get("params") or {})
+    return deps
+
+
+def check_dag(steps: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Valida ids únicos, dependências existentes e ausência de ciclos.
+    Retorna mensagem de erro ou None.
+    """
+    if len(steps) > MAX_STEPS:
+        return f"Plano com mais de {MAX_STEPS} passos."
+    ids = [s.get("id") for s in steps]
+    if len(set(ids)) != len(ids):
+        return "Ids de passos repetidos."
+    known = set(ids)
+    graph = {s["id"]: step_dependencies(s) for s in steps}
+    for sid, deps in graph.items():
+        missing = deps - known
+        if missing:
+            return f"Passo '{sid}' depende de passo inexistente: {', '.join(sorted(missing))}."
+        if sid in deps:
+            return f"Passo '{sid}' depende de si mesmo."
+
+    # Kahn: se sobrar nó, há ciclo
+    remaining = {k: set(v) for k, v in graph.items()}
+    while remaining:
+        ready = [k for k, v in remaining.items() if not v]
+        if not ready:
+            return "Dependências circulares entre passos."
+        for k in ready:
+            remaining.pop(k)
+        for v in remaining.values():
+            v.difference_update(ready)
+    return None
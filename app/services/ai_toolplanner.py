@@ -1,8 +1,15 @@
 from __future__ import annotations
-import json
+import os
 from typing import Any, Dict
+from app.services import metrics, tracing
 from app.services.ai_chat import ai_chat
-from app.services.ai_validation import validate_ai_action
+from app.services.ai_validation import build_response_schema, validate_ai_action
+from app.services.json_extract import extract_json_object
+
+PLANNER_STRUCTURED_OUTPUT = os.getenv("PLANNER_STRUCTURED_OUTPUT", "true").strip().lower() in ("1", "true", "yes", "y")
+PLANNER_MAX_OUTPUT_TOKENS = int(os.getenv("PLANNER_MAX_OUTPUT_TOKENS", "2048"))
+# Ex.: 0 desliga o "thinking" dos modelos 2.5-flash, que consome maxOutputTokens. Vazio = padrão do modelo.
+PLANNER_THINKING_BUDGET = os.getenv("PLANNER_THINKING_BUDGET", "").strip()
 
 TOOLS_JSON = """
 {
@@ -59,9 +66,26 @@ TOOLS_JSON = """
       "action": "get_message_detail",
       "params": {
         "message_id":   { "type": "string",  "optional": false },
-        "include_body": { "type": "boolean", "optional": true, "default": false }
+        "include_body": { "type": "boolean", "optional": true, "default": false },
+        "body_format":  { "type": "string",  "optional": true, "default": "text", "enum": ["text", "summary", "html"] }
+      },
+      "description": "Detalhes de um e-mail por ID. Se include_body=true, inclui o corpo: body_format 'text' (limpo, sem histórico citado; padrão), 'summary' (resumo curto) ou 'html' (original, só se o usuário pedir)."
+    },
+    {
+      "action": "search_mail",
+      "params": {
+        "query": { "type": "string",  "optional": false },
+        "top":   { "type": "integer", "optional": true, "default": 25 }
       },
-      "description": "Detalhes de um e-mail por ID. Se include_body=true, inclui body HTML."
+      "description": "Busca e-mails (Inbox e Enviados) por texto em assunto, remetente, destinatários e prévia do corpo. Prefira esta ação a list_inbox quando o usuário procurar um e-mail específico."
+    },
+    {
+      "action": "summarize_inbox",
+      "params": {
+        "top":         { "type": "integer", "optional": true, "default": 20 },
+        "unread_only": { "type": "boolean", "optional": true, "default": false }
+      },
+      "description": "Resume os e-mails mais recentes da caixa de entrada (um resumo por mensagem e uma visão geral). Use quando o usuário pedir resumo/panorama dos e-mails."
     },
     {
       "action": "send_mail",
@@ -76,8 +100,9 @@ TOOLS_JSON = """
   "output_format": {
     "type": "object",
     "properties": {
-      "action": "string (uma das ações listadas em tools.action)",
-      "params": "object (parâmetros válidos conforme a ação escolhida)",
+      "action": "string (uma das ações listadas em tools.action, ou 'multi_step' quando o pedido exigir várias ações)",
+      "params": "object (parâmetros válidos conforme a ação escolhida; {} em multi_step)",
+      "steps": "array (apenas em multi_step): [{ id, action, params, depends_on? }]. Um parâmetro pode usar a saída de um passo anterior: '$id.caminho' (valor inteiro, ex. '$s1.value[0].subject'; '[*]' mapeia listas, ex. '$s2.items[*].emails[0]') ou '${id.caminho}' dentro de um texto",
       "reason": "string curta explicando o porquê da escolha",
       "confidence": "number 0..1 (confiança da escolha)",
       "message": "string (resposta conversacional para o usuário, no mesmo idioma do pedido)",
@@ -132,13 +157,56 @@ Exemplo (listar enviados):
 Exemplo (detalhe de e-mail):
 {
   "action": "get_message_detail",
-  "params": { "message_id": "AAMkADk...AAA=", "include_body": true },
+  "params": { "message_id": "AAMkADk...AAA=", "include_body": true, "body_format": "text" },
   "reason": "Usuário quer abrir um e-mail específico",
   "confidence": 0.84,
   "message": "Abrindo os detalhes dessa mensagem.",
   "message_type": "email_detail"
 }
 
+Exemplo (resumir e-mails):
+{
+  "action": "summarize_inbox",
+  "params": { "top": 20, "unread_only": true },
+  "reason": "Usuário quer um resumo dos e-mails não lidos",
+  "confidence": 0.88,
+  "message": "Vou resumir seus e-mails não lidos.",
+  "message_type": "email_list"
+}
+
+Exemplo (buscar e-mail):
+{
+  "action": "search_mail",
+  "params": { "query": "fatura março", "top": 10 },
+  "reason": "Usuário procura e-mails sobre a fatura de março",
+  "confidence": 0.86,
+  "message": "Vou procurar nos seus e-mails por 'fatura março'.",
+  "message_type": "email_list"
+}
+
+Exemplo (vários passos):
+{
+  "action": "multi_step",
+  "params": {},
+  "steps": [
+    { "id": "s1", "action": "list_inbox", "params": { "top": 1 } },
+    { "id": "s2", "action": "list_contacts", "params": { "domain": "gmail.com", "top": 200 } },
+    {
+      "id": "s3",
+      "action": "send_mail",
+      "params": {
+        "subject": "Fw: ${s1.value[0].subject}",
+        "body_html": "<p>Assunto do último e-mail recebido: ${s1.value[0].subject}</p>",
+        "to": "$s2.items[*].emails[0]"
+      }
+    }
+  ],
+  "reason": "Usuário quer enviar o assunto do último e-mail para os contatos do gmail.com",
+  "confidence": 0.82,
+  "message": "Vou pegar o assunto do seu último e-mail e enviar para todos os contatos @gmail.com.",
+  "message_type": "email_sent"
+}
+
 Exemplo (enviar email):
 {
   "action": "send_mail",
@@ -163,6 +231,8 @@ REGRAS:
 - Se o usuário apenas conversar (saudação, agradecimento, papo informal), use a ação 'chat_reply' e 'message_type' = 'small_talk'.
 - Se houver uma ação concreta, escolha a ação correta e escreva 'message' explicando resumidamente o que será feito/feito.
 - Use ESTRITAMENTE os parâmetros definidos na ação escolhida; não invente campos ou chaves fora do catálogo.
+- Se o pedido exigir mais de uma ação (ex.: buscar dados e depois enviar), use action 'multi_step' com 'steps'. Passos sem dependência entre si rodam em paralelo; use referências '$id...' para encadear resultados.
+- Saídas úteis para referências: list_contacts -> { count, items: [{ id, displayName, emails: [...] }] }; list_inbox/list_sent -> { value: [{ id, subject, from, receivedDateTime, bodyPreview }] }; search_mail -> { items: [{ id, subject, from, to }] }; summarize_inbox -> { overview, items: [{ id, subject, from, summary }] }.
 - Responda no MESMO IDIOMA do usuário.
 - Saída: JSON puro (sem markdown, sem cercas de código).
 """
@@ -177,6 +247,35 @@ def _strip_code_fences(s: str) -> str:
           t = t[:-3].strip()
   return t
 
+def _generation_config() -> Dict[str, Any]:
+  config: Dict[str, Any] = {
+      "temperature": 0,
+      "maxOutputTokens": PLANNER_MAX_OUTPUT_TOKENS,
+      "responseMimeType": "application/json",
+      "responseSchema": build_response_schema(),
+  }
+  if PLANNER_THINKING_BUDGET:
+      config["thinkingConfig"] = {"thinkingBudget": int(PLANNER_THINKING_BUDGET)}
+  return config
+
+def _call_planner_model(prompt: str) -> str:
+  """
+  Modo estruturado (responseSchema) quando habilitado; se a API recusar o schema (400),
+  cai para o modo texto uma vez.
+  """
+  if PLANNER_STRUCTURED_OUTPUT:
+      try:
+          raw = ai_chat(prompt, generation_config=_generation_config())
+          metrics.incr("planner.structured_calls")
+          return raw
+      except RuntimeError as e:
+          if not str(e).startswith("Gemini 400"):
+              raise
+          metrics.incr("planner.structured_fallbacks")
+  metrics.incr("planner.text_calls")
+  return ai_chat(prompt)
+
+@tracing.traced("planner.plan_action")
 def plan_action(user_prompt: str) -> Dict[str, Any]:
   prompt = (
       SYSTEM_INSTRUCTIONS
@@ -189,12 +288,14 @@ def plan_action(user_prompt: str) -> Dict[str, Any]:
       + "\n\nResponda apenas com o JSON exigido pelo 'output_format'."
   )
 
-  raw = ai_chat(prompt)
-  text = _strip_code_fences(raw)
+  metrics.incr("planner.requests")
+  tracing.get_current_span().set_attribute("planner.prompt_chars", len(prompt))
+  raw = _call_planner_model(prompt)
+  plan, strategy = extract_json_object(_strip_code_fences(raw))
+  metrics.incr(f"planner.parse.{strategy}")
 
-  try:
-      plan = json.loads(text)
-  except json.JSONDecodeError:
+  if plan is None:
+      metrics.incr("planner.parse_failures")
       return {
           "action": "chat_reply",
           "params": { "tone": "friendly" },
@@ -206,6 +307,7 @@ def plan_action(user_prompt: str) -> Dict[str, Any]:
 
   validation = validate_ai_action(plan, raw)
   if not validation.get("valid", False):
+      metrics.incr("planner.validation_failures")
       return {
           "action": "chat_reply",
           "params": { "tone": "friendly" },
@@ -231,7 +333,10 @@ def plan_action(user_prompt: str) -> Dict[str, Any]:
           "list_inbox": "email_list",
           "list_sent": "email_list",
           "get_message_detail": "email_detail",
-          "send_mail": "email_sent"
+          "search_mail": "email_list",
+          "summarize_inbox": "email_list",
+          "send_mail": "email_sent",
+          "multi_step": "text"
       }
       clean["message_type"] = mapping.get(clean.get("action","chat_reply"), "text")
 
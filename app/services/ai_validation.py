@@ -1,6 +1,8 @@
 from __future__ import annotations
 from typing import Any, Dict, Tuple, List
 
+from app.services.ai_plan_graph import check_dag, is_ref
+
 # ============ AÇÕES SUPORTADAS ============
 TOOL_SPEC: Dict[str, Dict[str, Any]] = {
     "chat_reply": {
@@ -43,7 +45,20 @@ TOOL_SPEC: Dict[str, Dict[str, Any]] = {
     "get_message_detail": {
         "params": {
             "message_id":   {"type": "string",  "optional": False},
-            "include_body": {"type": "boolean", "optional": True, "default": False}
+            "include_body": {"type": "boolean", "optional": True, "default": False},
+            "body_format":  {"type": "string",  "optional": True, "default": "text", "enum": ["text", "summary", "html"]}
+        }
+    },
+    "search_mail": {
+        "params": {
+            "query": {"type": "string",  "optional": False},
+            "top":   {"type": "integer", "optional": True, "default": 25, "min": 1, "max": 100}
+        }
+    },
+    "summarize_inbox": {
+        "params": {
+            "top":         {"type": "integer", "optional": True, "default": 20, "min": 1, "max": 50},
+            "unread_only": {"type": "boolean", "optional": True, "default": False}
         }
     },
     "send_mail": {
@@ -55,6 +70,9 @@ TOOL_SPEC: Dict[str, Dict[str, Any]] = {
     }
 }
 
+# Plano com vários passos (DAG em 'steps'); não é uma ferramenta por si só.
+MULTI_STEP_ACTION = "multi_step"
+
 # ============ TIPAGEM DA MENSAGEM PARA O FRONT ============
 MESSAGE_TYPE_ENUM = {
     "small_talk", "text",
@@ -63,6 +81,56 @@ MESSAGE_TYPE_ENUM = {
     "system", "error",
 }
 
+# ============ SCHEMA PARA SAÍDA ESTRUTURADA (Gemini responseSchema) ============
+_SCHEMA_TYPES = {
+    "string": {"type": "STRING"},
+    "integer": {"type": "INTEGER"},
+    "boolean": {"type": "BOOLEAN"},
+    "array_string": {"type": "ARRAY", "items": {"type": "STRING"}},
+}
+
+def build_response_schema() -> Dict[str, Any]:
+    """
+    Deriva o responseSchema do planner a partir de TOOL_SPEC.
+    'params' é a união dos parâmetros de todas as ações (todos opcionais no schema;
+    obrigatoriedade por ação continua em validate_ai_action). Parâmetros do tipo
+    'object' ficam de fora: o Gemini não aceita OBJECT sem 'properties'.
+    """
+    params: Dict[str, Any] = {}
+    for spec in TOOL_SPEC.values():
+        for name, p_spec in spec["params"].items():
+            schema = _SCHEMA_TYPES.get(p_spec.get("type"))
+            if schema and name not in params:
+                params[name] = dict(schema)
+                if p_spec.get("enum"):
+                    params[name]["enum"] = list(p_spec["enum"])
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "action": {"type": "STRING", "enum": list(TOOL_SPEC) + [MULTI_STEP_ACTION]},
+            "params": {"type": "OBJECT", "properties": params},
+            "steps": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "id": {"type": "STRING"},
+                        "action": {"type": "STRING", "enum": [a for a in TOOL_SPEC if a != "chat_reply"]},
+                        "params": {"type": "OBJECT", "properties": params},
+                        "depends_on": {"type": "ARRAY", "items": {"type": "STRING"}},
+                    },
+                    "required": ["id", "action", "params"],
+                },
+            },
+            "reason": {"type": "STRING"},
+            "confidence": {"type": "NUMBER"},
+            "message": {"type": "STRING"},
+            "message_type": {"type": "STRING", "enum": sorted(MESSAGE_TYPE_ENUM)},
+        },
+        "required": ["action", "params", "reason", "confidence", "message", "message_type"],
+        "propertyOrdering": ["action", "params", "steps", "reason", "confidence", "message", "message_type"],
+    }
+
 OFFENSIVE_TERMS = {
     "porra","caralho","merda","buceta","punheta","puta","puto","foder","foda-se","fdp",
     "desgraçado","imbecil","otário","vagabunda","vagabundo","seu lixo",
@@ -82,6 +150,8 @@ def _type_check(name: str, spec: Dict[str, Any], value: Any) -> Tuple[bool, str,
     if t == "string":
         if not isinstance(value, str):
             return False, f"param '{name}' deve ser string", None
+        if spec.get("enum") and value.strip() not in spec["enum"]:
+            return False, f"param '{name}' deve ser um de: {', '.join(spec['enum'])}", None
         return True, "", value.strip()
 
     if t == "integer":
@@ -124,15 +194,107 @@ def _type_check(name: str, spec: Dict[str, Any], value: Any) -> Tuple[bool, str,
 
     return False, f"tipo '{t}' inválido na spec do param '{name}'", None
 
+def _check_params(action: str, params: Dict[str, Any], allow_refs: bool = False) -> Tuple[bool, str, Dict[str, Any]]:
+    """
+    Valida/coage os parâmetros de uma ação contra TOOL_SPEC.
+    allow_refs=True: valores com referência a outro passo ($s1...) passam sem checagem
+    de tipo; são checados de novo depois de resolvidos (validate_step_params).
+    """
+    spec = TOOL_SPEC[action]["params"]
+    clean: Dict[str, Any] = {}
+    for name, p_spec in spec.items():
+        if name in params:
+            if allow_refs and is_ref(params[name]):
+                clean[name] = params[name]
+                continue
+            ok, msg, coerced = _type_check(name, p_spec, params[name])
+            if not ok:
+                return False, msg, {}
+            clean[name] = coerced
+        else:
+            if not p_spec.get("optional", False):
+                return False, f"Parâmetro obrigatório ausente: '{name}'", {}
+            if "default" in p_spec:
+                clean[name] = p_spec["default"]
+
+    if action == "search_mail" and not is_ref(clean.get("query")) and not clean.get("query"):
+        return False, "search_mail requer 'query' não vazia.", {}
+
+    if action == "send_mail":
+        if not is_ref(clean.get("to")) and (not clean.get("to") or len(clean["to"]) == 0):
+            return False, "send_mail requer ao menos um destinatário em 'to'.", {}
+        if not clean.get("subject"):
+            return False, "send_mail requer 'subject' não vazio.", {}
+        if not clean.get("body_html"):
+            return False, "send_mail requer 'body_html' não vazio.", {}
+        if _contains_offensive(str(clean.get("subject", ""))) or _contains_offensive(str(clean.get("body_html", ""))):
+            return False, "Conteúdo ofensivo/explicitamente inadequado detectado no e-mail.", {}
+
+    return True, "", clean
+
+def validate_step_params(action: str, params: Dict[str, Any]) -> Tuple[bool, str, Dict[str, Any]]:
+    """
+    Revalida os parâmetros de um passo depois que as referências foram resolvidas.
+    Para 'array_string', uma string vira lista de um item e listas aninhadas
+    (ex.: ["$s1.items[*].email"]) são achatadas.
+    """
+    spec = TOOL_SPEC.get(action, {}).get("params", {})
+    fixed = dict(params)
+    for name, p_spec in spec.items():
+        if p_spec.get("type") != "array_string" or name not in fixed:
+            continue
+        value = fixed[name]
+        if isinstance(value, str):
+            fixed[name] = [value]
+        elif isinstance(value, list):
+            flat: List[Any] = []
+            for v in value:
+                flat.extend(v if isinstance(v, list) else [v])
+            fixed[name] = flat
+    return _check_params(action, fixed)
+
+def _validate_steps(steps: Any) -> Tuple[bool, str, List[Dict[str, Any]]]:
+    if not isinstance(steps, list) or not steps:
+        return False, "Campo 'steps' deve ser uma lista não vazia.", []
+    clean_steps: List[Dict[str, Any]] = []
+    for i, step in enumerate(steps):
+        if not isinstance(step, dict):
+            return False, f"Passo #{i} não é um objeto.", []
+        sid = step.get("id") or f"s{i + 1}"
+        if not isinstance(sid, str):
+            return False, f"Passo #{i}: 'id' deve ser string.", []
+        action = step.get("action")
+        if action not in TOOL_SPEC or action == "chat_reply":
+            return False, f"Passo '{sid}': ação inválida: {action}", []
+        params = step.get("params") or {}
+        if not isinstance(params, dict):
+            return False, f"Passo '{sid}': 'params' deve ser um objeto.", []
+        depends_on = step.get("depends_on") or []
+        if not isinstance(depends_on, list) or not all(isinstance(d, str) for d in depends_on):
+            return False, f"Passo '{sid}': 'depends_on' deve ser lista de ids.", []
+        ok, msg, clean = _check_params(action, params, allow_refs=True)
+        if not ok:
+            return False, f"Passo '{sid}': {msg}", []
+        clean_steps.append({"id": sid, "action": action, "params": clean, "depends_on": depends_on})
+
+    err = check_dag(clean_steps)
+    if err:
+        return False, err, []
+    return True, "", clean_steps
+
 def validate_ai_action(plan: Dict[str, Any], raw_model_text: str) -> Dict[str, Any]:
     if not isinstance(plan, dict):
         return {"valid": False, "message": "Plano não é um objeto JSON.", "clean": None}
 
     action = plan.get("action")
-    if action not in TOOL_SPEC:
+    steps = plan.get("steps")
+    multi = action == MULTI_STEP_ACTION or (action is None and steps is not None)
+    if not multi and action not in TOOL_SPEC:
         return {"valid": False, "message": f"Ação inválida: {action}", "clean": None}
 
     params = plan.get("params")
+    if multi and params is None:
+        params = {}
     if not isinstance(params, dict):
         return {"valid": False, "message": "Campo 'params' deve ser um objeto.", "clean": None}
 
@@ -145,29 +307,14 @@ def validate_ai_action(plan: Dict[str, Any], raw_model_text: str) -> Dict[str, A
         return {"valid": False, "message": f"message_type inválido (use um de {sorted(MESSAGE_TYPE_ENUM)}).", "clean": None}
     message_type = message_type.strip()
 
-    spec = TOOL_SPEC[action]["params"]
-    clean: Dict[str, Any] = {}
-    for name, p_spec in spec.items():
-        if name in params:
-            ok, msg, coerced = _type_check(name, p_spec, params[name])
-            if not ok:
-                return {"valid": False, "message": msg, "clean": None}
-            clean[name] = coerced
-        else:
-            if not p_spec.get("optional", False):
-                return {"valid": False, "message": f"Parâmetro obrigatório ausente: '{name}'", "clean": None}
-            if "default" in p_spec:
-                clean[name] = p_spec["default"]
-
-    if action == "send_mail":
-        if not clean.get("to") or len(clean["to"]) == 0:
-            return {"valid": False, "message": "send_mail requer ao menos um destinatário em 'to'.", "clean": None}
-        if not clean.get("subject"):
-            return {"valid": False, "message": "send_mail requer 'subject' não vazio.", "clean": None}
-        if not clean.get("body_html"):
-            return {"valid": False, "message": "send_mail requer 'body_html' não vazio.", "clean": None}
-        if _contains_offensive(clean.get("subject", "")) or _contains_offensive(clean.get("body_html", "")):
-            return {"valid": False, "message": "Conteúdo ofensivo/explicitamente inadequado detectado no e-mail.", "clean": None}
+    clean_steps: List[Dict[str, Any]] = []
+    if multi:
+        ok, msg, clean_steps = _validate_steps(steps)
+        clean: Dict[str, Any] = {}
+    else:
+        ok, msg, clean = _check_params(action, params)
+    if not ok:
+        return {"valid": False, "message": msg, "clean": None}
 
     if _contains_offensive(message):
         return {"valid": False, "message": "Conteúdo ofensivo/inadequado não é permitido na mensagem.", "clean": None}
@@ -187,11 +334,13 @@ def validate_ai_action(plan: Dict[str, Any], raw_model_text: str) -> Dict[str, A
         return {"valid": False, "message": "Campo 'confidence' deve ser número.", "clean": None}
 
     cleaned_plan = {
-        "action": action,
+        "action": MULTI_STEP_ACTION if multi else action,
         "params": clean,
         "reason": reason.strip() if isinstance(reason, str) else "",
         "confidence": float(confidence) if isinstance(confidence, (int, float)) else 0.0,
         "message": message.strip(),
         "message_type": message_type
     }
-    return {"valid": True, "message": "ok", "clean": cleaned_plan}
\ No newline at end of file
+    if multi:
+        cleaned_plan["steps"] = clean_steps
+    return {"valid": True, "message": "ok", "clean": cleaned_plan}
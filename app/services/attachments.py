@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from app.services import metrics
+from app.services.ms_oauth import graph_get
+
+# =========================
+# Config (env)
+# =========================
+ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", str(64 * 1024)))
+# vazio = sem cache em disco
+ATTACHMENT_CACHE_DIR = os.getenv("ATTACHMENT_CACHE_DIR", "").strip()
+ATTACHMENT_CACHE_MAX_BYTES = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+ATTACHMENT_FIELDS = "id,name,contentType,size,isInline,lastModifiedDateTime"
+FILE_ATTACHMENT = "#microsoft.graph.fileAttachment"
+
+
+def list_attachments(access_token: str, message_id: str) -> Dict[str, Any]:
+    """Metadados dos anexos (sem contentBytes)."""
+    return graph_get(f"/me/messages/{message_id}/attachments", access_token, params={"$select": ATTACHMENT_FIELDS})
+
+
+def get_attachment_meta(access_token: str, message_id: str, attachment_id: str) -> Dict[str, Any]:
+    return graph_get(
+        f"/me/messages/{message_id}/attachments/{attachment_id}",
+        access_token,
+        params={"$select": ATTACHMENT_FIELDS},
+    )
+
+
+def content_disposition(name: Optional[str]) -> str:
+    name = (name or "anexo").replace("\r", " ").replace("\n", " ")
+    ascii_name = name.encode("ascii", "replace").decode().replace('"', "'").replace("?", "_")
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(name)}"
+
+
+def iter_range(chunks: Iterator[bytes], start: int, stop: int) -> Iterator[bytes]:
+    """Recorta [start, stop) de um fluxo de blocos sem acumular o que é descartado."""
+    pos = 0
+    for chunk in chunks:
+        end = pos + len(chunk)
+        if end > start and pos < stop:
+            yield chunk[max(0, start - pos):min(len(chunk), stop - pos)]
+        pos = end
+        if pos >= stop:
+            break
+
+
+# =========================
+# Cache em disco (endereçado por conteúdo)
+# =========================
+# blobs/<sha256>      -> conteúdo (arquivos iguais em mensagens/usuários diferentes são gravados uma vez)
+# refs/<hash da ref>  -> {"sha256", "content_type", "name", "size"}; a ref inclui o usuário,
+#                        então só quem já baixou o anexo encontra o blob
+_evict_lock = threading.Lock()
+
+
+def _ref_path(owner: str, message_id: str, attachment_id: str) -> str:
+    ref = hashlib.sha256(f"{owner}\0{message_id}\0{attachment_id}".encode()).hexdigest()
+    return os.path.join(ATTACHMENT_CACHE_DIR, "refs", ref)
+
+
+def _blob_path(sha: str) -> str:
+    return os.path.join(ATTACHMENT_CACHE_DIR, "blobs", sha[:2], sha)
+
+
+def cache_lookup(owner: str, message_id: str, attachment_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """(caminho do blob, metadados) se o anexo já estiver em cache."""
+    if not ATTACHMENT_CACHE_DIR:
+        return None
+    try:
+        with open(_ref_path(owner, message_id, attachment_id), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        path = _blob_path(meta["sha256"])
+        os.utime(path)  # LRU por mtime
+        metrics.incr("attachments.cache_hits")
+        return path, meta
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def tee_to_cache(
+    chunks: Iterator[bytes],
+    owner: str,
+    message_id: str,
+    attachment_id: str,
+    meta: Dict[str, Any],
+) -> Iterator[bytes]:
+    """
+    Repassa os blocos ao cliente e grava em um arquivo temporário ao mesmo tempo.
+    Só publica no cache se o download terminar inteiro (cliente que desconecta não deixa lixo).
+    """
+    if not ATTACHMENT_CACHE_DIR:
+        yield from chunks
+        return
+    tmp_dir = os.path.join(ATTACHMENT_CACHE_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+    digest = hashlib.sha256()
+    size = 0
+    complete = False
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in chunks:
+                out.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+                yield chunk
+        complete = True
+    finally:
+        if complete:
+            _publish(tmp, digest.hexdigest(), size, owner, message_id, attachment_id, meta)
+        else:
+            _silent_remove(tmp)
+
+
+def _publish(tmp: str, sha: str, size: int, owner: str, message_id: str, attachment_id: str,
+             meta: Dict[str, Any]) -> None:
+    try:
+        blob = _blob_path(sha)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if os.path.exists(blob):
+            _silent_remove(tmp)
+        else:
+            os.replace(tmp, blob)
+        ref = _ref_path(owner, message_id, attachment_id)
+        os.makedirs(os.path.dirname(ref), exist_ok=True)
+        ref_tmp = f"{ref}.{os.getpid()}.tmp"
+        with open(ref_tmp, "w", encoding="utf-8") as f:
+            json.dump({"sha256": sha, "size": size, "content_type": meta.get("contentType"),
+                       "name": meta.get("name")}, f)
+        os.replace(ref_tmp, ref)
+        metrics.incr("attachments.cache_stores")
+        _evict()
+    except OSError:
+        _silent_remove(tmp)
+
+
+def _evict() -> None:
+    """Remove os blobs menos usados (mtime) até caber em ATTACHMENT_CACHE_MAX_BYTES."""
+    if not _evict_lock.acquire(blocking=False):
+        return
+    try:
+        root = os.path.join(ATTACHMENT_CACHE_DIR, "blobs")
+        files = []
+        total = 0
+        for d, _, names in os.walk(root):
+            for n in names:
+                p = os.path.join(d, n)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+                total += st.st_size
+        if total <= ATTACHMENT_CACHE_MAX_BYTES:
+            return
+        for _, size, p in sorted(files):
+            # refs órfãs são ignoradas em cache_lookup (blob ausente -> miss)
+            _silent_remove(p)
+            total -= size
+            if total <= ATTACHMENT_CACHE_MAX_BYTES:
+                break
+    finally:
+        _evict_lock.release()
+
+
+def _silent_remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,581 @@
+from __future__ import annotations
+
+import os
+import socket
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from app.config import PROJECT_ROOT
+from app.services import json_codec, metrics
+from app.services.singleflight import make_key
+
+# =========================
+# Config (env)
+# =========================
+# memory | sqlite | redis | none
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").strip().lower()
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# depois de vencer o TTL, o valor ainda é servido por até N segundos enquanto é renovado em segundo plano
+# (com GRAPH_CACHE_TTLS de 15 s para e-mail, a Inbox pode ficar até 15 + 30 = 45 s defasada)
+CACHE_STALE_SECONDS = float(os.getenv("CACHE_STALE_SECONDS", "30"))
+# vida máxima de qualquer entrada (TTL + stale); também o tempo que um contador de geração é guardado
+CACHE_MAX_LIFETIME = float(os.getenv("CACHE_MAX_LIFETIME", "86400"))
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(PROJECT_ROOT, "instance", "cache.sqlite3"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "app")
+
+# Entrada armazenada: (valor serializado, fresco_até, utilizável_até) em epoch segundos.
+Entry = Tuple[bytes, float, float]
+
+
+# =========================
+# Backends
+# =========================
+class CacheBackend:
+    """Armazenamento bruto (bytes) com expiração; a política de TTL/SWR fica em Cache."""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[Entry]:
+        raise NotImplementedError
+
+    def set(self, key: str, data: bytes, fresh_until: float, stale_until: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def new_generation(self, key: str, ttl: float) -> int:
+        """
+        Grava uma geração nova e única (time_ns) para invalidar um namespace inteiro; expira em 'ttl'.
+        Nunca reutiliza um valor: quando o contador expira e volta a 0, as entradas de gerações
+        antigas não reaparecem, e as de 0 já venceram (ttl >= vida máxima de uma entrada).
+        """
+        raise NotImplementedError
+
+    def counter(self, key: str) -> int:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """LRU em memória, limitado por número de entradas e por bytes."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Entry]" = OrderedDict()
+        self._bytes = 0
+        self._counters: Dict[str, Tuple[int, float]] = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                self._drop(key)
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key: str, data: bytes, fresh_until: float, stale_until: float) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._data[key] = (data, fresh_until, stale_until)
+            self._bytes += len(data)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                old_key = next(iter(self._data))
+                self._drop(old_key)
+                metrics.incr("cache.evictions")
+
+    def _drop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def new_generation(self, key: str, ttl: float) -> int:
+        now = time.time()
+        gen = time.time_ns()
+        with self._lock:
+            self._counters[key] = (gen, now + ttl)
+            if now >= self._next_sweep:
+                # um contador por usuário/categoria: descarta os vencidos de tempos em tempos
+                self._counters = {k: v for k, v in self._counters.items() if v[1] > now}
+                self._next_sweep = now + 60
+        return gen
+
+    def counter(self, key: str) -> int:
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                return 0
+            if entry[1] <= time.time():
+                del self._counters[key]
+                return 0
+            return entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+            self._bytes = 0
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Arquivo SQLite (WAL + mmap) compartilhado pelos workers do mesmo host.
+    LRU aproximado: ao passar dos limites, remove as entradas acessadas há mais tempo.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " fresh_until REAL NOT NULL, stale_until REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed ON cache_entries (accessed)")
+            # cache_counters (contadores sem expiração) foi substituída por cache_generations
+            conn.execute("DROP TABLE IF EXISTS cache_counters")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_generations"
+                " (key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={64 * 1024 * 1024}")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Entry]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, fresh_until, stale_until FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[2] <= now:
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE cache_entries SET accessed = ? WHERE key = ?", (now, key))
+        return bytes(row[0]), row[1], row[2]
+
+    def set(self, key: str, data: bytes, fresh_until: float, stale_until: float) -> None:
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, size, fresh_until, stale_until, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(data), len(data), fresh_until, stale_until, now),
+            )
+            conn.execute("DELETE FROM cache_entries WHERE stale_until <= ?", (now,))
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone()
+            while count > self.max_entries or total > self.max_bytes:
+                # só o excedente em entradas; acima de max_bytes, uma a uma até caber
+                victims = conn.execute(
+                    "SELECT key, size FROM cache_entries ORDER BY accessed LIMIT ?",
+                    (max(1, count - self.max_entries),),
+                ).fetchall()
+                if not victims:
+                    break
+                conn.executemany("DELETE FROM cache_entries WHERE key = ?", [(k,) for k, _ in victims])
+                metrics.incr("cache.evictions", len(victims))
+                count -= len(victims)
+                total -= sum(s for _, s in victims)
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def new_generation(self, key: str, ttl: float) -> int:
+        now = time.time()
+        gen = time.time_ns()
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO cache_generations (key, value, expires) VALUES (?, ?, ?)",
+                         (key, gen, now + ttl))
+            conn.execute("DELETE FROM cache_generations WHERE expires <= ?", (now,))
+        return gen
+
+    def counter(self, key: str) -> int:
+        row = self._conn().execute(
+            "SELECT value FROM cache_generations WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def clear(self) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache_entries")
+            conn.execute("DELETE FROM cache_generations")
+
+
+class RedisError(RuntimeError):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """
+    Cliente mínimo do protocolo Redis (RESP2) sobre socket, sem dependências.
+    Funciona com Redis, Valkey, KeyDB etc. Evicção por tamanho fica a cargo do servidor
+    (configure maxmemory + maxmemory-policy allkeys-lru).
+    """
+
+    name = "redis"
+    _HEADER = struct.Struct("!dd")
+
+    def __init__(self, url: str = CACHE_REDIS_URL, timeout: float = 2.0):
+        u = urlparse(url)
+        if u.scheme not in ("redis", ""):
+            raise ValueError(f"URL Redis não suportada: {url}")
+        self.host = u.hostname or "localhost"
+        self.port = u.port or 6379
+        self.password = unquote(u.password) if u.password else None
+        self.username = unquote(u.username) if u.username else None
+        self.db = int((u.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    # -------------------------
+    # Protocolo
+    # -------------------------
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        self._local.conn = conn
+        if self.password:
+            auth = [self.username, self.password] if self.username else [self.password]
+            self._command("AUTH", *auth)
+        if self.db:
+            self._command("SELECT", str(self.db))
+        return conn
+
+    def _close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _encode(args: Tuple[Any, ...]) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a if isinstance(a, bytes) else str(a).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        return b"".join(out)
+
+    def _read(self, f) -> Any:
+        line = f.readline()
+        if not line:
+            raise ConnectionError("conexão Redis fechada")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = f.read(n + 2)
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read(f) for _ in range(n)]
+        raise RedisError(f"resposta inesperada: {line!r}")
+
+    def _command(self, *args: Any) -> Any:
+        conn = getattr(self._local, "conn", None)
+        for attempt in (1, 2):
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn[0].sendall(self._encode(args))
+                return self._read(conn[1])
+            except (OSError, ConnectionError):
+                self._close()
+                conn = None
+                if attempt == 2:
+                    raise
+
+    # -------------------------
+    # API
+    # -------------------------
+    def get(self, key: str) -> Optional[Entry]:
+        raw = self._command("GET", key)
+        if not raw or len(raw) < self._HEADER.size:
+            return None
+        fresh_until, stale_until = self._HEADER.unpack_from(raw)
+        return raw[self._HEADER.size:], fresh_until, stale_until
+
+    def set(self, key: str, data: bytes, fresh_until: float, stale_until: float) -> None:
+        ttl_ms = int(max(1.0, stale_until - time.time()) * 1000)
+        self._command("SET", key, self._HEADER.pack(fresh_until, stale_until) + data, "PX", ttl_ms)
+
+    def delete(self, key: str) -> None:
+        self._command("DEL", key)
+
+    def new_generation(self, key: str, ttl: float) -> int:
+        gen = time.time_ns()
+        self._command("SET", key, str(gen), "PX", int(max(1.0, ttl) * 1000))
+        return gen
+
+    def counter(self, key: str) -> int:
+        raw = self._command("GET", key)
+        return int(raw) if raw else 0
+
+    def clear(self) -> None:
+        # só as chaves deste app (SCAN, nunca FLUSHDB)
+        cursor = "0"
+        while True:
+            cursor_raw, keys = self._command("SCAN", cursor, "MATCH", f"{CACHE_PREFIX}:*", "COUNT", "500")
+            if keys:
+                self._command("DEL", *keys)
+            cursor = cursor_raw.decode() if isinstance(cursor_raw, bytes) else str(cursor_raw)
+            if cursor == "0":
+                break
+
+
+# =========================
+# Política (TTL, SWR, namespaces)
+# =========================
+class Cache:
+    """
+    Cache de objetos JSON com TTL, stale-while-revalidate e namespaces (ex.: um por usuário).
+    Falhas do backend nunca quebram a requisição: viram miss.
+    """
+
+    def __init__(self, backend: CacheBackend, prefix: str = CACHE_PREFIX, stale_seconds: float = CACHE_STALE_SECONDS,
+                 max_lifetime: float = CACHE_MAX_LIFETIME):
+        self.backend = backend
+        self.prefix = prefix
+        self.stale_seconds = stale_seconds
+        self.max_lifetime = max_lifetime
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+
+    def _full_key(self, namespace: str, parts: Tuple[Any, ...]) -> str:
+        gen = self.backend.counter(f"{self.prefix}:gen:{namespace}")
+        return f"{self.prefix}:{namespace}:{gen}:{make_key(*parts)}"
+
+    def invalidate(self, namespace: str) -> None:
+        """Invalida todas as entradas do namespace (troca de geração, O(1) em qualquer backend)."""
+        try:
+            self.backend.new_generation(f"{self.prefix}:gen:{namespace}", self.max_lifetime)
+        except Exception:
+            metrics.incr("cache.errors")
+
+    def get(self, namespace: str, parts: Tuple[Any, ...]) -> Optional[Any]:
+        """Valor ainda utilizável (fresco ou stale) ou None."""
+        try:
+            entry = self.backend.get(self._full_key(namespace, parts))
+        except Exception:
+            metrics.incr("cache.errors")
+            return None
+        metrics.incr("cache.hits" if entry is not None else "cache.misses")
+        return json_codec.loads(entry[0]) if entry is not None else None
+
+    def set(self, namespace: str, parts: Tuple[Any, ...], value: Any, ttl: float) -> None:
+        try:
+            key = self._full_key(namespace, parts)
+        except Exception:
+            metrics.incr("cache.errors")
+            return
+        self._store(key, value, ttl, 0.0)
+
+    def get_or_load(
+        self,
+        namespace: str,
+        parts: Tuple[Any, ...],
+        ttl: float,
+        loader: Callable[[], Any],
+        stale_seconds: Optional[float] = None,
+        raw: bool = False,
+    ) -> Any:
+        """
+        raw=True: o loader devolve bytes JSON, guardados e devolvidos como estão (sem decodificar).
+        Entradas raw e decodificadas com as mesmas partes são intercambiáveis.
+        """
+        if ttl <= 0:
+            return loader()
+        stale = self.stale_seconds if stale_seconds is None else stale_seconds
+        try:
+            key = self._full_key(namespace, parts)
+            entry = self.backend.get(key)
+        except Exception:
+            metrics.incr("cache.errors")
+            return loader()
+
+        now = time.time()
+        if entry is not None:
+            data, fresh_until, _ = entry
+            value = data if raw else json_codec.loads(data)
+            if fresh_until > now:
+                metrics.incr("cache.hits")
+                return value
+            metrics.incr("cache.stale_hits")
+            self._refresh_async(key, ttl, stale, loader, raw)
+            return value
+
+        metrics.incr("cache.misses")
+        value = loader()
+        self._store(key, value, ttl, stale, raw)
+        return value
+
+    def _store(self, key: str, value: Any, ttl: float, stale: float, raw: bool = False) -> None:
+        try:
+            data = bytes(value) if raw else json_codec.dumps(value)
+        except (TypeError, ValueError):
+            return
+        # nenhuma entrada sobrevive ao contador de geração do seu namespace (ver new_generation)
+        ttl = min(ttl, self.max_lifetime)
+        stale = min(stale, self.max_lifetime - ttl)
+        now = time.time()
+        try:
+            self.backend.set(key, data, now + ttl, now + ttl + stale)
+        except Exception:
+            metrics.incr("cache.errors")
+
+    def _refresh_async(self, key: str, ttl: float, stale: float, loader: Callable[[], Any], raw: bool) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._store(key, loader(), ttl, stale, raw)
+                metrics.incr("cache.refreshes")
+            except Exception:
+                # mantém o valor antigo até expirar de vez
+                metrics.incr("cache.refresh_errors")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name="cache-refresh", daemon=True).start()
+
+
+def parse_ttls(raw: str) -> List[Tuple[str, float]]:
+    """
+    "caminho=segundos,..." -> [(caminho, ttl)], mais específico primeiro.
+    Caminho terminado em '*' vale como prefixo; sem '*', só o caminho exato.
+    Ex.: "/me=300,/me/contacts*=60,/me/mailFolders*=15"
+    """
+    out = []
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        path, ttl = part.split("=", 1)
+        try:
+            out.append((path.strip(), float(ttl)))
+        except ValueError:
+            continue
+    return sorted(out, key=lambda p: (not p[0].endswith("*"), len(p[0])), reverse=True)
+
+
+def ttl_for(path: str, ttls: List[Tuple[str, float]], default: float = 0.0) -> float:
+    for pattern, ttl in ttls:
+        if pattern.endswith("*"):
+            if path.startswith(pattern[:-1]):
+                return ttl
+        elif path == pattern:
+            return ttl
+    return default
+
+
+_cache: Optional[Cache] = None
+_cache_lock = threading.Lock()
+
+
+def _make_backend(name: str) -> Optional[CacheBackend]:
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name == "redis":
+        return RedisBackend()
+    if name == "memory":
+        return MemoryBackend()
+    return None
+
+
+class _NullBackend(CacheBackend):
+    name = "none"
+
+    def get(self, key):
+        return None
+
+    def set(self, key, data, fresh_until, stale_until):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def new_generation(self, key, ttl):
+        return 0
+
+    def counter(self, key):
+        return 0
+
+    def clear(self):
+        pass
+
+
+def get_cache() -> Cache:
+    """Cache do processo, criado na primeira chamada conforme CACHE_BACKEND."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = Cache(_make_backend(CACHE_BACKEND) or _NullBackend())
+    return _cache
+
+
+def reset_cache() -> None:
+    """Descarta o cache do processo (ex.: no worker recém-criado por fork, que não pode herdar conexões)."""
+    global _cache, _cache_lock
+    _cache = None
+    _cache_lock = threading.Lock()
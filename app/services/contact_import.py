@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from sqlalchemy import or_, update
+
+from app.extensions import db
+from app.models.contact_import import ContactImportJob
+from app.services.ms_oauth import GRAPH_BATCH_LIMIT, build_contact_payload, graph_batch
+
+# =========================
+# Config (env)
+# =========================
+CONTACT_IMPORT_CONCURRENCY = int(os.getenv("CONTACT_IMPORT_CONCURRENCY", "2"))
+CONTACT_IMPORT_MAX_RETRIES = int(os.getenv("CONTACT_IMPORT_MAX_RETRIES", "5"))
+CONTACT_IMPORT_MAX_ERRORS = 100
+# job "running" sem checkpoint há mais que isso é dado como abandonado (worker morto) e pode ser retomado
+CONTACT_IMPORT_STALE_SECONDS = int(os.getenv("CONTACT_IMPORT_STALE_SECONDS", "300"))
+# intervalo mínimo entre linhas de progresso no stream da resposta
+CONTACT_IMPORT_PROGRESS_SECONDS = 1.0
+
+IMPORT_FORMATS = ("csv", "ndjson")
+EXTRA_FIELDS = ("companyName", "jobTitle", "department", "officeLocation", "mobilePhone", "personalNotes")
+
+_RETRY_STATUSES = {429, 503, 504}
+_MAX_RETRY_AFTER = 60.0
+
+Row = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+# =========================
+# Leitura incremental (CSV / NDJSON)
+# =========================
+def iter_rows(stream: BinaryIO, fmt: str) -> Iterator[Row]:
+    """
+    Lê o corpo linha a linha, sem carregar o arquivo inteiro.
+    Gera (numero_da_linha, registro | None, erro | None).
+    """
+    text_stream = io.TextIOWrapper(io.BufferedReader(stream), encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text_stream)
+        for n, row in enumerate(reader, start=1):
+            yield n, row, None
+        return
+
+    for n, line in enumerate(text_stream, start=1):
+        line = line.strip()
+        if not line:
+            yield n, None, None
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            yield n, None, "JSON inválido"
+            continue
+        if not isinstance(obj, dict):
+            yield n, None, "linha deve ser um objeto JSON"
+            continue
+        yield n, obj, None
+
+
+def _as_list(value: Any) -> Optional[List[str]]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [p.strip() for p in str(value).split(";") if p.strip()]
+
+
+def validate_row(row: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Valida um registro e devolve (payload_graph, erro). Colunas desconhecidas são ignoradas.
+    """
+    given = str(row.get("givenName") or "").strip()
+    if not given:
+        return None, "Campo 'givenName' é obrigatório."
+    email = str(row.get("email") or "").strip() or None
+    if email and ("@" not in email or email.startswith("@") or email.endswith("@")):
+        return None, f"E-mail inválido: {email}"
+    extra = {k: str(row[k]).strip() for k in EXTRA_FIELDS if row.get(k) not in (None, "")}
+    payload = build_contact_payload(
+        given,
+        surname=str(row.get("surname") or "").strip() or None,
+        email=email,
+        businessPhones=_as_list(row.get("businessPhones")),
+        extra=extra or None,
+    )
+    return payload, None
+
+
+# =========================
+# Envio em $batch com controle de throttling
+# =========================
+class _Throttle:
+    """Pausa compartilhada entre workers quando o Graph responde 429/503."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._until = 0.0
+
+    def backoff(self, seconds: float) -> None:
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + seconds)
+
+    def wait(self) -> None:
+        while True:
+            with self._lock:
+                delay = self._until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+
+def _retry_after(headers: Optional[Dict[str, Any]], attempt: int) -> float:
+    value = None
+    for k, v in (headers or {}).items():
+        if k.lower() == "retry-after":
+            value = v
+    try:
+        return min(float(value), _MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return min(2 ** attempt + random.random(), _MAX_RETRY_AFTER)
+
+
+def _send_batch(
+    access_token: str, items: List[Tuple[int, Dict[str, Any]]], throttle: _Throttle
+) -> List[Tuple[int, bool, Optional[str]]]:
+    """
+    Cria os contatos de 'items' via $batch. Reenvia apenas as sub-requisições
+    throttled (429/503/504), respeitando Retry-After.
+    """
+    pending = {str(row_no): payload for row_no, payload in items}
+    results: List[Tuple[int, bool, Optional[str]]] = []
+
+    for attempt in range(CONTACT_IMPORT_MAX_RETRIES + 1):
+        throttle.wait()
+        reqs = [{"id": rid, "method": "POST", "url": "/me/contacts", "body": body} for rid, body in pending.items()]
+        try:
+            responses = graph_batch(access_token, reqs)
+        except requests.HTTPError as e:
+            status = getattr(e.response, "status_code", None)
+            if status in _RETRY_STATUSES and attempt < CONTACT_IMPORT_MAX_RETRIES:
+                throttle.backoff(_retry_after(getattr(e.response, "headers", None), attempt))
+                continue
+            # o que já foi criado nas tentativas anteriores não pode ser reenviado numa retomada
+            e.partial_results = results
+            raise
+
+        retry_delay = 0.0
+        for resp in responses:
+            rid = str(resp.get("id"))
+            if rid not in pending:
+                continue
+            status = int(resp.get("status") or 0)
+            if 200 <= status < 300:
+                results.append((int(rid), True, None))
+                pending.pop(rid)
+            elif status in _RETRY_STATUSES and attempt < CONTACT_IMPORT_MAX_RETRIES:
+                retry_delay = max(retry_delay, _retry_after(resp.get("headers"), attempt))
+            else:
+                err = ((resp.get("body") or {}).get("error") or {}).get("message") or f"HTTP {status}"
+                results.append((int(rid), False, err))
+                pending.pop(rid)
+
+        if not pending:
+            break
+        throttle.backoff(retry_delay)
+
+    for rid in pending:
+        results.append((int(rid), False, "Limite de tentativas excedido (throttling)."))
+    return results
+
+
+# =========================
+# Job
+# =========================
+def _stale_before() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=CONTACT_IMPORT_STALE_SECONDS)
+
+
+def job_to_dict(job: ContactImportJob) -> Dict[str, Any]:
+    status = job.status
+    if status == "running" and job.updated_at and job.updated_at < _stale_before():
+        # o processo que rodava o job morreu sem gravar o estado final
+        status = "interrupted"
+    return {
+        "job_id": job.id,
+        "status": status,
+        "format": job.format,
+        "rows_read": job.rows_read,
+        "rows_committed": job.rows_committed,
+        "created": job.created,
+        "failed": job.failed,
+        "invalid": job.invalid,
+        "errors": json.loads(job.errors) if job.errors else [],
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def claim_job(job_id: str, owner: str) -> bool:
+    """
+    Marca o job como "running" para retomá-lo, só se ninguém estiver rodando: UPDATE condicional,
+    então duas retomadas simultâneas do mesmo job_id não passam juntas. Jobs concluídos não são
+    reabertos; "running" sem checkpoint há CONTACT_IMPORT_STALE_SECONDS conta como abandonado.
+    """
+    result = db.session.execute(
+        update(ContactImportJob)
+        .where(
+            ContactImportJob.id == job_id,
+            ContactImportJob.owner == owner,
+            ContactImportJob.status != "completed",
+            or_(ContactImportJob.status != "running", ContactImportJob.updated_at < _stale_before()),
+        )
+        .values(status="running", finished_at=None, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def iter_import(job: ContactImportJob, rows: Iterator[Row], access_token: str) -> Iterator[Dict[str, Any]]:
+    """
+    Consome 'rows' em lotes de 20 e envia até CONTACT_IMPORT_CONCURRENCY lotes em paralelo.
+    O progresso é gravado no job a cada lote concluído e devolvido (job_to_dict) no máximo
+    a cada CONTACT_IMPORT_PROGRESS_SECONDS.
+
+    Retomada: o checkpoint grava rows_read e, em rows_pending, as linhas enviadas cujo
+    resultado ainda não voltou (lotes em voo, lote abortado, lote ainda em montagem).
+    Numa nova execução só essas linhas e as posteriores a rows_read são processadas; um
+    lote que terminou depois de outro que falhou não é reenviado (nem contado de novo).
+    Toda escrita no banco acontece nesta thread; os workers só falam com o Graph.
+    """
+    errors: List[Dict[str, Any]] = json.loads(job.errors) if job.errors else []
+    resume_after = job.rows_committed
+    read_before = job.rows_read
+    carried = set(json.loads(job.rows_pending) if job.rows_pending else [])
+    throttle = _Throttle()
+    in_flight: Dict[Future, List[int]] = {}
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+    last_row = resume_after
+    last_progress = time.monotonic()
+
+    def record_error(row_no: int, message: str) -> None:
+        if len(errors) < CONTACT_IMPORT_MAX_ERRORS:
+            errors.append({"row": row_no, "error": message})
+
+    def checkpoint() -> None:
+        # pendentes da execução anterior que ainda não foram relidas continuam pendentes
+        pending = {r for r in carried if r > last_row}
+        pending.update(r for rows_ in in_flight.values() for r in rows_)
+        pending.update(r for r, _ in batch)
+        job.rows_read = max(job.rows_read, last_row)
+        job.rows_committed = (min(pending) - 1) if pending else job.rows_read
+        job.rows_pending = json.dumps(sorted(pending)) if pending else None
+        job.errors = json.dumps(errors, ensure_ascii=False)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    def apply(results: List[Tuple[int, bool, Optional[str]]]) -> None:
+        for row_no, ok, err in results:
+            if ok:
+                job.created += 1
+            else:
+                job.failed += 1
+                record_error(row_no, err or "erro desconhecido")
+
+    def collect(done) -> None:
+        for fut in done:
+            results = fut.result()
+            in_flight.pop(fut)
+            apply(results)
+        checkpoint()
+
+    def salvage() -> None:
+        # lotes que terminaram saem de in_flight; de um lote abortado sai só o que já tem resultado
+        for fut in list(in_flight):
+            if fut.cancelled():
+                continue
+            exc = fut.exception()
+            if exc is None:
+                apply(fut.result())
+                in_flight.pop(fut)
+                continue
+            partial = getattr(exc, "partial_results", None) or []
+            apply(partial)
+            handled = {row_no for row_no, _, _ in partial}
+            in_flight[fut] = [r for r in in_flight[fut] if r not in handled]
+
+    def progress() -> Iterator[Dict[str, Any]]:
+        nonlocal last_progress
+        now = time.monotonic()
+        if now - last_progress >= CONTACT_IMPORT_PROGRESS_SECONDS:
+            last_progress = now
+            yield job_to_dict(job)
+
+    job.status = "running"
+    job.finished_at = None
+    db.session.commit()
+
+    with ThreadPoolExecutor(max_workers=max(1, CONTACT_IMPORT_CONCURRENCY)) as pool:
+        try:
+            for row_no, row, parse_err in rows:
+                if row_no <= resume_after:
+                    continue
+                last_row = row_no
+                if row_no <= read_before and row_no not in carried:
+                    continue
+                if parse_err:
+                    job.invalid += 1
+                    record_error(row_no, parse_err)
+                    continue
+                if row is None:
+                    continue
+                payload, err = validate_row(row)
+                if err:
+                    job.invalid += 1
+                    record_error(row_no, err)
+                    continue
+
+                batch.append((row_no, payload))
+                if len(batch) >= GRAPH_BATCH_LIMIT:
+                    fut = pool.submit(_send_batch, access_token, batch, throttle)
+                    in_flight[fut] = [r for r, _ in batch]
+                    batch = []
+                    # backpressure: não lê mais o corpo enquanto todos os workers estão ocupados
+                    if len(in_flight) >= CONTACT_IMPORT_CONCURRENCY:
+                        done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                        collect(done)
+                        yield from progress()
+
+            if batch:
+                fut = pool.submit(_send_batch, access_token, batch, throttle)
+                in_flight[fut] = [r for r, _ in batch]
+                batch = []
+            while in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                collect(done)
+                yield from progress()
+        except BaseException as e:
+            # salva o que já terminou; o restante pode ser retomado com o mesmo job_id
+            # (inclui GeneratorExit: o cliente desconectou no meio do stream)
+            for f in in_flight:
+                f.cancel()
+            wait(list(in_flight))
+            salvage()
+            job.status = "interrupted"
+            record_error(last_row, f"Import interrompido: {e or type(e).__name__}")
+            checkpoint()
+            raise
+
+    job.status = "completed"
+    job.finished_at = datetime.utcnow()
+    checkpoint()
+
+
+def run_import(job: ContactImportJob, rows: Iterator[Row], access_token: str) -> ContactImportJob:
+    """Executa o import inteiro, sem acompanhar o progresso."""
+    for _ in iter_import(job, rows, access_token):
+        pass
+    return job
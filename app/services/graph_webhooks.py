@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import hmac
+import os
+import queue
+import secrets
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.extensions import db
+from app.models.graph_subscription import GraphSubscription
+from app.models.mail_index import MailSyncState
+from app.services import metrics
+from app.services.cache import CACHE_BACKEND
+from app.services.ms_oauth import graph_delete, graph_patch, graph_post, invalidate_owner_cache
+
+# =========================
+# Config (env)
+# =========================
+# URL pública (HTTPS) que o Graph chama, ex.: https://api.exemplo.com/webhooks/graph
+GRAPH_WEBHOOK_URL = os.getenv("GRAPH_WEBHOOK_URL", "").strip()
+# contatos/mensagens: no máximo 4230 minutos por assinatura
+GRAPH_SUBSCRIPTION_MINUTES = int(os.getenv("GRAPH_SUBSCRIPTION_MINUTES", "4200"))
+GRAPH_WEBHOOK_QUEUE_SIZE = int(os.getenv("GRAPH_WEBHOOK_QUEUE_SIZE", "1000"))
+# assinaturas lidas do banco valem por este tempo em cada processo (remoções feitas por outro worker)
+GRAPH_WEBHOOK_STATE_TTL = 60.0
+
+RESOURCES: Dict[str, str] = {
+    "contacts": "me/contacts",
+    "mail": "me/messages",
+}
+CHANGE_TYPES = "created,updated,deleted"
+
+
+class SubscriptionError(RuntimeError):
+    """Configuração ausente ou falha ao criar/renovar assinatura."""
+
+
+def cache_backend_problem() -> Optional[str]:
+    """
+    A notificação chega a um worker só; com cache por processo, os outros continuariam servindo
+    contatos/e-mails antigos até o TTL + stale. Exige sqlite/redis (ou nenhum cache).
+    """
+    if CACHE_BACKEND == "memory":
+        return ("CACHE_BACKEND=memory é por processo: a invalidação de um webhook não chega aos outros workers. "
+                "Use CACHE_BACKEND=sqlite ou redis com GRAPH_WEBHOOK_URL.")
+    return None
+
+
+def warn_if_cache_not_shared(app) -> None:
+    """Chamado no create_app: avisa logo na subida, não só quando alguém tenta assinar."""
+    problem = cache_backend_problem() if GRAPH_WEBHOOK_URL else None
+    if problem:
+        app.logger.warning("graph webhooks: %s", problem)
+
+
+# =========================
+# Assinaturas
+# =========================
+def _expiration(now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.utcnow()) + timedelta(minutes=GRAPH_SUBSCRIPTION_MINUTES)
+
+
+def _iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat() + "Z"
+
+
+def subscription_to_dict(sub: GraphSubscription) -> Dict[str, Any]:
+    return {
+        "id": sub.id,
+        "category": sub.category,
+        "resource": sub.resource,
+        "status": sub.status,
+        "expires_at": sub.expires_at.isoformat() if sub.expires_at else None,
+        "renewed_at": sub.renewed_at.isoformat() if sub.renewed_at else None,
+        "last_notification_at": sub.last_notification_at.isoformat() if sub.last_notification_at else None,
+    }
+
+
+def create_subscriptions(access_token: str, owner: str, categories: Iterable[str]) -> List[GraphSubscription]:
+    """
+    Cria (ou renova, se já existir ativa) uma assinatura por categoria para o usuário.
+    """
+    if not GRAPH_WEBHOOK_URL:
+        raise SubscriptionError("GRAPH_WEBHOOK_URL não configurada.")
+    problem = cache_backend_problem()
+    if problem:
+        raise SubscriptionError(problem)
+    out: List[GraphSubscription] = []
+    for category in categories:
+        existing = GraphSubscription.query.filter_by(owner=owner, category=category, status="active").first()
+        if existing is not None:
+            out.append(renew_subscription(access_token, existing))
+            continue
+        client_state = secrets.token_urlsafe(32)
+        expires = _expiration()
+        data = graph_post("/subscriptions", access_token, payload={
+            "changeType": CHANGE_TYPES,
+            "notificationUrl": GRAPH_WEBHOOK_URL,
+            "lifecycleNotificationUrl": GRAPH_WEBHOOK_URL,
+            "resource": RESOURCES[category],
+            "expirationDateTime": _iso(expires),
+            "clientState": client_state,
+        })
+        sub = GraphSubscription(
+            id=data["id"],
+            owner=owner,
+            category=category,
+            resource=RESOURCES[category],
+            client_state=client_state,
+            status="active",
+            expires_at=expires,
+        )
+        db.session.add(sub)
+        db.session.commit()
+        _known_states.pop(sub.id, None)
+        out.append(sub)
+    return out
+
+
+def renew_subscription(access_token: str, sub: GraphSubscription) -> GraphSubscription:
+    expires = _expiration()
+    graph_patch(f"/subscriptions/{sub.id}", access_token, payload={"expirationDateTime": _iso(expires)})
+    sub.expires_at = expires
+    sub.renewed_at = datetime.utcnow()
+    sub.status = "active"
+    db.session.commit()
+    return sub
+
+
+def renew_expiring(access_token: str, owner: str, within: timedelta = timedelta(hours=12)) -> List[GraphSubscription]:
+    """Renova as assinaturas do usuário que vencem dentro de 'within' (ou pediram reautorização)."""
+    limit = datetime.utcnow() + within
+    subs = GraphSubscription.query.filter(
+        GraphSubscription.owner == owner,
+        GraphSubscription.status != "removed",
+        db.or_(GraphSubscription.expires_at <= limit, GraphSubscription.status == "reauthorization_required"),
+    ).all()
+    return [renew_subscription(access_token, s) for s in subs]
+
+
+def delete_subscription(access_token: str, sub: GraphSubscription) -> None:
+    try:
+        graph_delete(f"/subscriptions/{sub.id}", access_token)
+    except Exception as e:
+        # já removida no Graph: apaga localmente mesmo assim
+        if getattr(getattr(e, "response", None), "status_code", None) != 404:
+            raise
+    db.session.delete(sub)
+    db.session.commit()
+    _known_states.pop(sub.id, None)
+
+
+# =========================
+# Recebimento
+# =========================
+# subscriptionId -> ((clientState, owner, category), lido_em); evita ir ao banco a cada notificação.
+# Por processo: a entrada vence em GRAPH_WEBHOOK_STATE_TTL para enxergar remoções feitas por outro worker.
+_known_states: Dict[str, Tuple[Tuple[str, str, str], float]] = {}
+_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=GRAPH_WEBHOOK_QUEUE_SIZE)
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+def _lookup(subscription_ids: Set[str]) -> Dict[str, Tuple[str, str, str]]:
+    now = time.monotonic()
+    missing = [s for s in subscription_ids
+               if s not in _known_states or now - _known_states[s][1] > GRAPH_WEBHOOK_STATE_TTL]
+    if missing:
+        for s in missing:
+            _known_states.pop(s, None)
+        for sub in GraphSubscription.query.filter(
+            GraphSubscription.id.in_(missing), GraphSubscription.status != "removed"
+        ).all():
+            _known_states[sub.id] = ((sub.client_state, sub.owner, sub.category), now)
+    return {s: _known_states[s][0] for s in subscription_ids if s in _known_states}
+
+
+def accept_notifications(payload: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Confere clientState de cada notificação e enfileira as válidas.
+    Retorna (aceitas, rejeitadas). Não faz nada lento: o processamento é no worker.
+    """
+    items = payload.get("value") if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        return 0, 0
+    known = _lookup({str(n.get("subscriptionId")) for n in items if isinstance(n, dict)})
+
+    accepted = rejected = 0
+    for n in items:
+        if not isinstance(n, dict):
+            rejected += 1
+            continue
+        entry = known.get(str(n.get("subscriptionId")))
+        if entry is None or not hmac.compare_digest(str(n.get("clientState") or ""), entry[0]):
+            rejected += 1
+            continue
+        try:
+            _queue.put_nowait({
+                "subscription_id": str(n["subscriptionId"]),
+                "owner": entry[1],
+                "category": entry[2],
+                "change_type": n.get("changeType"),
+                "lifecycle_event": n.get("lifecycleEvent"),
+            })
+        except queue.Full:
+            raise QueueFull("fila de notificações cheia")
+        accepted += 1
+
+    metrics.incr("webhook.accepted", accepted)
+    if rejected:
+        metrics.incr("webhook.rejected", rejected)
+    return accepted, rejected
+
+
+def ensure_webhook_worker(app) -> None:
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            return
+        _worker = threading.Thread(target=_worker_loop, args=(app,), name="graph-webhooks", daemon=True)
+        _worker.start()
+
+
+def _worker_loop(app) -> None:
+    while True:
+        batch = [_queue.get()]
+        # rajadas do Graph: junta o que já chegou e invalida cada usuário/categoria uma vez
+        while len(batch) < 100:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with app.app_context():
+                process_notifications(batch)
+        except Exception:
+            app.logger.exception("graph webhooks: falha ao processar notificações")
+
+
+def drain_queue(app) -> int:
+    """Processa o que ainda está na fila (ex.: worker do Gunicorn saindo); retorna quantas notificações."""
+    batch: List[Dict[str, Any]] = []
+    while True:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        with app.app_context():
+            process_notifications(batch)
+    return len(batch)
+
+
+def process_notifications(batch: List[Dict[str, Any]]) -> Dict[str, Set[str]]:
+    """Invalida caches e marca o índice de e-mail para delta-sync, por usuário afetado."""
+    affected: Dict[str, Set[str]] = defaultdict(set)
+    now = datetime.utcnow()
+    lifecycle: Dict[str, str] = {}
+    for n in batch:
+        event = n.get("lifecycle_event")
+        if event == "missed":
+            # notificações perdidas: não dá para saber o que mudou
+            affected[n["owner"]].update(RESOURCES)
+        elif event in ("reauthorizationRequired", "subscriptionRemoved"):
+            lifecycle[n["subscription_id"]] = event
+        else:
+            affected[n["owner"]].add(n["category"])
+
+    for owner, categories in affected.items():
+        invalidate_owner_cache(owner, categories)
+        if "mail" in categories:
+            # sem token guardado não há como sincronizar aqui: a próxima busca faz o delta
+            MailSyncState.query.filter_by(owner=owner).update({"synced_at": None})
+        metrics.incr("webhook.invalidations", len(categories))
+
+    subs = {n["subscription_id"] for n in batch}
+    for sub in GraphSubscription.query.filter(GraphSubscription.id.in_(subs)).all():
+        sub.last_notification_at = now
+        event = lifecycle.get(sub.id)
+        if event == "reauthorizationRequired":
+            sub.status = "reauthorization_required"
+        elif event == "subscriptionRemoved":
+            sub.status = "removed"
+            _known_states.pop(sub.id, None)
+    db.session.commit()
+    return affected
+
+
+# =========================
+# Simulador local
+# =========================
+def simulated_notification(
+    sub: GraphSubscription,
+    change_type: str = "updated",
+    lifecycle_event: Optional[str] = None,
+    client_state: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Corpo no formato que o Graph envia, para testar o receptor sem túnel público."""
+    item: Dict[str, Any] = {
+        "subscriptionId": sub.id,
+        "clientState": sub.client_state if client_state is None else client_state,
+        "subscriptionExpirationDateTime": _iso(sub.expires_at),
+        "tenantId": str(uuid.UUID(int=0)),
+    }
+    if lifecycle_event:
+        item["lifecycleEvent"] = lifecycle_event
+    else:
+        res_id = f"AAMk{uuid.uuid4().hex}"
+        item.update({
+            "changeType": change_type,
+            "resource": f"Users/{sub.owner}/{'Messages' if sub.category == 'mail' else 'Contacts'}/{res_id}",
+            "resourceData": {"@odata.type": "#Microsoft.Graph.Message" if sub.category == "mail"
+                             else "#Microsoft.Graph.Contact", "id": res_id},
+        })
+    return {"value": [item]}
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import os
+import re
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# =========================
+# Config (env)
+# =========================
+# limite padrão do texto extraído (caracteres); ~4 caracteres por token
+MAIL_TEXT_MAX_CHARS = int(os.getenv("MAIL_TEXT_MAX_CHARS", "8000"))
+# blocos pequenos: o parser para logo depois do marcador de citação
+_FEED_CHUNK = 4 * 1024
+
+_SKIP_TAGS = {"script", "style", "head", "title", "noscript", "template", "svg", "xml", "o:p"}
+_BLOCK_TAGS = {
+    "p", "div", "br", "li", "tr", "table", "ul", "ol", "blockquote", "hr", "section", "article",
+    "h1", "h2", "h3", "h4", "h5", "h6", "pre", "header", "footer",
+}
+_VOID_TAGS = {"br", "hr", "img", "meta", "link", "input", "col", "area", "base", "wbr", "source"}
+
+# Onde começa o histórico citado / assinatura (Outlook, Gmail, Yahoo, Apple Mail, Thunderbird)
+_QUOTE_IDS = {"divrplyfwdmsg", "appendonsend", "stopspelling", "mail-editor-reference-message-container"}
+_QUOTE_CLASSES = {"gmail_quote", "yahoo_quoted", "moz-cite-prefix", "ms-outlook-mobile-reference-message",
+                  "protonmail_quote", "zmail_extra"}
+_SIGNATURE_IDS = {"signature", "ms-outlook-mobile-signature", "applemailsignature"}
+_SIGNATURE_CLASSES = {"gmail_signature", "moz-signature", "elementtoproof-signature"}
+
+# Cabeçalhos de resposta em texto ("Em ... escreveu:", "On ... wrote:", bloco De:/Enviado: do Outlook)
+_REPLY_HEADER_RE = re.compile(
+    r"^(?:"
+    r"(?:em|on|le|am|el)\s.{0,200}?(?:escreveu|wrote|a écrit|schrieb|escribió)\s*:"
+    r"|-{2,}\s*(?:original message|mensagem original|forwarded message|mensagem encaminhada)\s*-{2,}"
+    r"|_{10,}"
+    r"|(?:de|from)\s*:\s.+\n\s*(?:enviad[oa]|sent|data|date)\s*:"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
+_SIGNATURE_RE = re.compile(
+    r"^(?:--\s*$|enviado do meu |sent from my |obter o outlook para )",
+    re.IGNORECASE | re.MULTILINE,
+)
+_WS_RE = re.compile(r"[ \t\r\f\v\u00a0\u200b]+")
+_BLANKS_RE = re.compile(r"\n\s*\n\s*\n+")
+
+
+def _is_tracking_pixel(attrs: Dict[str, str]) -> bool:
+    w, h = attrs.get("width", "").strip("px "), attrs.get("height", "").strip("px ")
+    if w in ("0", "1") or h in ("0", "1"):
+        return True
+    style = attrs.get("style", "").replace(" ", "").lower()
+    return "display:none" in style or "width:1px" in style or "height:1px" in style
+
+
+class _Extractor(HTMLParser):
+    """Converte HTML em texto de forma incremental; para de consumir ao achar citação ou atingir o limite."""
+
+    def __init__(self, max_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.size = 0
+        self.skip_depth = 0
+        self.quote_depth = 0
+        self.skipped_quote = False
+        self.stopped: Optional[str] = None  # "quote" | "signature" | "cap"
+        self._href: Optional[str] = None
+        self._link_start = 0
+
+    def _emit(self, text: str) -> None:
+        if self.stopped:
+            return
+        room = self.max_chars - self.size
+        if len(text) >= room:
+            text = text[:room]
+            self.stopped = "cap"
+        self.parts.append(text)
+        self.size += len(text)
+
+    def handle_starttag(self, tag, attrs):
+        if self.stopped:
+            return
+        a = {k.lower(): (v or "") for k, v in attrs}
+        el_id = a.get("id", "").lower()
+        classes = set(a.get("class", "").lower().split())
+        # marcadores de histórico (e o <blockquote type="cite"> do Apple Mail/Thunderbird): o resto é resposta anterior
+        if el_id in _QUOTE_IDS or classes & _QUOTE_CLASSES or (tag == "blockquote" and a.get("type") == "cite"):
+            self.stopped = "quote"
+            return
+        if el_id in _SIGNATURE_IDS or classes & _SIGNATURE_CLASSES:
+            self.stopped = "signature"
+            return
+        # citação no meio do texto: pula só o trecho citado e continua depois dele
+        if tag == "blockquote":
+            self.quote_depth += 1
+            self.skipped_quote = True
+            return
+        if tag in _SKIP_TAGS:
+            if tag not in _VOID_TAGS:
+                self.skip_depth += 1
+            return
+        if self.skip_depth or self.quote_depth:
+            return
+        if tag == "img":
+            alt = a.get("alt", "").strip()
+            if alt and not _is_tracking_pixel(a):
+                self._emit(f"[imagem: {alt}]")
+            return
+        if tag == "a":
+            self._href = a.get("href", "")
+            self._link_start = len(self.parts)
+        if tag in _BLOCK_TAGS:
+            self._emit("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and tag not in _VOID_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+            return
+        if tag == "blockquote" and self.quote_depth:
+            self.quote_depth -= 1
+            return
+        if self.stopped or self.skip_depth or self.quote_depth:
+            return
+        if tag == "a" and self._href is not None:
+            href = self._href
+            self._href = None
+            # mostra o destino de links http(s) cujo texto não é a própria URL
+            if href.startswith(("http://", "https://")) and len(href) <= 200:
+                text = "".join(self.parts[self._link_start:]).strip()
+                if text and href not in text:
+                    self._emit(f" <{href}>")
+        if tag in _BLOCK_TAGS:
+            self._emit("\n")
+
+    def handle_data(self, data):
+        if self.stopped or self.skip_depth or self.quote_depth:
+            return
+        self._emit(data)
+
+
+def _normalize(text: str) -> str:
+    lines = [_WS_RE.sub(" ", ln).strip() for ln in text.split("\n")]
+    return _BLANKS_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _cut_text_markers(text: str) -> Tuple[str, Optional[str]]:
+    """Corta histórico/assinatura que não vieram marcados no HTML (ou em corpos texto puro)."""
+    reason = None
+    m = _REPLY_HEADER_RE.search(text)
+    if m and m.start() > 0:
+        text, reason = text[:m.start()], "quote"
+    m = _SIGNATURE_RE.search(text)
+    if m and m.start() > 0:
+        text, reason = text[:m.start()], reason or "signature"
+    kept = [ln for ln in text.split("\n") if not ln.lstrip().startswith(">")]
+    if len(kept) != text.count("\n") + 1:
+        reason = reason or "quote"
+    return "\n".join(kept).rstrip(), reason
+
+
+def iter_chunks(html: str, size: int = _FEED_CHUNK) -> Iterable[str]:
+    for i in range(0, len(html), size):
+        yield html[i:i + size]
+
+
+def html_to_text(
+    chunks: Iterable[str] | str,
+    max_chars: Optional[int] = None,
+    content_type: str = "html",
+) -> Dict[str, object]:
+    """
+    Extrai texto legível de um corpo de e-mail, consumindo o HTML em blocos e parando cedo
+    (citação, assinatura ou limite). Remove scripts/estilos, pixels de rastreio e o histórico citado.
+    Retorna { text, truncated, stopped_at, consumed_chars }.
+    """
+    limit = MAIL_TEXT_MAX_CHARS if max_chars is None else max(1, max_chars)
+    if isinstance(chunks, str):
+        chunks = iter_chunks(chunks)
+
+    consumed = 0
+    if content_type.lower() == "text":
+        buf: List[str] = []
+        for chunk in chunks:
+            buf.append(chunk)
+            consumed += len(chunk)
+            # margem para cortar marcadores e normalizar espaços
+            if consumed >= limit * 2:
+                break
+        raw, stopped = "\n".join("".join(buf).splitlines()), None
+    else:
+        parser = _Extractor(limit * 2)
+        for chunk in chunks:
+            parser.feed(chunk)
+            consumed += len(chunk)
+            if parser.stopped:
+                break
+        if not parser.stopped:
+            parser.close()
+        raw, stopped = "".join(parser.parts), parser.stopped
+        if not stopped and parser.skipped_quote:
+            stopped = "quote"
+
+    text, marker = _cut_text_markers(_normalize(raw))
+    truncated = stopped == "cap" or len(text) > limit
+    if truncated:
+        text = text[:limit].rstrip()
+    return {
+        "text": text,
+        "truncated": truncated,
+        "stopped_at": "cap" if truncated else (stopped or marker),
+        "consumed_chars": consumed,
+    }
+
+
+BODY_FORMATS = ("html", "text", "summary")
+
+
+def body_as_text(body: Optional[Dict[str, str]], max_chars: Optional[int] = None) -> Dict[str, object]:
+    """Recurso 'body' do Graph ({contentType, content}) -> corpo em texto limpo, no mesmo formato de saída."""
+    body = body or {}
+    content = body.get("content") or ""
+    out = html_to_text(content, max_chars=max_chars, content_type=body.get("contentType") or "html")
+    return {
+        "contentType": "text",
+        "content": out["text"],
+        "truncated": out["truncated"],
+        "stopped_at": out["stopped_at"],
+        "original_chars": len(content),
+    }
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Callable, Optional
+
+from flask import Response, current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:  # opcional: sem orjson tudo continua funcionando com o json da stdlib
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# =========================
+# Config (env)
+# =========================
+# auto (orjson se instalado) | orjson | stdlib
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").strip().lower()
+# chaves ordenadas deixam a saída (e o ETag) estável; desligar economiza CPU em payloads grandes
+JSON_SORT_KEYS = os.getenv("JSON_SORT_KEYS", "true").lower() in ("1", "true", "yes", "y")
+
+if JSON_BACKEND == "orjson" and orjson is None:
+    raise RuntimeError("JSON_BACKEND=orjson, mas o pacote orjson não está instalado.")
+USE_ORJSON = orjson is not None and JSON_BACKEND != "stdlib"
+BACKEND_NAME = "orjson" if USE_ORJSON else "stdlib"
+
+
+def dumps(
+    obj: Any,
+    sort_keys: bool = False,
+    indent: bool = False,
+    default: Optional[Callable[[Any], Any]] = None,
+) -> bytes:
+    """Serializa em JSON compacto (UTF-8)."""
+    if USE_ORJSON:
+        # datetime fica com o 'default' (mesmo formato do jsonify padrão do Flask)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(
+        obj,
+        default=default,
+        sort_keys=sort_keys,
+        ensure_ascii=False,
+        indent=2 if indent else None,
+        separators=None if indent else (",", ":"),
+    ).encode()
+
+
+def loads(data: bytes | str) -> Any:
+    if USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Provider do Flask (jsonify, request.get_json) usando orjson quando disponível."""
+
+    sort_keys = JSON_SORT_KEYS
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs or not USE_ORJSON:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=self.sort_keys, default=self.default).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if kwargs or not USE_ORJSON:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = dumps(obj, sort_keys=self.sort_keys, indent=indent, default=self.default)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+
+def raw_json_response(data: bytes, status: int = 200) -> Response:
+    """
+    Devolve bytes JSON já prontos (ex.: corpo do Graph ou do cache) sem decodificar/reserializar.
+    Use só quando a rota não transforma o payload.
+    """
+    return current_app.response_class(data, status=status, mimetype="application/json")
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _first_object(text: str, start: int = 0) -> Optional[Dict[str, Any]]:
+    """Primeiro objeto JSON completo e válido a partir de 'start' (ignora prosa ao redor)."""
+    decoder = json.JSONDecoder()
+    pos = text.find("{", start)
+    while pos != -1:
+        try:
+            obj, _ = decoder.raw_decode(text, pos)
+            if isinstance(obj, dict):
+                return obj
+        except json.JSONDecodeError:
+            pass
+        pos = text.find("{", pos + 1)
+    return None
+
+
+def _repair_truncated(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Varre o texto uma vez a partir do primeiro '{' guardando o último ponto em que
+    um valor terminou (ou um container abriu); corta ali e fecha os colchetes/chaves abertos.
+    Recupera respostas cortadas por maxOutputTokens: o token pela metade no fim
+    ('{"a": 12', '{"a": tru', '{"a": "tex') é descartado junto com a sua chave.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+
+    stack: List[str] = []
+    # por nível de objeto: True enquanto a próxima string é uma chave
+    expect_key: List[bool] = []
+    in_string = escape = False
+    string_is_key = False
+    safe: Optional[Tuple[int, str]] = None
+
+    def closers() -> str:
+        return "".join(_CLOSERS[c] for c in reversed(stack))
+
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                if not string_is_key:
+                    safe = (i + 1, closers())
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and expect_key[-1]
+        elif ch in "{[":
+            stack.append(ch)
+            expect_key.append(ch == "{")
+            # container vazio é sempre um corte válido ('{"a": [' -> '{"a": []}')
+            safe = (i + 1, closers())
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            expect_key.pop()
+            safe = (i + 1, closers())
+            if not stack:
+                break
+        elif ch == ":":
+            if expect_key:
+                expect_key[-1] = False
+        elif ch == ",":
+            if stack and stack[-1] == "{":
+                expect_key[-1] = True
+        elif not ch.isspace():
+            # número/literal: só é seguro se terminou num delimitador antes do fim do texto
+            j = i
+            while j < n and text[j] not in ",}] \t\r\n":
+                j += 1
+            i = j
+            if j < n:
+                safe = (j, closers())
+            continue
+        i += 1
+
+    if safe is None:
+        return None
+    cut, closing = safe
+    candidate = text[start:cut].rstrip().rstrip(",") + closing
+    try:
+        obj = json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def extract_json_object(text: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Extrai um objeto JSON de uma resposta de LLM de forma tolerante.
+    Retorna (objeto | None, estratégia): "strict", "embedded", "repaired" ou "failed".
+
+    >>> extract_json_object('Claro! {"action": "list_inbox", "params": {}} Pronto.')
+    ({'action': 'list_inbox', 'params': {}}, 'embedded')
+    >>> extract_json_object('{"action": "list_inbox", "params": {"top": 12')
+    ({'action': 'list_inbox', 'params': {}}, 'repaired')
+    >>> extract_json_object('{"a": 1, "b": tru')
+    ({'a': 1}, 'repaired')
+    >>> extract_json_object('{"a": 12')
+    ({}, 'repaired')
+    >>> extract_json_object('{"items": [{"id": "1"}, {"id": "2", "summary": "cor')
+    ({'items': [{'id': '1'}, {'id': '2'}]}, 'repaired')
+    >>> extract_json_object('{"a": [1, 2')
+    ({'a': [1]}, 'repaired')
+    >>> extract_json_object('sem json')
+    (None, 'failed')
+    """
+    t = (text or "").strip()
+    try:
+        obj = json.loads(t)
+        if isinstance(obj, dict):
+            return obj, "strict"
+    except json.JSONDecodeError:
+        pass
+
+    # o objeto externo vem primeiro: se ele estiver completo, é a resposta
+    first = t.find("{")
+    if first != -1:
+        try:
+            obj, _ = json.JSONDecoder().raw_decode(t, first)
+            if isinstance(obj, dict):
+                return obj, "embedded"
+        except json.JSONDecodeError:
+            pass
+
+    # incompleto (cortado): fecha o que foi aberto antes de procurar objetos internos
+    obj = _repair_truncated(t)
+    if obj is not None:
+        return obj, "repaired"
+
+    obj = _first_object(t, first + 1) if first != -1 else None
+    if obj is not None:
+        return obj, "embedded"
+    return None, "failed"
@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from jinja2 import StrictUndefined, TemplateError
+from jinja2.sandbox import SandboxedEnvironment
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models.mail_dispatch import MailDispatchJob, MailDispatchMessage
+from app.services.ms_oauth import build_message, graph_get, graph_post
+
+# =========================
+# Config (env)
+# =========================
+# Exchange Online limita cada caixa a 30 mensagens/minuto.
+MAIL_DISPATCH_PER_MINUTE = int(os.getenv("MAIL_DISPATCH_PER_MINUTE", "30"))
+MAIL_DISPATCH_WORKERS = int(os.getenv("MAIL_DISPATCH_WORKERS", "2"))
+MAIL_DISPATCH_MAX_ATTEMPTS = int(os.getenv("MAIL_DISPATCH_MAX_ATTEMPTS", "5"))
+MAIL_DISPATCH_POLL_INTERVAL = float(os.getenv("MAIL_DISPATCH_POLL_INTERVAL", "2"))
+MAIL_BULK_MAX_RECIPIENTS = int(os.getenv("MAIL_BULK_MAX_RECIPIENTS", "1000"))
+
+# Tempo que uma mensagem fica reservada ("sending") antes de ser considerada abandonada.
+_LEASE = timedelta(minutes=5)
+_RETRY_STATUSES = {429, 503, 504}
+
+# Propriedade estendida gravada no rascunho: permite descobrir, após um crash,
+# se a mensagem já foi enviada (Sent Items) ou se o rascunho ainda existe (Drafts).
+DISPATCH_KEY_PROPERTY = "String {3c5a1e0e-6f0b-4d8e-9a57-2b1f4f6c9d21} Name ConectaDispatchKey"
+
+
+class TemplateRenderError(ValueError):
+    """Template de assunto/corpo inválido ou variável ausente para um destinatário."""
+
+
+# =========================
+# Renderização (mail-merge)
+# =========================
+_subject_env = SandboxedEnvironment(autoescape=False, undefined=StrictUndefined)
+_body_env = SandboxedEnvironment(autoescape=True, undefined=StrictUndefined)
+
+
+def render_bulk(subject_tpl: str, body_tpl: str, recipients: List[Any]) -> List[Tuple[str, str, str]]:
+    """
+    Renderiza assunto/corpo por destinatário (Jinja2 em sandbox; corpo com autoescape).
+    recipients: ["a@x.com", ...] ou [{ "email": "a@x.com", "vars": { "nome": "Ana" } }, ...]
+    Retorna [(email, assunto, corpo_html), ...].
+    """
+    try:
+        subject_t = _subject_env.from_string(subject_tpl)
+        body_t = _body_env.from_string(body_tpl)
+    except TemplateError as e:
+        raise TemplateRenderError(f"Template inválido: {e}") from e
+
+    out: List[Tuple[str, str, str]] = []
+    for i, r in enumerate(recipients):
+        if isinstance(r, str):
+            email, variables = r, {}
+        elif isinstance(r, dict):
+            email, variables = r.get("email"), r.get("vars") or {}
+        else:
+            raise TemplateRenderError(f"Destinatário #{i} inválido.")
+        email = (email or "").strip() if isinstance(email, str) else ""
+        if "@" not in email or not isinstance(variables, dict):
+            raise TemplateRenderError(f"Destinatário #{i} inválido: {r!r}")
+        ctx = {**variables, "email": email}
+        try:
+            out.append((email, subject_t.render(ctx).strip(), body_t.render(ctx)))
+        except TemplateError as e:
+            raise TemplateRenderError(f"Erro ao renderizar para {email}: {e}") from e
+    return out
+
+
+# =========================
+# Fila
+# =========================
+# Tokens ficam só em memória: nunca são gravados no banco. Um job cujo processo
+# reiniciou fica parado até POST /mail/jobs/<id>/resume com um token válido.
+_tokens: Dict[str, str] = {}
+_tokens_lock = threading.Lock()
+_claim_lock = threading.Lock()
+_wakeup = threading.Event()
+_stop = threading.Event()
+_workers: List[threading.Thread] = []
+
+
+def enqueue_job(
+    owner: str, rendered: List[Tuple[str, str, str]], idempotency_key: Optional[str] = None
+) -> Tuple[MailDispatchJob, bool]:
+    """
+    Persiste o job e suas mensagens. Com idempotency_key, um reenvio do mesmo pedido
+    devolve o job existente em vez de enfileirar de novo. Retorna (job, criado).
+    """
+    if idempotency_key:
+        existing = MailDispatchJob.query.filter_by(owner=owner, idempotency_key=idempotency_key).first()
+        if existing is not None:
+            return existing, False
+
+    job = MailDispatchJob(owner=owner, idempotency_key=idempotency_key, status="queued", total=len(rendered))
+    db.session.add(job)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # outro pedido com a mesma chave inseriu entre a consulta e o flush: vale o job dele
+        db.session.rollback()
+        existing = (
+            MailDispatchJob.query.filter_by(owner=owner, idempotency_key=idempotency_key).first()
+            if idempotency_key else None
+        )
+        if existing is None:
+            raise
+        return existing, False
+    now = datetime.utcnow()
+    db.session.add_all([
+        MailDispatchMessage(
+            job_id=job.id, owner=owner, to_address=to, subject=subject or "(sem assunto)",
+            body_html=body, status="pending", next_attempt_at=now,
+        )
+        for to, subject, body in rendered
+    ])
+    db.session.commit()
+    return job, True
+
+
+def activate_job(app, job_id: str, access_token: str) -> None:
+    """Associa o token ao job neste processo e acorda os workers."""
+    with _tokens_lock:
+        _tokens[job_id] = access_token
+    ensure_dispatcher(app)
+    _wakeup.set()
+
+
+def job_status(job: MailDispatchJob, max_errors: int = 100) -> Dict[str, Any]:
+    counts = dict(
+        db.session.query(MailDispatchMessage.status, func.count())
+        .filter(MailDispatchMessage.job_id == job.id)
+        .group_by(MailDispatchMessage.status)
+        .all()
+    )
+    failures = (
+        MailDispatchMessage.query.filter_by(job_id=job.id, status="failed")
+        .limit(max_errors)
+        .all()
+    )
+    with _tokens_lock:
+        active = job.id in _tokens
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "pending": counts.get("pending", 0),
+        "sending": counts.get("sending", 0),
+        "sent": counts.get("sent", 0),
+        "failed": counts.get("failed", 0),
+        "active": active,
+        "errors": [{"to": m.to_address, "error": m.error} for m in failures],
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# =========================
+# Workers
+# =========================
+def ensure_dispatcher(app) -> None:
+    """Sobe os workers deste processo na primeira vez que houver o que enviar."""
+    with _claim_lock:
+        if _workers and all(t.is_alive() for t in _workers):
+            return
+        _stop.clear()
+        _workers.clear()
+        for i in range(max(1, MAIL_DISPATCH_WORKERS)):
+            t = threading.Thread(target=_worker_loop, args=(app,), name=f"mail-dispatch-{i}", daemon=True)
+            t.start()
+            _workers.append(t)
+
+
+def stop_dispatcher(timeout: float = 10.0) -> None:
+    """Para os workers após a mensagem em andamento (mensagens pendentes continuam no banco)."""
+    _stop.set()
+    _wakeup.set()
+    for t in list(_workers):
+        t.join(timeout)
+    _workers.clear()
+
+
+def _worker_loop(app) -> None:
+    while not _stop.is_set():
+        worked = False
+        try:
+            with app.app_context():
+                worked = _dispatch_once()
+        except Exception:
+            app.logger.exception("mail dispatch: falha no worker")
+        if not worked:
+            _wakeup.wait(MAIL_DISPATCH_POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def _sent_last_minute(owner: str, now: datetime) -> int:
+    return (
+        db.session.query(func.count())
+        .select_from(MailDispatchMessage)
+        .filter(
+            MailDispatchMessage.owner == owner,
+            db.or_(
+                MailDispatchMessage.sent_at >= now - timedelta(minutes=1),
+                MailDispatchMessage.status == "sending",
+            ),
+        )
+        .scalar()
+        or 0
+    )
+
+
+def _claim() -> Optional[Tuple[MailDispatchMessage, str, bool]]:
+    """
+    Reserva a próxima mensagem elegível (compare-and-set no banco, seguro entre processos).
+    Retorna (mensagem, token, precisa_reconciliar).
+    """
+    with _tokens_lock:
+        tokens = dict(_tokens)
+    if not tokens:
+        return None
+
+    now = datetime.utcnow()
+    candidates = (
+        MailDispatchMessage.query.filter(
+            MailDispatchMessage.job_id.in_(list(tokens)),
+            MailDispatchMessage.status.in_(("pending", "sending")),
+            MailDispatchMessage.next_attempt_at <= now,
+        )
+        .order_by(MailDispatchMessage.next_attempt_at)
+        .limit(50)
+        .all()
+    )
+    budget: Dict[str, int] = {}
+    for msg in candidates:
+        if msg.owner not in budget:
+            budget[msg.owner] = MAIL_DISPATCH_PER_MINUTE - _sent_last_minute(msg.owner, now)
+        if budget[msg.owner] <= 0:
+            continue
+
+        # tentativa anterior (ou lease expirado) pode ter chegado a criar/enviar o rascunho
+        reconcile = msg.attempts > 0 or msg.status == "sending"
+        res = db.session.execute(
+            update(MailDispatchMessage)
+            .where(
+                MailDispatchMessage.id == msg.id,
+                MailDispatchMessage.status == msg.status,
+                MailDispatchMessage.attempts == msg.attempts,
+            )
+            .values(status="sending", attempts=msg.attempts + 1,
+                    next_attempt_at=now + _LEASE, updated_at=now)
+        )
+        if res.rowcount != 1:
+            db.session.rollback()
+            continue
+        job = db.session.get(MailDispatchJob, msg.job_id)
+        if job.status == "queued":
+            job.status = "running"
+            job.updated_at = now
+        db.session.commit()
+        db.session.refresh(msg)
+        return msg, tokens[msg.job_id], reconcile
+    return None
+
+
+def _dispatch_once() -> bool:
+    with _claim_lock:
+        claimed = _claim()
+    if claimed is None:
+        return False
+    msg, token, reconcile = claimed
+    try:
+        _deliver(msg, token, reconcile)
+        msg.status = "sent"
+        msg.sent_at = datetime.utcnow()
+        msg.error = None
+    except requests.HTTPError as e:
+        status = getattr(e.response, "status_code", None)
+        if status == 401:
+            # token expirou: devolve a mensagem e pausa o job até um resume
+            msg.status = "pending"
+            msg.attempts -= 1
+            msg.next_attempt_at = datetime.utcnow()
+            with _tokens_lock:
+                _tokens.pop(msg.job_id, None)
+            job = db.session.get(MailDispatchJob, msg.job_id)
+            job.status = "paused"
+            job.updated_at = datetime.utcnow()
+        elif status in _RETRY_STATUSES and msg.attempts < MAIL_DISPATCH_MAX_ATTEMPTS:
+            msg.status = "pending"
+            msg.next_attempt_at = datetime.utcnow() + timedelta(seconds=_retry_after(e.response, msg.attempts))
+            msg.error = f"HTTP {status}"
+        else:
+            msg.status = "failed"
+            msg.error = str(e)
+    except Exception as e:
+        msg.status = "failed"
+        msg.error = str(e)
+    msg.updated_at = datetime.utcnow()
+    db.session.commit()
+    _finish_job_if_done(msg.job_id)
+    return True
+
+
+def _retry_after(response, attempt: int) -> float:
+    try:
+        return min(float(response.headers.get("Retry-After")), 300.0)
+    except (AttributeError, TypeError, ValueError):
+        return min(2 ** attempt + random.random(), 300.0)
+
+
+def _find_by_key(folder: str, key: str, token: str) -> Optional[dict]:
+    flt = (
+        "singleValueExtendedProperties/Any(ep: ep/id eq '"
+        + DISPATCH_KEY_PROPERTY
+        + f"' and ep/value eq '{key}')"
+    )
+    params = {"$filter": flt, "$select": "id", "$top": "1"}
+    data = graph_get(f"/me/mailFolders/{folder}/messages", token, params=params, cache=False)
+    values = data.get("value", []) or []
+    return values[0] if values else None
+
+
+def _deliver(msg: MailDispatchMessage, token: str, reconcile: bool) -> None:
+    """
+    Envia via rascunho marcado com a chave da mensagem:
+    POST /me/messages (rascunho) -> POST /me/messages/{id}/send.
+    Ao reconciliar, procura a chave em Enviados (já foi) e em Rascunhos (reaproveita),
+    garantindo que um retry após crash não envie duas vezes.
+    """
+    draft_id = None
+    if reconcile:
+        if _find_by_key("SentItems", msg.id, token):
+            return
+        draft = _find_by_key("Drafts", msg.id, token)
+        draft_id = draft["id"] if draft else None
+
+    if not draft_id:
+        message = build_message(msg.subject, msg.body_html, [msg.to_address])
+        message["singleValueExtendedProperties"] = [{"id": DISPATCH_KEY_PROPERTY, "value": msg.id}]
+        draft = graph_post("/me/messages", token, payload=message)
+        draft_id = draft["id"]
+        msg.draft_id = draft_id
+        db.session.commit()
+
+    graph_post(f"/me/messages/{draft_id}/send", token)
+
+
+def _finish_job_if_done(job_id: str) -> None:
+    remaining = (
+        db.session.query(func.count())
+        .select_from(MailDispatchMessage)
+        .filter(MailDispatchMessage.job_id == job_id, MailDispatchMessage.status.in_(("pending", "sending")))
+        .scalar()
+    )
+    if remaining:
+        return
+    job = db.session.get(MailDispatchJob, job_id)
+    if job.status != "completed":
+        job.status = "completed"
+        job.finished_at = job.updated_at = datetime.utcnow()
+        db.session.commit()
+    with _tokens_lock:
+        _tokens.pop(job_id, None)
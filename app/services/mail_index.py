@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from sqlalchemy import text
+
+from app.extensions import db
+from app.models.mail_index import MailIndexEntry, MailSyncState
+from app.services.ms_oauth import GRAPH_BASE, graph_get_url
+
+# =========================
+# Config (env)
+# =========================
+MAIL_INDEX_ENABLED = os.getenv("MAIL_INDEX_ENABLED", "true").strip().lower() in ("1", "true", "yes", "y")
+MAIL_INDEX_SYNC_INTERVAL = int(os.getenv("MAIL_INDEX_SYNC_INTERVAL", "60"))
+MAIL_INDEX_PAGE_SIZE = int(os.getenv("MAIL_INDEX_PAGE_SIZE", "200"))
+# páginas de delta por pasta em cada chamada: o sync inicial de caixas grandes é feito aos poucos,
+# ao longo de várias buscas, em vez de estourar o timeout do worker numa requisição só
+MAIL_INDEX_MAX_PAGES = int(os.getenv("MAIL_INDEX_MAX_PAGES", "5"))
+
+INDEXED_FOLDERS = ("Inbox", "SentItems")
+DELTA_SELECT = "subject,from,toRecipients,bodyPreview,receivedDateTime"
+
+FTS_TABLE = "mail_index_fts"
+
+
+# =========================
+# Sync incremental via delta
+# =========================
+def _parse_graph_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _address(entry: Optional[dict]) -> str:
+    ea = (entry or {}).get("emailAddress") or {}
+    name = ea.get("name") or ""
+    addr = ea.get("address") or ""
+    return f"{name} <{addr}>" if name and addr and name != addr else (addr or name)
+
+
+def _fts_available() -> bool:
+    if db.engine.dialect.name != "sqlite":
+        return False
+    row = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"), {"n": FTS_TABLE}
+    ).first()
+    return row is not None
+
+
+def _fts_delete(owner: str, message_ids: Iterable[str]) -> None:
+    for mid in message_ids:
+        db.session.execute(
+            text(f"DELETE FROM {FTS_TABLE} WHERE owner = :o AND message_id = :m"), {"o": owner, "m": mid}
+        )
+
+
+def _apply_page(owner: str, folder: str, values: List[dict], use_fts: bool) -> Tuple[int, int]:
+    upserts = [m for m in values if "@removed" not in m and m.get("id")]
+    removed = [m["id"] for m in values if "@removed" in m and m.get("id")]
+
+    if removed:
+        MailIndexEntry.query.filter(
+            MailIndexEntry.owner == owner, MailIndexEntry.message_id.in_(removed)
+        ).delete(synchronize_session=False)
+        if use_fts:
+            _fts_delete(owner, removed)
+
+    if upserts:
+        ids = [m["id"] for m in upserts]
+        existing = {
+            e.message_id: e
+            for e in MailIndexEntry.query.filter(
+                MailIndexEntry.owner == owner, MailIndexEntry.message_id.in_(ids)
+            )
+        }
+        for m in upserts:
+            entry = existing.get(m["id"])
+            if entry is None:
+                entry = existing[m["id"]] = MailIndexEntry(owner=owner, message_id=m["id"])
+                db.session.add(entry)
+            entry.folder = folder
+            # delta pode trazer só os campos alterados (ex.: isRead); mantém o que já temos
+            if "subject" in m:
+                entry.subject = m.get("subject") or ""
+            if "from" in m:
+                entry.sender = _address(m.get("from"))
+            if "toRecipients" in m:
+                entry.recipients = ", ".join(_address(r) for r in (m.get("toRecipients") or []))
+            if "bodyPreview" in m:
+                entry.body_preview = m.get("bodyPreview") or ""
+            if "receivedDateTime" in m:
+                entry.received_at = _parse_graph_datetime(m.get("receivedDateTime"))
+            entry.indexed_at = datetime.utcnow()
+
+        if use_fts:
+            _fts_delete(owner, ids)
+            for e in existing.values():
+                db.session.execute(
+                    text(
+                        f"INSERT INTO {FTS_TABLE} (owner, message_id, subject, sender, recipients, body_preview) "
+                        "VALUES (:o, :m, :s, :f, :t, :b)"
+                    ),
+                    {"o": owner, "m": e.message_id, "s": e.subject or "", "f": e.sender or "",
+                     "t": e.recipients or "", "b": e.body_preview or ""},
+                )
+
+    return len(upserts), len(removed)
+
+
+def _sync_folder(access_token: str, owner: str, state: MailSyncState, use_fts: bool) -> Dict[str, Any]:
+    # delta_link guarda o deltaLink do último sync completo ou, se o anterior parou em
+    # MAIL_INDEX_MAX_PAGES, o nextLink de onde retomar (os dois são seguidos do mesmo jeito)
+    headers = {"Prefer": f"odata.maxpagesize={MAIL_INDEX_PAGE_SIZE}"}
+    if state.delta_link:
+        url, params = state.delta_link, None
+    else:
+        url = f"{GRAPH_BASE}/me/mailFolders/{state.folder}/messages/delta"
+        params = {"$select": DELTA_SELECT}
+
+    upserted = removed = pages = 0
+    while url:
+        if pages >= MAIL_INDEX_MAX_PAGES:
+            # synced_at não muda: a próxima chamada continua daqui
+            return {"upserted": upserted, "removed": removed, "incomplete": True}
+        data = graph_get_url(url, access_token, params=params, extra_headers=headers)
+        pages += 1
+        u, r = _apply_page(owner, state.folder, data.get("value", []) or [], use_fts)
+        upserted += u
+        removed += r
+        params = None
+        if data.get("@odata.deltaLink"):
+            state.delta_link = data["@odata.deltaLink"]
+            url = None
+        else:
+            url = data.get("@odata.nextLink")
+            state.delta_link = url
+        # commit por página: um sync interrompido não perde o que já foi indexado
+        db.session.commit()
+
+    state.synced_at = datetime.utcnow()
+    db.session.commit()
+    return {"upserted": upserted, "removed": removed}
+
+
+def sync_mail_index(access_token: str, owner: str, force: bool = False) -> Dict[str, Any]:
+    """
+    Atualiza o índice local do usuário via /me/mailFolders/{Inbox,SentItems}/messages/delta.
+    Retoma do último deltaLink salvo; sem 'force', pula pastas sincronizadas há menos
+    de MAIL_INDEX_SYNC_INTERVAL segundos. Lê no máximo MAIL_INDEX_MAX_PAGES páginas por pasta;
+    se parar antes do fim, devolve "incomplete": true e a busca cobre só o que já foi indexado.
+    """
+    use_fts = _fts_available()
+    stats: Dict[str, Any] = {}
+    now = datetime.utcnow()
+
+    for folder in INDEXED_FOLDERS:
+        state = db.session.get(MailSyncState, (owner, folder))
+        if state is None:
+            state = MailSyncState(owner=owner, folder=folder)
+            db.session.add(state)
+        elif not force and state.synced_at and now - state.synced_at < timedelta(seconds=MAIL_INDEX_SYNC_INTERVAL):
+            stats[folder] = {"skipped": True}
+            continue
+
+        try:
+            stats[folder] = _sync_folder(access_token, owner, state, use_fts)
+        except requests.HTTPError as e:
+            db.session.rollback()
+            # deltaLink expirado (410 Gone): recomeça o sync completo da pasta
+            if getattr(e.response, "status_code", None) != 410 or not state.delta_link:
+                raise
+            state.delta_link = None
+            stats[folder] = _sync_folder(access_token, owner, state, use_fts)
+        except Exception:
+            db.session.rollback()
+            raise
+
+    stats["incomplete"] = any(isinstance(v, dict) and v.get("incomplete") for v in stats.values())
+    return stats
+
+
+# =========================
+# Busca
+# =========================
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _fts_query(q: str) -> Optional[str]:
+    """
+    Converte texto livre em consulta FTS5 segura: termos entre aspas (AND),
+    com prefixo no último termo para busca enquanto digita.
+    """
+    tokens = _TOKEN_RE.findall(q)
+    if not tokens:
+        return None
+    parts = [f'"{t}"' for t in tokens]
+    parts[-1] += "*"
+    return " ".join(parts)
+
+
+def _entry_dict(e: MailIndexEntry, rank: Optional[float] = None) -> Dict[str, Any]:
+    return {
+        "id": e.message_id,
+        "folder": e.folder,
+        "subject": e.subject,
+        "from": e.sender,
+        "to": e.recipients,
+        "bodyPreview": e.body_preview,
+        "receivedDateTime": e.received_at.isoformat() + "Z" if e.received_at else None,
+        "score": rank,
+    }
+
+
+def search_mail_index(owner: str, q: str, limit: int = 25, offset: int = 0) -> Dict[str, Any]:
+    """
+    Busca no índice local do usuário. Com FTS5 ordena por bm25 (assunto pesa mais);
+    sem FTS5 cai em LIKE ordenado por data.
+    """
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+
+    if _fts_available():
+        match = _fts_query(q)
+        if not match:
+            return {"count": 0, "total": 0, "items": [], "offset": offset, "limit": limit}
+        total = db.session.execute(
+            text(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q AND owner = :o"),
+            {"q": match, "o": owner},
+        ).scalar() or 0
+        rows = db.session.execute(
+            text(
+                f"SELECT message_id, bm25({FTS_TABLE}, 0, 0, 5.0, 2.0, 1.0, 1.0) AS rank "
+                f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q AND owner = :o "
+                "ORDER BY rank LIMIT :limit OFFSET :offset"
+            ),
+            {"q": match, "o": owner, "limit": limit, "offset": offset},
+        ).all()
+        ids = [r.message_id for r in rows]
+        by_id = {
+            e.message_id: e
+            for e in MailIndexEntry.query.filter(MailIndexEntry.owner == owner, MailIndexEntry.message_id.in_(ids))
+        }
+        # bm25 é negativo (menor = melhor); expõe como score positivo
+        items = [_entry_dict(by_id[r.message_id], round(-r.rank, 4)) for r in rows if r.message_id in by_id]
+    else:
+        like = f"%{q.strip()}%"
+        query = MailIndexEntry.query.filter(
+            MailIndexEntry.owner == owner,
+            db.or_(
+                MailIndexEntry.subject.ilike(like),
+                MailIndexEntry.sender.ilike(like),
+                MailIndexEntry.recipients.ilike(like),
+                MailIndexEntry.body_preview.ilike(like),
+            ),
+        )
+        total = query.count()
+        entries = query.order_by(MailIndexEntry.received_at.desc()).offset(offset).limit(limit).all()
+        items = [_entry_dict(e) for e in entries]
+
+    return {"count": len(items), "total": total, "items": items, "offset": offset, "limit": limit}
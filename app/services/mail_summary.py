@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services import metrics, tracing
+from app.services.ai_chat import ai_chat
+from app.services.cache import get_cache
+from app.services.html_text import body_as_text
+from app.services.json_extract import extract_json_object
+from app.services.ms_oauth import graph_get
+
+# =========================
+# Config (env)
+# =========================
+MAIL_SUMMARY_MAX_MESSAGES = int(os.getenv("MAIL_SUMMARY_MAX_MESSAGES", "50"))
+# orçamento de entrada por chamada ao Gemini (estimativa: ~4 caracteres por token)
+MAIL_SUMMARY_CHUNK_TOKENS = int(os.getenv("MAIL_SUMMARY_CHUNK_TOKENS", "6000"))
+MAIL_SUMMARY_CONCURRENCY = int(os.getenv("MAIL_SUMMARY_CONCURRENCY", "3"))
+# por mensagem; a chave inclui lastModifiedDateTime, então mudança na mensagem gera novo resumo
+MAIL_SUMMARY_CACHE_TTL = float(os.getenv("MAIL_SUMMARY_CACHE_TTL", str(7 * 24 * 3600)))
+# limite por mensagem dentro do prompt
+MAIL_SUMMARY_MESSAGE_CHARS = int(os.getenv("MAIL_SUMMARY_MESSAGE_CHARS", "2000"))
+
+_SELECT = "id,subject,from,receivedDateTime,lastModifiedDateTime,bodyPreview,isRead"
+
+_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summaries": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"ref": {"type": "STRING"}, "summary": {"type": "STRING"}},
+                "required": ["ref", "summary"],
+            },
+        }
+    },
+    "required": ["summaries"],
+}
+
+_CHUNK_PROMPT = """Resuma cada e-mail abaixo em UMA frase curta (até 30 palavras), em português,
+destacando pedido, prazo ou decisão quando houver. Não invente informações.
+Responda somente JSON: {{"summaries": [{{"ref": "<ref>", "summary": "<frase>"}}]}} com uma entrada por e-mail.
+
+{messages}"""
+
+_OVERVIEW_PROMPT = """Com base nos resumos de e-mails abaixo, escreva uma visão geral da caixa de entrada
+em português, em no máximo 5 tópicos curtos, priorizando o que exige ação do usuário.
+Responda em texto simples, um tópico por linha começando com "- ".
+
+{summaries}"""
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _sender(m: Dict[str, Any]) -> str:
+    ea = (m.get("from") or {}).get("emailAddress") or {}
+    return ea.get("name") or ea.get("address") or ""
+
+
+def _message_text(m: Dict[str, Any], text: Optional[str] = None) -> str:
+    body = (text if text is not None else m.get("bodyPreview") or "").strip()
+    return body[:MAIL_SUMMARY_MESSAGE_CHARS]
+
+
+def _render(ref: str, m: Dict[str, Any], text: Optional[str]) -> str:
+    return (
+        f"[ref={ref}]\nDe: {_sender(m)}\nAssunto: {m.get('subject') or '(sem assunto)'}\n"
+        f"Data: {m.get('receivedDateTime') or ''}\n{_message_text(m, text)}\n"
+    )
+
+
+def pack_chunks(blocks: List[Tuple[str, str]], budget_tokens: int) -> List[List[Tuple[str, str]]]:
+    """Agrupa (ref, bloco) em lotes que cabem no orçamento; um bloco maior que o orçamento vai sozinho."""
+    chunks: List[List[Tuple[str, str]]] = []
+    current: List[Tuple[str, str]] = []
+    used = 0
+    for ref, block in blocks:
+        cost = estimate_tokens(block)
+        if current and used + cost > budget_tokens:
+            chunks.append(current)
+            current, used = [], 0
+        current.append((ref, block))
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _summarize_chunk(chunk: List[Tuple[str, str]]) -> Dict[str, str]:
+    prompt = _CHUNK_PROMPT.format(messages="\n".join(block for _, block in chunk))
+    raw = ai_chat(prompt, generation_config={
+        "temperature": 0.2,
+        "responseMimeType": "application/json",
+        "responseSchema": _SCHEMA,
+    })
+    metrics.incr("summary.llm_calls")
+    obj, _ = extract_json_object(raw)
+    out: Dict[str, str] = {}
+    for item in (obj or {}).get("summaries") or []:
+        if isinstance(item, dict) and item.get("ref") and isinstance(item.get("summary"), str):
+            out[str(item["ref"])] = item["summary"].strip()
+    return out
+
+
+def _cache_parts(m: Dict[str, Any], source: str) -> Tuple[str, str, str]:
+    # a fonte entra na chave: resumo feito do bodyPreview não serve para quem pediu o corpo
+    return (m.get("id") or "", m.get("lastModifiedDateTime") or m.get("receivedDateTime") or "", source)
+
+
+def summarize_messages(
+    owner: str,
+    messages: List[Dict[str, Any]],
+    texts: Optional[Dict[str, str]] = None,
+    overview: bool = True,
+    source: str = "body",
+) -> Dict[str, Any]:
+    """
+    Resume mensagens reaproveitando resumos em cache; as novas são agrupadas em lotes
+    por orçamento de tokens e cada lote vira uma chamada ao Gemini (lotes em paralelo).
+    texts: { message_id: texto do corpo } para usar no lugar do bodyPreview.
+    source: identifica como 'texts' foi gerado (ex.: "body:4000" = corpo limpo cortado em 4000
+    caracteres); mensagens sem texto usam o bodyPreview e ficam no cache como "preview".
+    """
+    cache = get_cache()
+    namespace = f"owner:{owner}:mail_summaries"
+    summaries: Dict[str, str] = {}
+    pending: List[Tuple[str, str]] = []
+    refs: Dict[str, Dict[str, Any]] = {}
+
+    sources: Dict[str, str] = {}
+    for i, m in enumerate(messages):
+        sources[m.get("id")] = source if (texts or {}).get(m.get("id")) is not None else "preview"
+        cached = cache.get(namespace, _cache_parts(m, sources[m.get("id")]))
+        if isinstance(cached, str):
+            summaries[m["id"]] = cached
+            continue
+        ref = f"m{i}"
+        refs[ref] = m
+        pending.append((ref, _render(ref, m, (texts or {}).get(m.get("id")))))
+
+    chunks = pack_chunks(pending, MAIL_SUMMARY_CHUNK_TOKENS)
+    errors: List[str] = []
+    if chunks:
+        with ThreadPoolExecutor(max_workers=max(1, min(MAIL_SUMMARY_CONCURRENCY, len(chunks)))) as pool:
+            futures = [pool.submit(tracing.wrap(_summarize_chunk), c) for c in chunks]
+            for fut in futures:
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    # um lote com erro não derruba os demais; as mensagens dele ficam sem resumo
+                    errors.append(str(e))
+                    continue
+                for ref, text in result.items():
+                    m = refs.get(ref)
+                    if m is None:
+                        continue
+                    summaries[m["id"]] = text
+                    cache.set(namespace, _cache_parts(m, sources[m.get("id")]), text, MAIL_SUMMARY_CACHE_TTL)
+
+    metrics.incr("summary.cached_messages", len(messages) - len(pending))
+    metrics.incr("summary.new_messages", len(pending))
+
+    items = [{
+        "id": m.get("id"),
+        "subject": m.get("subject"),
+        "from": _sender(m),
+        "receivedDateTime": m.get("receivedDateTime"),
+        "isRead": m.get("isRead"),
+        "summary": summaries.get(m.get("id")),
+    } for m in messages]
+
+    result: Dict[str, Any] = {
+        "count": len(items),
+        "new": len(pending),
+        "cached": len(messages) - len(pending),
+        "llm_calls": len(chunks),
+        "items": items,
+    }
+    if errors:
+        result["errors"] = errors
+    if overview and any(it["summary"] for it in items):
+        result["overview"] = _overview(namespace, items)
+    return result
+
+
+def _overview(namespace: str, items: List[Dict[str, Any]]) -> Optional[str]:
+    lines = "\n".join(f"- {it['from']}: {it['subject']} — {it['summary']}" for it in items if it["summary"])
+    parts = ("overview", hashlib.sha256(lines.encode()).hexdigest())
+    cached = get_cache().get(namespace, parts)
+    if isinstance(cached, str):
+        return cached
+    try:
+        text = ai_chat(_OVERVIEW_PROMPT.format(summaries=lines), generation_config={"temperature": 0.2}).strip()
+    except Exception:
+        return None
+    metrics.incr("summary.llm_calls")
+    get_cache().set(namespace, parts, text, MAIL_SUMMARY_CACHE_TTL)
+    return text
+
+
+def fetch_inbox_for_summary(access_token: str, top: int, unread_only: bool = False,
+                            use_body: bool = False) -> List[Dict[str, Any]]:
+    top = max(1, min(int(top), MAIL_SUMMARY_MAX_MESSAGES))
+    params = {"$top": str(top), "$select": _SELECT + (",body" if use_body else ""), "$orderby": "receivedDateTime desc"}
+    if unread_only:
+        # o Graph exige a propriedade do $orderby também no $filter
+        params["$filter"] = "receivedDateTime ge 1900-01-01T00:00:00Z and isRead eq false"
+    data = graph_get("/me/mailFolders/Inbox/messages", access_token, params=params)
+    return data.get("value", []) or []
+
+
+def summarize_inbox(access_token: str, owner: str, top: int = 20, unread_only: bool = False,
+                    overview: bool = True, use_body: bool = False) -> Dict[str, Any]:
+    """use_body: resume a partir do corpo limpo (html_to_text) em vez do bodyPreview de 255 caracteres."""
+    messages = fetch_inbox_for_summary(access_token, top, unread_only=unread_only, use_body=use_body)
+    texts = None
+    if use_body:
+        texts = {m.get("id"): body_as_text(m.pop("body", None), max_chars=MAIL_SUMMARY_MESSAGE_CHARS)["content"]
+                 for m in messages}
+    return summarize_messages(owner, messages, texts=texts, overview=overview,
+                              source=f"body:{MAIL_SUMMARY_MESSAGE_CHARS}")
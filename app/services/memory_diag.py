@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import gc
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from app.config import PROJECT_ROOT
+
+# =========================
+# Config (env)
+# =========================
+# frames guardados por alocação (mais frames = mais contexto e mais memória/CPU do tracemalloc)
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "10"))
+# snapshots mantidos em disco por processo (os mais antigos saem)
+MEMORY_MAX_SNAPSHOTS = int(os.getenv("MEMORY_MAX_SNAPSHOTS", "5"))
+# compartilhado entre os workers: comando do admin (.control) e snapshots (<pid>-<ms>.snap + .json)
+MEMORY_DIR = os.getenv("MEMORY_DIR", os.path.join(PROJECT_ROOT, "instance", "memory"))
+
+GROUP_BY = ("lineno", "filename", "traceback")
+
+_CONTROL_FILE = ".control"
+_SAFE_ID = re.compile(r"^\d+-\d+$")
+
+_lock = threading.Lock()
+_last_ms = 0
+
+
+class SnapshotNotFound(KeyError):
+    pass
+
+
+def rss_bytes() -> Optional[int]:
+    """RSS atual do processo (Linux: /proc/self/statm); None onde não há /proc."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# =========================
+# Comando do admin (vale para todos os workers: marcador em MEMORY_DIR, como o profiler)
+# =========================
+_control: Dict[str, Any] = {}
+_control_checked = 0.0
+# pedidos de snapshot anteriores ao início do processo não valem para ele
+_snapshot_seen = time.time()
+# só desliga o tracemalloc que o comando ligou (o memcheck, por exemplo, liga o seu)
+_started_here = False
+
+
+def _write_control(control: Dict[str, Any]) -> None:
+    global _control, _control_checked
+    os.makedirs(MEMORY_DIR, exist_ok=True)
+    tmp = os.path.join(MEMORY_DIR, f"{_CONTROL_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(control, f)
+    os.replace(tmp, os.path.join(MEMORY_DIR, _CONTROL_FILE))
+    _control, _control_checked = control, time.monotonic()
+
+
+def _read_control() -> Dict[str, Any]:
+    """Último comando do admin; o arquivo é relido no máximo uma vez por segundo por processo."""
+    global _control, _control_checked
+    now = time.monotonic()
+    if now - _control_checked >= 1.0:
+        _control_checked = now
+        try:
+            with open(os.path.join(MEMORY_DIR, _CONTROL_FILE)) as f:
+                _control = json.load(f)
+        except (OSError, ValueError):
+            _control = {}
+    return _control
+
+
+def set_tracing(enabled: bool, frames: int = MEMORY_TRACE_FRAMES) -> None:
+    """Liga/desliga o tracemalloc em todos os workers (aplicado aqui na hora; nos demais, na próxima requisição)."""
+    control = dict(_read_control())
+    control.update(tracing=enabled, frames=frames)
+    _write_control(control)
+    sync()
+
+
+def request_snapshots(label: str = "") -> Dict[str, Any]:
+    """Grava um snapshot neste worker e pede um a cada um dos demais (gravado na próxima requisição de cada)."""
+    global _snapshot_seen
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc não está ativo neste processo.")
+    requested_at = time.time()
+    control = dict(_read_control())
+    control.update(snapshot_at=requested_at, snapshot_label=label)
+    _write_control(control)
+    with _lock:
+        _snapshot_seen = max(_snapshot_seen, requested_at)
+    return take_snapshot(label)
+
+
+def sync() -> Optional[Dict[str, Any]]:
+    """
+    Aplica o comando do admin neste processo: liga/desliga o tracemalloc e grava o snapshot
+    pedido, se houver um novo. Chamado a cada requisição; fora a releitura do arquivo, é
+    só uma comparação. Devolve o snapshot gravado agora, se algum.
+    """
+    global _snapshot_seen, _started_here
+    control = _read_control()
+    if not control:
+        return None
+    if control.get("tracing") and not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, int(control.get("frames") or MEMORY_TRACE_FRAMES)))
+        _started_here = True
+    elif not control.get("tracing") and tracemalloc.is_tracing() and _started_here:
+        tracemalloc.stop()
+        _started_here = False
+
+    requested_at = float(control.get("snapshot_at") or 0)
+    if requested_at <= _snapshot_seen:
+        return None
+    with _lock:
+        if requested_at <= _snapshot_seen:
+            return None
+        _snapshot_seen = requested_at
+    if not tracemalloc.is_tracing():
+        return None
+    return take_snapshot(str(control.get("snapshot_label") or ""))
+
+
+def status() -> Dict[str, Any]:
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": rss_bytes(),
+        "tracing": tracemalloc.is_tracing(),
+        "traced_bytes": current,
+        "traced_peak_bytes": peak,
+        "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory() if tracemalloc.is_tracing() else 0,
+        "gc_counts": gc.get_count(),
+        "tracing_requested": bool(_read_control().get("tracing")),
+        "snapshots": list_snapshots(),
+    }
+
+
+# =========================
+# Snapshots em disco (Snapshot.dump / Snapshot.load): comparáveis entre workers e requisições
+# =========================
+def take_snapshot(label: str = "") -> Dict[str, Any]:
+    global _last_ms
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc não está ativo neste processo.")
+    gc.collect()
+    snap = tracemalloc.take_snapshot().filter_traces((
+        # as estruturas do próprio tracemalloc/importlib só fazem ruído
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    with _lock:
+        _last_ms = max(_last_ms + 1, int(time.time() * 1000))
+        sid = f"{os.getpid()}-{_last_ms}"
+    meta = {"id": sid, "pid": os.getpid(), "label": label, "taken_at": time.time(), "rss_bytes": rss_bytes(),
+            "traced_bytes": sum(s.size for s in snap.statistics("filename"))}
+
+    os.makedirs(MEMORY_DIR, exist_ok=True)
+    base = os.path.join(MEMORY_DIR, sid)
+    snap.dump(base + ".snap.tmp")
+    os.replace(base + ".snap.tmp", base + ".snap")
+    with open(base + ".json.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(base + ".json.tmp", base + ".json")
+    _prune(os.getpid())
+    return meta
+
+
+def _prune(pid: int) -> None:
+    mine = [m for m in list_snapshots() if m.get("pid") == pid]
+    for m in mine[MEMORY_MAX_SNAPSHOTS:]:
+        for ext in (".snap", ".json"):
+            try:
+                os.remove(os.path.join(MEMORY_DIR, m["id"] + ext))
+            except OSError:
+                pass
+
+
+def list_snapshots() -> List[Dict[str, Any]]:
+    """Snapshots de todos os processos, do mais recente para o mais antigo."""
+    out = []
+    try:
+        names = os.listdir(MEMORY_DIR)
+    except OSError:
+        return out
+    for name in names:
+        if not name.endswith(".json") or not _SAFE_ID.match(name[:-5]):
+            continue
+        try:
+            with open(os.path.join(MEMORY_DIR, name)) as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(out, key=lambda m: m.get("taken_at") or 0, reverse=True)
+
+
+def _load(sid: str):
+    if not _SAFE_ID.match(sid):
+        raise SnapshotNotFound(sid)
+    base = os.path.join(MEMORY_DIR, sid)
+    try:
+        with open(base + ".json") as f:
+            meta = json.load(f)
+        return meta, tracemalloc.Snapshot.load(base + ".snap")
+    except (OSError, ValueError, EOFError):
+        raise SnapshotNotFound(sid)
+
+
+def _frames(stat, group_by: str) -> List[str]:
+    if group_by == "filename":
+        return [f.filename for f in stat.traceback]
+    return [f"{f.filename}:{f.lineno}" for f in stat.traceback]
+
+
+def top(sid: str, group_by: str = "lineno", limit: int = 20) -> Dict[str, Any]:
+    """Maiores alocadores vivos no snapshot, agrupados por linha, arquivo ou traceback."""
+    meta, snap = _load(sid)
+    stats = snap.statistics(group_by)
+    return {
+        **meta,
+        "group_by": group_by,
+        "items": [{"where": _frames(s, group_by), "size_bytes": s.size, "count": s.count} for s in stats[:limit]],
+    }
+
+
+def compare(sid_a: str, sid_b: str, group_by: str = "lineno", limit: int = 20) -> Dict[str, Any]:
+    """O que cresceu (ou encolheu) de A para B, ordenado pela variação absoluta (mesmo pid faz mais sentido)."""
+    a, snap_a = _load(sid_a)
+    b, snap_b = _load(sid_b)
+    diff = snap_b.compare_to(snap_a, group_by)
+    return {
+        "a": a,
+        "b": b,
+        "group_by": group_by,
+        "total_diff_bytes": sum(d.size_diff for d in diff),
+        "rss_diff_bytes": (b["rss_bytes"] - a["rss_bytes"]) if a["rss_bytes"] and b["rss_bytes"] else None,
+        "items": [
+            {"where": _frames(d, group_by), "size_bytes": d.size, "size_diff_bytes": d.size_diff,
+             "count": d.count, "count_diff": d.count_diff}
+            for d in diff[:limit]
+        ],
+    }
+
+
+def object_counts(limit: int = 30) -> List[Dict[str, Any]]:
+    """Objetos rastreados pelo GC por tipo (percorre o heap inteiro: uso administrativo)."""
+    gc.collect()
+    counts = Counter()
+    for o in gc.get_objects():
+        t = type(o)
+        counts[t.__qualname__ if t.__module__ == "builtins" else f"{t.__module__}.{t.__qualname__}"] += 1
+    return [{"type": name, "count": n} for name, n in counts.most_common(limit)]
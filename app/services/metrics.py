@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict
+
+# =========================
+# Contadores em memória (por processo)
+# =========================
+_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+_timings: Dict[str, Dict[str, float]] = {}
+
+
+def incr(name: str, value: int = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Registra uma duração (soma, contagem e máximo) em segundos."""
+    with _lock:
+        t = _timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        t["count"] += 1
+        t["sum"] += seconds
+        if seconds > t["max"]:
+            t["max"] = seconds
+
+
+def ratio(numerator: str, denominator: str) -> float:
+    with _lock:
+        den = _counters.get(denominator, 0)
+        return (_counters.get(numerator, 0) / den) if den else 0.0
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        timings = {
+            k: {**v, "avg": (v["sum"] / v["count"]) if v["count"] else 0.0}
+            for k, v in _timings.items()
+        }
+        return {"counters": dict(_counters), "timings": timings}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _timings.clear()
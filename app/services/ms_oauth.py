@@ -1,9 +1,17 @@
 from __future__ import annotations
 
+import heapq
 import os
 import requests
-from typing import Any, Dict, List, Optional, Tuple
-from requests_oauthlib import OAuth2Session
+from operator import itemgetter
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.services import json_codec, tracing, transport
+from app.services.cache import get_cache, parse_ttls, ttl_for
+from app.services.singleflight import SingleFlight, make_key, user_key
+
+if TYPE_CHECKING:
+    from requests_oauthlib import OAuth2Session
 
 # =========================
 # Config (env)
@@ -22,7 +30,29 @@ AUTH_BASE = f"https://login.microsoftonline.com/{TENANT}/oauth2/v2.0"
 AUTHORIZE_URL = f"{AUTH_BASE}/authorize"
 TOKEN_URL = f"{AUTH_BASE}/token"
 
-GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+# sobrescrevível para apontar a um stub local (teste de carga)
+GRAPH_BASE = os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0").rstrip("/")
+# (conexão, leitura) em segundos: nenhuma chamada ao Graph fica pendurada para sempre
+GRAPH_TIMEOUT = (float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5")), float(os.getenv("GRAPH_READ_TIMEOUT", "30")))
+
+# GETs idênticos e simultâneos (mesmo usuário, URL e params) viram uma chamada só
+_graph_flight = SingleFlight("graph")
+
+# TTL (s) por endpoint ('*' no fim = prefixo); sem correspondência = sem cache.
+# Escritas do usuário (POST/PATCH/DELETE) invalidam o cache dele.
+GRAPH_CACHE_TTLS = parse_ttls(os.getenv(
+    "GRAPH_CACHE_TTLS",
+    "/me=300,/me/contacts*=60,/me/mailFolders*=15,/me/messages*=15",
+))
+
+# Contatos e e-mails ficam num namespace por usuário (id do /me), não por token:
+# assim uma notificação do Graph, que só identifica o usuário, consegue invalidá-los.
+CACHE_CATEGORIES = (
+    ("/me/contactFolders", "contacts"),
+    ("/me/contacts", "contacts"),
+    ("/me/mailFolders", "mail"),
+    ("/me/messages", "mail"),
+)
 
 
 # =========================
@@ -32,6 +62,9 @@ def _oauth_session(state: Optional[str] = None, token: Optional[dict] = None) ->
     """
     Cria uma OAuth2Session configurada para Authorization Code + refresh automático (Microsoft).
     """
+    # importado só aqui: o fluxo OAuth é raro e o pacote pesa no boot dos workers
+    from requests_oauthlib import OAuth2Session
+
     if not CLIENT_ID:
         raise RuntimeError("MS_CLIENT_ID não configurado no ambiente.")
     if not CLIENT_SECRET:
@@ -88,23 +121,132 @@ def fetch_token_by_code(code: str, state: Optional[str] = None) -> dict:
 # =========================
 # Helpers HTTP para Graph
 # =========================
+def _trace_headers() -> Dict[str, str]:
+    """client-request-id = trace id: o Graph devolve e registra, ligando nossa requisição à dele."""
+    request_id = tracing.graph_client_request_id()
+    return {"client-request-id": request_id, "return-client-request-id": "true"} if request_id else {}
+
+
 def _auth_headers(access_token: str, content_type: Optional[str] = "application/json") -> Dict[str, str]:
-    h = {"Authorization": f"Bearer {access_token}"}
+    h = {"Authorization": f"Bearer {access_token}", **_trace_headers()}
     if content_type:
         h["Content-Type"] = content_type
     return h
 
 
-def graph_get(endpoint: str, access_token: str, params: Optional[Dict[str, Any]] = None) -> dict:
+@tracing.traced("graph.get", record_args=("endpoint",))
+def graph_get(
+    endpoint: str,
+    access_token: str,
+    params: Optional[Dict[str, Any]] = None,
+    cache: bool = True,
+) -> dict:
     """
     GET genérico no Graph.
     endpoint: ex. "/me", "/me/contacts", "/users/{id}"
+    cache=False para leituras que precisam refletir o estado atual (ex.: conferência pós-envio).
     """
     url = f"{GRAPH_BASE}{endpoint}"
+    return _cached_get(endpoint, url, access_token, params or {}, None, cache)
+
+
+@tracing.traced("graph.get_raw", record_args=("endpoint",))
+def graph_get_raw(
+    endpoint: str,
+    access_token: str,
+    params: Optional[Dict[str, Any]] = None,
+    cache: bool = True,
+) -> bytes:
+    """
+    Como graph_get, mas devolve o corpo JSON do Graph em bytes, sem decodificar.
+    Para rotas que repassam a resposta sem transformação (divide o cache com graph_get).
+    """
+    url = f"{GRAPH_BASE}{endpoint}"
+    return _cached_get(endpoint, url, access_token, params or {}, None, cache, raw=True)
+
+
+def _cached_get(
+    path: str,
+    url: str,
+    access_token: str,
+    params: Optional[Dict[str, Any]],
+    extra_headers: Optional[Dict[str, str]],
+    cache: bool,
+    raw: bool = False,
+) -> Any:
+    owner = user_key(access_token)
+    key = make_key(owner, "GET", url, params or {}, extra_headers or {}, raw)
+
+    def load() -> Any:
+        return _graph_flight.do(key, lambda: _get_json(url, access_token, params, extra_headers, raw))
+
+    clean_path = path.split("?", 1)[0]
+    ttl = ttl_for(clean_path, GRAPH_CACHE_TTLS) if cache else 0
+    if ttl <= 0:
+        return load()
+    category = cache_category(clean_path)
+    namespace = owner_namespace(resolve_owner(access_token), category) if category else owner
+    return get_cache().get_or_load(namespace, ("GET", url, params or {}, extra_headers or {}), ttl, load, raw=raw)
+
+
+def cache_category(path: str) -> Optional[str]:
+    for prefix, category in CACHE_CATEGORIES:
+        if path == prefix or path.startswith(prefix + "/") or path.startswith(prefix + "("):
+            return category
+    return None
+
+
+def owner_namespace(owner: str, category: str) -> str:
+    return f"owner:{owner}:{category}"
+
+
+def invalidate_owner_cache(owner: str, categories: Iterable[str] = ("contacts", "mail")) -> None:
+    """Descarta as leituras em cache de contatos/e-mails de um usuário (ex.: ao receber notificação)."""
+    cache = get_cache()
+    for category in categories:
+        cache.invalidate(owner_namespace(owner, category))
+
+
+def _invalidate(access_token: str) -> None:
+    get_cache().invalidate(user_key(access_token))
+    try:
+        invalidate_owner_cache(resolve_owner(access_token))
+    except Exception:
+        # sem /me não há namespace por usuário a invalidar; o TTL cuida do resto
+        pass
+
+
+def _get_json(
+    url: str,
+    access_token: str,
+    params: Optional[Dict[str, Any]],
+    extra_headers: Optional[Dict[str, str]] = None,
+    raw: bool = False,
+) -> Any:
     headers = _auth_headers(access_token)
-    r = requests.get(url, headers=headers, params=params or {})
+    if extra_headers:
+        headers.update(extra_headers)
+    r = transport.get(url, headers=headers, params=params, timeout=GRAPH_TIMEOUT)
     r.raise_for_status()
-    return r.json()
+    return r.content if raw else json_codec.loads(r.content)
+
+
+@tracing.traced("graph.get_url")
+def graph_get_url(
+    url: str,
+    access_token: str,
+    params: Optional[Dict[str, Any]] = None,
+    extra_headers: Optional[Dict[str, str]] = None,
+) -> dict:
+    """
+    GET em uma URL absoluta do Graph (ex.: @odata.nextLink / @odata.deltaLink).
+    """
+    if not url.startswith(GRAPH_BASE):
+        raise ValueError(f"URL fora do Microsoft Graph: {url}")
+    path = url[len(GRAPH_BASE):]
+    # delta/sync (Prefer, deltaLink) sempre vai ao Graph
+    cache = not extra_headers and "/delta" not in path.split("?", 1)[0]
+    return _cached_get(path, url, access_token, params, extra_headers, cache)
 
 
 def call_graph(endpoint: str, access_token: str, params: Optional[Dict[str, Any]] = None) -> dict:
@@ -114,86 +256,205 @@ def call_graph(endpoint: str, access_token: str, params: Optional[Dict[str, Any]
     return graph_get(endpoint, access_token, params)
 
 
+@tracing.traced("graph.post", record_args=("endpoint",))
 def graph_post(endpoint: str, access_token: str, payload: Optional[dict] = None, params: Optional[dict] = None) -> dict:
     url = f"{GRAPH_BASE}{endpoint}"
     headers = _auth_headers(access_token)
-    r = requests.post(url, headers=headers, json=payload or {}, params=params or {})
+    r = transport.post(url, headers=headers, json=payload or {}, params=params or {}, timeout=GRAPH_TIMEOUT)
     r.raise_for_status()
+    _invalidate(access_token)
     if r.status_code in (202, 204) or not r.content:
         return {"status": r.status_code}
     return r.json()
 
 
+@tracing.traced("graph.patch", record_args=("endpoint",))
 def graph_patch(endpoint: str, access_token: str, payload: Optional[dict] = None) -> dict:
     url = f"{GRAPH_BASE}{endpoint}"
     headers = _auth_headers(access_token)
-    r = requests.patch(url, headers=headers, json=payload or {})
+    r = transport.patch(url, headers=headers, json=payload or {}, timeout=GRAPH_TIMEOUT)
     r.raise_for_status()
+    _invalidate(access_token)
     if not r.content:
         return {"status": r.status_code}
     return r.json()
 
 
+@tracing.traced("graph.delete", record_args=("endpoint",))
 def graph_delete(endpoint: str, access_token: str) -> dict:
     url = f"{GRAPH_BASE}{endpoint}"
     headers = _auth_headers(access_token)
-    r = requests.delete(url, headers=headers)
+    r = transport.delete(url, headers=headers, timeout=GRAPH_TIMEOUT)
     r.raise_for_status()
+    _invalidate(access_token)
     return {"status": r.status_code}
 
 
+GRAPH_BATCH_LIMIT = 20
+
+
+@tracing.traced("graph.batch")
+def graph_batch(access_token: str, batch_requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Envia até 20 requisições em uma única chamada JSON $batch.
+    batch_requests: [{ "id", "method", "url", "body"?, "headers"? }, ...] (url relativa, ex. "/me/contacts")
+    Retorna a lista 'responses' ({ id, status, headers, body }) na ordem dos ids enviados.
+    """
+    if len(batch_requests) > GRAPH_BATCH_LIMIT:
+        raise ValueError(f"$batch aceita no máximo {GRAPH_BATCH_LIMIT} requisições.")
+    reqs = []
+    for br in batch_requests:
+        item = {"id": str(br["id"]), "method": br["method"], "url": br["url"]}
+        if br.get("body") is not None:
+            item["body"] = br["body"]
+            item["headers"] = {"Content-Type": "application/json", **(br.get("headers") or {})}
+        elif br.get("headers"):
+            item["headers"] = br["headers"]
+        reqs.append(item)
+    data = graph_post("/$batch", access_token, payload={"requests": reqs})
+    order = {r["id"]: i for i, r in enumerate(reqs)}
+    return sorted(data.get("responses", []) or [], key=lambda r: order.get(str(r.get("id")), len(order)))
+
+
+@tracing.traced("graph.get_binary", record_args=("endpoint",))
 def graph_get_binary(endpoint: str, access_token: str, params: Optional[Dict[str, Any]] = None) -> bytes:
+    """Conteúdo binário pequeno (ex.: foto). Para arquivos grandes use graph_open_stream."""
     url = f"{GRAPH_BASE}{endpoint}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    r = requests.get(url, headers=headers, params=params or {}, stream=True)
+    headers = {"Authorization": f"Bearer {access_token}", **_trace_headers()}
+    r = transport.get(url, headers=headers, params=params or {}, timeout=GRAPH_TIMEOUT)
     r.raise_for_status()
     return r.content
 
 
+@tracing.traced("graph.open_stream", record_args=("endpoint",))
+def graph_open_stream(
+    endpoint: str,
+    access_token: str,
+    extra_headers: Optional[Dict[str, str]] = None,
+    timeout: float = 60,
+) -> requests.Response:
+    """
+    Abre um GET binário sem ler o corpo: o chamador itera r.iter_content() e deve chamar r.close().
+    extra_headers: ex. {"Range": "bytes=0-1023"}.
+    """
+    url = f"{GRAPH_BASE}{endpoint}"
+    headers = {"Authorization": f"Bearer {access_token}", **_trace_headers(), **(extra_headers or {})}
+    r = transport.get(url, headers=headers, stream=True, timeout=timeout)
+    try:
+        r.raise_for_status()
+    except Exception:
+        r.close()
+        raise
+    return r
+
+
 # =========================
 # Funcionalidades: Contatos / Email / Perfil
 # =========================
-def fetch_contacts_grouped_by_domain(access_token: str, top: int = 100) -> Dict[str, List[Dict[str, str]]]:
+CONTACTS_PAGE_SIZE = 999
+
+
+def graph_iter_pages(
+    endpoint: str,
+    access_token: str,
+    params: Optional[Dict[str, Any]] = None,
+    max_items: Optional[int] = None,
+) -> Iterator[dict]:
     """
-    Lê contatos pessoais e agrupa por domínio do e-mail.
-    Retorna: { "dominio.com": [ { id, displayName, email }, ... ], ... }
+    Itera os itens de 'value' seguindo @odata.nextLink, página a página.
+    Para quando não há próxima página ou quando 'max_items' itens foram lidos.
     """
-    params = {"$select": "id,displayName,emailAddresses", "$top": str(top)}
-    data = graph_get("/me/contacts", access_token, params=params)
-    values = data.get("value", []) or []
-
-    grouped: Dict[str, List[Dict[str, str]]] = {}
-    for c in values:
+    if max_items is not None and max_items <= 0:
+        return
+    url: Optional[str] = f"{GRAPH_BASE}{endpoint}"
+    query: Optional[Dict[str, Any]] = params or {}
+    count = 0
+    while url:
+        data = graph_get_url(url, access_token, params=query)
+        for item in data.get("value", []) or []:
+            yield item
+            count += 1
+            if max_items is not None and count >= max_items:
+                return
+        # nextLink já carrega todos os parâmetros da consulta ($skiptoken incluso)
+        url = data.get("@odata.nextLink")
+        query = None
+
+
+def group_contacts_by_domain(contacts: Iterable[dict]) -> Dict[str, List[Tuple[Tuple[str, str], Dict[str, str]]]]:
+    """
+    Agrega contatos por domínio em uma única passada.
+    Deduplica por (id, email) na inserção e calcula a chave de ordenação uma vez só.
+    Retorna: { "dominio.com": [ ((nome_lower, email_lower), { id, displayName, email }), ... ] }
+    (listas não ordenadas; use _sorted_domain_items para ordenar).
+    """
+    grouped: Dict[str, Dict[Tuple[str, str], Tuple[Tuple[str, str], Dict[str, str]]]] = {}
+    for c in contacts:
         cid = c.get("id") or ""
         name = c.get("displayName") or ""
-        emails = c.get("emailAddresses") or []
-        for e in emails:
+        name_key = name.lower()
+        for e in c.get("emailAddresses") or []:
             addr = (e.get("address") or "").strip()
             if not addr or "@" not in addr:
                 continue
-            domain = addr.split("@", 1)[1].lower()
-            grouped.setdefault(domain, []).append({
-                "id": cid,
-                "displayName": name,
-                "email": addr
-            })
-
-    # dedup por (id,email) e ordena
-    for d in list(grouped.keys()):
-        seen = set()
-        dedup = []
-        for item in grouped[d]:
-            key = (item["id"], item["email"].lower())
-            if key in seen:
+            addr_key = addr.lower()
+            domain = addr_key.split("@", 1)[1]
+            bucket = grouped.setdefault(domain, {})
+            key = (cid, addr_key)
+            if key in bucket:
                 continue
-            seen.add(key)
-            dedup.append(item)
-        grouped[d] = sorted(
-            dedup,
-            key=lambda x: (x["displayName"].lower(), x["email"].lower())
-        )
-
-    return dict(sorted(grouped.items(), key=lambda kv: kv[0]))
+            bucket[key] = ((name_key, addr_key), {"id": cid, "displayName": name, "email": addr})
+    return {d: list(bucket.values()) for d, bucket in grouped.items()}
+
+
+def _sorted_domain_items(entries: List[Tuple[Tuple[str, str], Dict[str, str]]]) -> List[Dict[str, str]]:
+    entries.sort(key=itemgetter(0))
+    return [item for _, item in entries]
+
+
+def fetch_contacts_grouped_by_domain(
+    access_token: str,
+    top: int = 100,
+    counts_only: bool = False,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    domain: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Lê contatos pessoais (paginando no Graph até 'top') e agrupa por domínio do e-mail.
+    Retorna: { "dominio.com": [ { id, displayName, email }, ... ], ... }
+    counts_only=True  -> { "dominio.com": 12, ... }
+    limit informado   -> { "dominio.com": { total, offset, limit, items: [...] }, ... }
+    domain informado  -> restringe o resultado a esse domínio.
+    """
+    params = {"$select": "id,displayName,emailAddresses", "$top": str(min(top, CONTACTS_PAGE_SIZE))}
+    contacts = graph_iter_pages("/me/contacts", access_token, params=params, max_items=top)
+    grouped = group_contacts_by_domain(contacts)
+
+    if domain:
+        d = domain.strip().lower()
+        grouped = {d: grouped[d]} if d in grouped else {}
+
+    domains = sorted(grouped)
+    if counts_only:
+        return {d: len(grouped[d]) for d in domains}
+
+    if limit is None:
+        return {d: _sorted_domain_items(grouped[d]) for d in domains}
+
+    sliced: Dict[str, Any] = {}
+    for d in domains:
+        entries = grouped[d]
+        total = len(entries)
+        if offset + limit < total:
+            # só ordena o necessário para a fatia pedida
+            page = [item for _, item in heapq.nsmallest(offset + limit, entries, key=itemgetter(0))[offset:]]
+        else:
+            page = _sorted_domain_items(entries)[offset:]
+        sliced[d] = {"total": total, "offset": offset, "limit": limit, "items": page}
+    return sliced
+
+
 def create_contact(
     access_token: str,
     givenName: str,
@@ -205,6 +466,20 @@ def create_contact(
     """
     Cria um contato pessoal (pasta padrão de contatos do usuário).
     """
+    payload = build_contact_payload(givenName, surname, email, businessPhones, extra)
+    return graph_post("/me/contacts", access_token, payload=payload)
+
+
+def build_contact_payload(
+    givenName: str,
+    surname: Optional[str] = None,
+    email: Optional[str] = None,
+    businessPhones: Optional[List[str]] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Monta o corpo de criação de contato aceito por POST /me/contacts.
+    """
     payload: Dict[str, Any] = {"givenName": givenName}
     if surname:
         payload["surname"] = surname
@@ -214,8 +489,7 @@ def create_contact(
         payload["businessPhones"] = businessPhones
     if extra:
         payload.update(extra)
-
-    return graph_post("/me/contacts", access_token, payload=payload)
+    return payload
 
 
 def update_contact(access_token: str, contact_id: str, payload: Dict[str, Any]) -> dict:
@@ -230,21 +504,34 @@ def send_email(access_token: str, subject: str, body_html: str, to_recipients: L
     Envia e-mail em nome do usuário autenticado.
     """
     payload = {
-        "message": {
-            "subject": subject or "(sem assunto)",
-            "body": {"contentType": "HTML", "content": body_html or ""},
-            "toRecipients": [{"emailAddress": {"address": r}} for r in to_recipients],
-        },
+        "message": build_message(subject, body_html, to_recipients),
         "saveToSentItems": True,
     }
     return graph_post("/me/sendMail", access_token, payload=payload)
 
 
-def list_sent_emails(access_token: str, top: int = 25) -> dict:
+def build_message(subject: str, body_html: str, to_recipients: List[str]) -> Dict[str, Any]:
+    """
+    Monta o recurso 'message' do Graph (usado em sendMail e na criação de rascunhos).
+    """
+    return {
+        "subject": subject or "(sem assunto)",
+        "body": {"contentType": "HTML", "content": body_html or ""},
+        "toRecipients": [{"emailAddress": {"address": r}} for r in to_recipients],
+    }
+
+
+def list_sent_emails(
+    access_token: str,
+    top: int = 25,
+    select: Optional[str] = None,
+    page_params: Optional[Dict[str, Any]] = None,
+) -> dict:
     """
     Lista e-mails da pasta Enviados (Sent Items).
+    page_params: parâmetros de continuação (vindos de um cursor); substituem top/select.
     """
-    params = {"$top": str(top), "$select": "id,subject,from,receivedDateTime,toRecipients"}
+    params = page_params or {"$top": str(top), "$select": select or "id,subject,from,receivedDateTime,toRecipients"}
     return graph_get("/me/mailFolders/SentItems/messages", access_token, params=params)
 
 
@@ -255,6 +542,25 @@ def get_profile(access_token: str) -> dict:
     return graph_get("/me", access_token)
 
 
+_OWNER_TTL = 3600.0
+
+
+def resolve_owner(access_token: str) -> str:
+    """
+    Identifica o usuário dono do token (id do /me), com cache
+    por hash do token para não chamar /me a cada requisição.
+    """
+    def load() -> str:
+        me = get_profile(access_token)
+        owner = me.get("id") or me.get("userPrincipalName")
+        if not owner:
+            raise RuntimeError("Não foi possível identificar o usuário (/me sem id).")
+        return owner
+
+    # namespace próprio: escritas do usuário não precisam refazer o /me
+    return get_cache().get_or_load(f"token:{user_key(access_token)}", ("owner",), _OWNER_TTL, load)
+
+
 def get_user_photo_bytes(access_token: str) -> bytes:
     """
     Retorna bytes da foto do usuário em /me/photo/$value).
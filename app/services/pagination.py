@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from flask import jsonify, request
+from itsdangerous import BadSignature, URLSafeSerializer
+
+# =========================
+# Campos permitidos por recurso (fields= -> $select)
+# =========================
+CONTACT_FIELDS = frozenset({
+    "id", "displayName", "givenName", "surname",
+    "emailAddresses", "businessPhones", "homePhones", "mobilePhone",
+    "companyName", "jobTitle", "department", "officeLocation",
+    "imAddresses", "birthday", "personalNotes", "categories",
+    "createdDateTime", "lastModifiedDateTime",
+})
+
+MESSAGE_FIELDS = frozenset({
+    "id", "subject", "from", "sender", "toRecipients", "ccRecipients", "bccRecipients",
+    "replyTo", "conversationId", "receivedDateTime", "sentDateTime", "isRead",
+    "bodyPreview", "webLink", "hasAttachments", "importance", "categories",
+    "lastModifiedDateTime",
+})
+
+_CURSOR_SALT = "graph-cursor"
+
+
+class CursorError(ValueError):
+    """Cursor inválido, adulterado ou emitido para outro endpoint."""
+
+
+def parse_fields(raw: Optional[str], allowed: Iterable[str], default: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Valida 'fields=a,b,c' contra a allowlist e devolve (select, erro).
+    Sem 'fields', devolve o select default. 'id' é sempre incluído.
+    """
+    if raw is None or not raw.strip():
+        return default, None
+    allowed = set(allowed)
+    requested = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        return None, f"Campos não permitidos em 'fields': {', '.join(unknown)}. Permitidos: {', '.join(sorted(allowed))}."
+    if "id" not in requested:
+        requested.insert(0, "id")
+    # preserva a ordem pedida, sem repetições
+    return ",".join(dict.fromkeys(requested)), None
+
+
+def encode_cursor(endpoint: str, next_link: str, secret: str) -> str:
+    """
+    Converte o @odata.nextLink do Graph em um cursor opaco e assinado.
+    Guarda só os parâmetros de consulta ($skiptoken, $skip, $top, $select...), nunca a URL.
+    """
+    query = dict(parse_qsl(urlsplit(next_link).query, keep_blank_values=True))
+    return URLSafeSerializer(secret, salt=_CURSOR_SALT).dumps({"ep": endpoint, "q": query})
+
+
+def decode_cursor(cursor: str, endpoint: str, secret: str) -> Dict[str, Any]:
+    """
+    Valida a assinatura do cursor e devolve os parâmetros da próxima página.
+    """
+    try:
+        data = URLSafeSerializer(secret, salt=_CURSOR_SALT).loads(cursor)
+    except BadSignature as e:
+        raise CursorError("Cursor inválido.") from e
+    if not isinstance(data, dict) or data.get("ep") != endpoint or not isinstance(data.get("q"), dict):
+        raise CursorError("Cursor não pertence a este endpoint.")
+    return data["q"]
+
+
+def attach_next_cursor(data: Dict[str, Any], endpoint: str, secret: str) -> Dict[str, Any]:
+    """
+    Remove o nextLink cru da resposta do Graph e adiciona 'next_cursor' (ou None).
+    """
+    next_link = data.pop("@odata.nextLink", None)
+    data["next_cursor"] = encode_cursor(endpoint, next_link, secret) if next_link else None
+    return data
+
+
+def conditional_json(data: Any, status: int = 200):
+    """
+    jsonify com ETag; responde 304 quando o If-None-Match do cliente bate.
+    """
+    resp = jsonify(data)
+    resp.status_code = status
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.add_etag()
+    return resp.make_conditional(request)
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from app.config import PROJECT_ROOT
+
+# =========================
+# Config (env)
+# =========================
+# false: nenhum hook é registrado (custo zero); true: hooks baratos que só perfilam quando disparados
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").strip().lower() in ("1", "true", "yes", "y")
+# sample: amostragem de pilha numa thread à parte (flamegraph) | cprofile: determinístico (pstats)
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample").strip().lower()
+# fração das requisições perfiladas automaticamente (0.01 = 1%)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# só estes prefixos de caminho entram na amostragem/ativação (vazio = todos)
+PROFILE_PATHS = tuple(p.strip() for p in os.getenv("PROFILE_PATHS", "/ai/,/mail/,/contacts/").split(",") if p.strip())
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(PROJECT_ROOT, "instance", "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+_EXTENSIONS = {"sample": ".collapsed", "cprofile": ".prof"}
+_ARMED_FILE = ".armed"
+_SAFE_NAME = re.compile(r"^[\w.-]+\.(collapsed|prof)$")
+
+
+# =========================
+# Ativação pelo admin (vale para todos os workers: marcador com prazo em PROFILE_DIR)
+# =========================
+_armed_until = 0.0
+_armed_checked = 0.0
+
+
+def arm(seconds: float) -> float:
+    """Perfila todas as requisições de PROFILE_PATHS pelos próximos N segundos (0 desliga)."""
+    global _armed_until, _armed_checked
+    until = time.time() + seconds if seconds > 0 else 0.0
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, _ARMED_FILE), "w") as f:
+        f.write(str(until))
+    _armed_until, _armed_checked = until, time.monotonic()
+    return until
+
+
+def armed_until() -> float:
+    """Prazo da ativação; o arquivo é relido no máximo uma vez por segundo por processo."""
+    global _armed_until, _armed_checked
+    now = time.monotonic()
+    if now - _armed_checked >= 1.0:
+        _armed_checked = now
+        try:
+            with open(os.path.join(PROFILE_DIR, _ARMED_FILE)) as f:
+                _armed_until = float(f.read() or 0)
+        except (OSError, ValueError):
+            _armed_until = 0.0
+    return _armed_until
+
+
+def wants_path(path: str) -> bool:
+    return not PROFILE_PATHS or path.startswith(PROFILE_PATHS)
+
+
+# =========================
+# Sessões de profiling
+# =========================
+class StackSampler:
+    """
+    Amostra a pilha de uma thread a cada intervalo (sys._current_frames) numa thread à parte.
+    A thread perfilada não é instrumentada: o custo fica na amostragem, não nas chamadas.
+    Saída no formato "collapsed" (flamegraph.pl, speedscope): "mod:func;mod:func N".
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> bytes:
+        self._stop.set()
+        self._thread.join()
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common()).encode()
+
+
+class ProfilerBusy(RuntimeError):
+    """Já há uma sessão cProfile ativa neste processo."""
+
+
+# No Python 3.12+ o cProfile usa sys.monitoring, que é do processo inteiro: um segundo
+# Profile.enable() concorrente levanta ValueError. Uma sessão por vez; as demais são puladas.
+_cprofile_lock = threading.Lock()
+
+
+class CProfileSession:
+    def __init__(self):
+        import cProfile
+
+        self._profile = cProfile.Profile()
+
+    def start(self) -> None:
+        if not _cprofile_lock.acquire(blocking=False):
+            raise ProfilerBusy("sessão cProfile já ativa neste processo")
+        try:
+            self._profile.enable()
+        except BaseException:
+            _cprofile_lock.release()
+            raise
+
+    def stop(self) -> bytes:
+        import marshal
+
+        try:
+            self._profile.disable()
+        finally:
+            _cprofile_lock.release()
+        self._profile.create_stats()
+        # mesmo formato de Profile.dump_stats: abre com pstats.Stats(arquivo) ou snakeviz
+        return marshal.dumps(self._profile.stats)
+
+
+def start_session(mode: str = PROFILE_MODE):
+    """Sessão iniciada, ou None se o cProfile já estiver em uso por outra requisição."""
+    if mode == "cprofile":
+        session = CProfileSession()
+    else:
+        session = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+    try:
+        session.start()
+    except ProfilerBusy:
+        return None
+    return session
+
+
+# =========================
+# Capturas em disco (diretório limitado a PROFILE_MAX_FILES)
+# =========================
+def save_capture(data: bytes, method: str, path: str, duration: float, mode: str = PROFILE_MODE) -> str:
+    slug = re.sub(r"[^\w-]+", "_", path.strip("/")) or "root"
+    now = time.time()
+    name = (f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}"
+            f"-{method}-{slug[:60]}-{int(duration * 1000)}ms-{os.getpid()}-{secrets.token_hex(3)}"
+            f"{_EXTENSIONS.get(mode, '.collapsed')}")
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp = os.path.join(PROFILE_DIR, f".{name}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, os.path.join(PROFILE_DIR, name))
+    _prune()
+    return name
+
+
+def _prune() -> None:
+    captures = list_captures()
+    for item in captures[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, item["name"]))
+        except OSError:
+            pass
+
+
+def list_captures() -> List[Dict[str, Any]]:
+    """Capturas da mais recente para a mais antiga."""
+    out = []
+    try:
+        entries = list(os.scandir(PROFILE_DIR))
+    except OSError:
+        return out
+    for entry in entries:
+        if not _SAFE_NAME.match(entry.name):
+            continue
+        st = entry.stat()
+        out.append({"name": entry.name, "bytes": st.st_size, "created_at": st.st_mtime})
+    return sorted(out, key=lambda c: c["created_at"], reverse=True)
+
+
+def capture_path(name: str) -> Optional[str]:
+    """Caminho da captura, ou None se o nome for inválido/inexistente (sem sair de PROFILE_DIR)."""
+    if not _SAFE_NAME.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.config import PROJECT_ROOT
+from app.services.cache import CACHE_PREFIX, CACHE_REDIS_URL, RedisBackend, RedisError
+
+try:  # lock entre processos só existe em POSIX
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# =========================
+# Config (env)
+# =========================
+RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "true").strip().lower() in ("1", "true", "yes", "y")
+# shm: arquivo mapeado em memória, compartilhado pelos workers do host | memory: só o processo | redis: entre hosts
+RATELIMIT_STORE = os.getenv("RATELIMIT_STORE", "shm").strip().lower()
+# "MÉTODO rota=escopo:limite/segundos+...;..." (rota como no Flask; '*' no fim vale como prefixo)
+RATELIMIT_RULES = os.getenv(
+    "RATELIMIT_RULES",
+    "POST /ai/=user:20/60+ip:60/60;"
+    "POST /ai/batch=user:5/60+ip:15/60;"
+    "POST /ai/chat=user:20/60+ip:60/60;"
+    "POST /mail/send=user:10/60+ip:30/60;"
+    "POST /mail/send-bulk=user:3/300+ip:10/300;"
+    "POST /contacts/import=user:3/300+ip:10/300;"
+    "GET /mail/summary=user:10/60+ip:30/60",
+)
+# vale para as rotas sem regra própria (vazio = sem limite)
+RATELIMIT_DEFAULT = os.getenv("RATELIMIT_DEFAULT", "ip:600/60")
+# rotas fora do limite: health check e notificações do Graph (chegam em rajadas dos IPs da Microsoft)
+RATELIMIT_EXEMPT = os.getenv("RATELIMIT_EXEMPT", "/api/health,/webhooks/graph")
+_DEFAULT_SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else os.path.join(PROJECT_ROOT, "instance")
+RATELIMIT_SHM_PATH = os.getenv("RATELIMIT_SHM_PATH", os.path.join(_DEFAULT_SHM_DIR, f"{CACHE_PREFIX}-ratelimit"))
+RATELIMIT_SHM_SLOTS = int(os.getenv("RATELIMIT_SHM_SLOTS", "65536"))
+RATELIMIT_REDIS_URL = os.getenv("RATELIMIT_REDIS_URL", CACHE_REDIS_URL)
+# quantos proxies confiáveis há na frente do app (0 = usa o IP da conexão, ignora X-Forwarded-For)
+RATELIMIT_PROXY_HOPS = int(os.getenv("RATELIMIT_PROXY_HOPS", "0"))
+
+
+class Limit(NamedTuple):
+    scope: str  # "user" | "ip"
+    limit: int
+    period: float
+
+    @property
+    def policy(self) -> str:
+        """Formato do cabeçalho RateLimit-Policy: '20;w=60'."""
+        return f"{self.limit};w={int(self.period)}"
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    limit: Limit
+    remaining: int
+    reset: float  # segundos até o balde encher de novo
+    retry_after: float  # segundos até caber a próxima requisição (0 se permitida)
+
+
+def parse_limits(raw: str) -> Tuple[Limit, ...]:
+    """'user:20/60+ip:60/60' -> (Limit('user', 20, 60.0), Limit('ip', 60, 60.0))."""
+    out = []
+    for part in (raw or "").split("+"):
+        scope, _, spec = part.strip().partition(":")
+        limit, _, period = spec.partition("/")
+        try:
+            out.append(Limit(scope.strip(), int(limit), float(period)))
+        except ValueError:
+            continue
+    # IP primeiro: uma rajada anônima é barrada sem gastar o balde do usuário
+    return tuple(sorted((l for l in out if l.scope in ("user", "ip") and l.limit > 0 and l.period > 0),
+                        key=lambda l: l.scope != "ip"))
+
+
+def parse_rules(raw: str) -> List[Tuple[str, str, Tuple[Limit, ...]]]:
+    """
+    "MÉTODO rota=limites;..." -> [(método, rota, limites)], mais específico primeiro.
+    Ex.: "POST /ai/=user:20/60+ip:60/60;GET /mail/*=ip:120/60"
+    """
+    out = []
+    for part in (raw or "").split(";"):
+        if "=" not in part:
+            continue
+        target, limits = part.split("=", 1)
+        method, _, rule = target.strip().partition(" ")
+        limits = parse_limits(limits)
+        if rule and limits:
+            out.append((method.upper(), rule.strip(), limits))
+    return sorted(out, key=lambda r: (not r[1].endswith("*"), len(r[1])), reverse=True)
+
+
+def _hash64(key: str) -> int:
+    # 0 marca slot livre no arquivo compartilhado
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+def _refill(tokens: float, last: float, now: float, limit: Limit) -> float:
+    return min(float(limit.limit), tokens + (now - last) * limit.limit / limit.period)
+
+
+def _decide(allowed: bool, tokens: float, limit: Limit) -> Decision:
+    rate = limit.limit / limit.period
+    return Decision(
+        allowed=allowed,
+        limit=limit,
+        remaining=int(tokens),
+        reset=(limit.limit - tokens) / rate,
+        retry_after=0.0 if allowed else (1.0 - tokens) / rate,
+    )
+
+
+# =========================
+# Armazenamento dos baldes
+# =========================
+class MemoryStore:
+    """Baldes no próprio processo: cada worker do gunicorn conta separado (desenvolvimento/testes)."""
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[float]] = {}
+
+    def take(self, key: str, limit: Limit) -> Decision:
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [float(limit.limit), now]
+            tokens = _refill(bucket[0], bucket[1], now, limit)
+            allowed = tokens >= 1.0
+            bucket[0], bucket[1] = (tokens - 1.0 if allowed else tokens), now
+        return _decide(allowed, bucket[0], limit)
+
+
+class SharedMemoryStore:
+    """
+    Baldes num arquivo mapeado em memória (tmpfs), visível a todos os workers do host.
+    Tabela hash de tamanho fixo: cada slot guarda (hash da chave, tokens, último acesso);
+    colisões procuram nos PROBE slots seguintes e, cheios, reaproveitam o menos recente.
+    Exclusão entre processos por lockf na faixa de slots; entre threads do mesmo processo
+    por um Lock (locks POSIX são do processo, não da thread).
+    """
+
+    name = "shm"
+    _SLOT = struct.Struct("<Qdd")
+    PROBE = 4
+
+    def __init__(self, path: str = RATELIMIT_SHM_PATH, slots: int = RATELIMIT_SHM_SLOTS):
+        if fcntl is None:
+            raise RuntimeError("RATELIMIT_STORE=shm requer POSIX (fcntl)")
+        self.path = path
+        self.slots = max(1, slots)
+        size = (self.slots + self.PROBE) * self._SLOT.size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit) -> Decision:
+        h = _hash64(key)
+        start = (h % self.slots) * self._SLOT.size
+        span = self.PROBE * self._SLOT.size
+        slot, mm = self._SLOT, self._mm
+        now = time.time()
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, span, start)
+            try:
+                victim, victim_last = start, float("inf")
+                for offset in range(start, start + span, slot.size):
+                    kh, tokens, last = slot.unpack_from(mm, offset)
+                    if kh == h:
+                        break
+                    if kh == 0:
+                        tokens, last = float(limit.limit), now
+                        break
+                    if last < victim_last:
+                        victim, victim_last = offset, last
+                else:
+                    offset, tokens, last = victim, float(limit.limit), now
+                tokens = _refill(tokens, last, now, limit)
+                allowed = tokens >= 1.0
+                if allowed:
+                    tokens -= 1.0
+                slot.pack_into(mm, offset, h, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, span, start)
+        return _decide(allowed, tokens, limit)
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+
+class RedisStore:
+    """Baldes no Redis (script Lua atômico): vale entre hosts, ao custo de uma ida e volta por balde."""
+
+    name = "redis"
+    _SCRIPT = """
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local limit, period, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(b[1]) or limit
+local last = tonumber(b[2]) or now
+tokens = math.min(limit, tokens + math.max(0, now - last) * limit / period)
+local allowed = 0
+if tokens >= 1 then tokens = tokens - 1; allowed = 1 end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(period * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url: str = RATELIMIT_REDIS_URL):
+        self._redis = RedisBackend(url)
+        self._sha = hashlib.sha1(self._SCRIPT.encode()).hexdigest()
+
+    def take(self, key: str, limit: Limit) -> Decision:
+        args = (f"{CACHE_PREFIX}:rl:{key}", limit.limit, limit.period, f"{time.time():.6f}")
+        try:
+            allowed, tokens = self._redis._command("EVALSHA", self._sha, 1, *args)
+        except RedisError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            allowed, tokens = self._redis._command("EVAL", self._SCRIPT, 1, *args)
+        return _decide(bool(allowed), float(tokens), limit)
+
+
+def _make_store(kind: str):
+    if kind == "shm":
+        return SharedMemoryStore()
+    if kind == "redis":
+        return RedisStore()
+    return MemoryStore()
+
+
+# =========================
+# Limitador
+# =========================
+class RateLimiter:
+    def __init__(self, store, rules: str = RATELIMIT_RULES, default: str = RATELIMIT_DEFAULT,
+                 exempt: str = RATELIMIT_EXEMPT):
+        self.store = store
+        self.rules = parse_rules(rules)
+        self.default = parse_limits(default)
+        self.exempt = {p.strip() for p in exempt.split(",") if p.strip()}
+        # (método, rota do Flask) -> (id da regra, limites); o número de rotas é fixo, não cresce
+        self._resolved: Dict[Tuple[str, str], Tuple[str, Tuple[Limit, ...]]] = {}
+
+    def limits_for(self, method: str, rule: str) -> Tuple[str, Tuple[Limit, ...]]:
+        resolved = self._resolved.get((method, rule))
+        if resolved is None:
+            resolved = ("", ())
+            if rule not in self.exempt:
+                for m, pattern, limits in self.rules:
+                    if m in (method, "*") and (
+                        rule.startswith(pattern[:-1]) if pattern.endswith("*") else rule == pattern
+                    ):
+                        resolved = (f"{m} {pattern}", limits)
+                        break
+                else:
+                    if self.default and method != "OPTIONS":
+                        resolved = ("*", self.default)
+            self._resolved[(method, rule)] = resolved
+        return resolved
+
+    def check(self, method: str, rule: str, user: Optional[str], ip: Optional[str]) -> Optional[Decision]:
+        """
+        Consome um token de cada balde da rota (IP, depois usuário) e para no primeiro que negar.
+        Devolve a decisão mais restritiva (para os cabeçalhos) ou None se a rota não tem limite.
+        """
+        rule_id, limits = self.limits_for(method, rule)
+        tightest = None
+        for limit in limits:
+            ident = ip if limit.scope == "ip" else user
+            if not ident:
+                # sem usuário identificado a rota responde 401; o balde por IP já cobre o abuso
+                continue
+            decision = self.store.take(f"{rule_id}|{limit.scope}|{ident}", limit)
+            if not decision.allowed:
+                return decision
+            if tightest is None or decision.remaining < tightest.remaining:
+                tightest = decision
+        return tightest
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    """Limitador do processo, criado na primeira chamada conforme RATELIMIT_STORE."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(_make_store(RATELIMIT_STORE))
+    return _limiter
+
+
+def reset_limiter() -> None:
+    """Descarta o limitador do processo (worker recém-criado por fork: conexão Redis/lock herdados)."""
+    global _limiter, _limiter_lock
+    _limiter = None
+    _limiter_lock = threading.Lock()
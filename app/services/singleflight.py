@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.services import metrics
+
+try:  # lock entre processos só existe em POSIX
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# =========================
+# Config (env)
+# =========================
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").strip().lower() in ("1", "true", "yes", "y")
+# Diretório compartilhado entre workers do gunicorn (vazio = só dentro do processo).
+# Guarda respostas por alguns segundos: use um diretório local/tmpfs, não um volume compartilhado.
+SINGLEFLIGHT_SHARED_DIR = os.getenv("SINGLEFLIGHT_SHARED_DIR", "").strip()
+# por quanto tempo uma resposta recém-obtida por outro worker ainda vale como "a mesma chamada"
+SINGLEFLIGHT_SHARED_TTL = float(os.getenv("SINGLEFLIGHT_SHARED_TTL", "1.0"))
+
+
+def make_key(*parts: Any) -> str:
+    """Chave estável (hash) a partir de partes serializáveis em JSON."""
+    raw = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def user_key(access_token: str) -> str:
+    return hashlib.sha256(access_token.encode()).hexdigest()[:16]
+
+
+class SingleFlight:
+    """
+    Chamadas concorrentes com a mesma chave compartilham uma única execução:
+    a primeira executa, as demais esperam e recebem uma cópia do resultado (ou a mesma exceção).
+    Não é cache: terminada a chamada, a próxima volta a executar.
+    """
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        if not SINGLEFLIGHT_ENABLED:
+            return fn()
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+
+        if not leader:
+            metrics.incr("singleflight.coalesced")
+            metrics.incr(f"singleflight.coalesced.{self.scope}")
+            # cópia: quem recebe pode alterar o dict sem afetar os demais
+            return copy.deepcopy(fut.result())
+
+        try:
+            result = self._shared(key, fn) if SINGLEFLIGHT_SHARED_DIR else fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    # -------------------------
+    # Entre processos (lock file)
+    # -------------------------
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(SINGLEFLIGHT_SHARED_DIR, f"{self.scope}-{key[:32]}")
+        return base + ".lock", base + ".json"
+
+    def _shared(self, key: str, fn: Callable[[], Any]) -> Any:
+        if fcntl is None:
+            return fn()
+        os.makedirs(SINGLEFLIGHT_SHARED_DIR, mode=0o700, exist_ok=True)
+        lock_path, data_path = self._paths(key)
+        with open(lock_path, "a") as lock:
+            # quem chegar enquanto outro worker busca fica bloqueado aqui
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                cached = self._read_fresh(data_path)
+                if cached is not None:
+                    metrics.incr("singleflight.coalesced")
+                    metrics.incr(f"singleflight.coalesced.{self.scope}")
+                    return cached[0]
+                result = fn()
+                self._write(data_path, result)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_fresh(path: str) -> Optional[Tuple[Any]]:
+        try:
+            if time.time() - os.path.getmtime(path) > SINGLEFLIGHT_SHARED_TTL:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return (json.load(f),)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path: str, result: Any) -> None:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError):
+            # resultado não serializável: só não é compartilhado entre workers
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import os
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+# SpanKind, StatusCode e get_current_span são usados pelos demais módulos via tracing.*
+from opentelemetry.trace import SpanKind, StatusCode, format_trace_id, get_current_span  # noqa: F401
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+from app.config import PROJECT_ROOT
+
+# =========================
+# Config (env)
+# =========================
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").strip().lower() in ("1", "true", "yes", "y")
+# file: uma linha OTLP/JSON por lote em TRACING_FILE | otlp: OTLP/HTTP em TRACING_OTLP_ENDPOINT | none
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file").strip().lower()
+TRACING_FILE = os.getenv("TRACING_FILE", os.path.join(PROJECT_ROOT, "instance", "traces.jsonl"))
+TRACING_FILE_MAX_BYTES = int(os.getenv("TRACING_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+# fração dos traces iniciados aqui que são gravados (traceparent de fora manda na decisão)
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "conecta-api")
+TRACING_FLUSH_SECONDS = float(os.getenv("TRACING_FLUSH_SECONDS", "2"))
+TRACING_MAX_QUEUE = int(os.getenv("TRACING_MAX_QUEUE", "4096"))
+
+_propagator = TraceContextTextMapPropagator()
+
+
+# =========================
+# Glue com o OpenTelemetry (SDK configurado em _setup_provider, só com TRACING_ENABLED)
+# =========================
+def get_tracer(name: str) -> trace.Tracer:
+    return trace.get_tracer(name)
+
+
+def current_trace_id() -> Optional[str]:
+    ctx = get_current_span().get_span_context()
+    return format_trace_id(ctx.trace_id) if ctx.is_valid else None
+
+
+def extract(headers: Any) -> otel_context.Context:
+    """Contexto do traceparent recebido (frontend, gateway); vazio se não houver um válido."""
+    return _propagator.extract(headers)
+
+
+def inject(headers: Dict[str, str]) -> Dict[str, str]:
+    """Acrescenta traceparent/tracestate do span atual aos cabeçalhos de saída."""
+    _propagator.inject(headers)
+    return headers
+
+
+def activate(span: trace.Span, parent: Optional[otel_context.Context] = None) -> object:
+    """Torna o span o atual fora de um 'with' (hooks before/after_request); desfazer com deactivate."""
+    return otel_context.attach(trace.set_span_in_context(span, parent))
+
+
+def deactivate(token: object) -> None:
+    otel_context.detach(token)
+
+
+def traced(name: str, kind: SpanKind = SpanKind.INTERNAL, record_args: Tuple[str, ...] = ()) -> Callable:
+    """
+    Decorador: envolve a função num span. record_args: parâmetros gravados como atributos.
+    Com TRACING_ENABLED=false devolve a própria função (custo zero).
+    """
+    def decorator(fn: Callable) -> Callable:
+        if not TRACING_ENABLED:
+            return fn
+        tracer = get_tracer(fn.__module__)
+        positions = {}
+        if record_args:
+            code = fn.__code__
+            names = code.co_varnames[:code.co_argcount]
+            positions = {a: names.index(a) for a in record_args if a in names}
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            attributes = {}
+            for arg, pos in positions.items():
+                value = kwargs.get(arg, args[pos] if pos < len(args) else None)
+                if isinstance(value, (str, int, float, bool)):
+                    attributes[f"code.arg.{arg}"] = value
+            with tracer.start_as_current_span(name, kind=kind, attributes=attributes):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def wrap(fn: Callable) -> Callable:
+    """Leva o span atual para outra thread (ThreadPoolExecutor.submit(tracing.wrap(fn), ...))."""
+    if not TRACING_ENABLED:
+        return fn
+    ctx = contextvars.copy_context()
+    return functools.wraps(fn)(lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs))
+
+
+def graph_client_request_id() -> Optional[str]:
+    """Trace id no formato GUID exigido pelo cabeçalho client-request-id do Graph."""
+    trace_id = current_trace_id()
+    return str(uuid.UUID(trace_id)) if trace_id else None
+
+
+# =========================
+# Exportação (BatchSpanProcessor do SDK: a thread é recriada no worker após o fork)
+# =========================
+def _make_exporter(kind: str):
+    from app.services.tracing_export import FileExporter
+
+    if kind == "otlp":
+        # OTLP/HTTP (protobuf): qualquer coletor OpenTelemetry, ou manage.py trace-collector
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter(endpoint=TRACING_OTLP_ENDPOINT, timeout=5)
+    if kind == "file":
+        return FileExporter(TRACING_FILE, TRACING_FILE_MAX_BYTES)
+    return None
+
+
+_provider = None
+
+
+def _setup_provider() -> None:
+    global _provider
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    from app.services.tracing_export import CountingExporter
+
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)),
+    )
+    exporter = _make_exporter(TRACING_EXPORTER)
+    if exporter is not None:
+        _provider.add_span_processor(BatchSpanProcessor(
+            CountingExporter(exporter),
+            max_queue_size=TRACING_MAX_QUEUE,
+            schedule_delay_millis=int(TRACING_FLUSH_SECONDS * 1000),
+        ))
+    trace.set_tracer_provider(_provider)
+
+
+if TRACING_ENABLED:
+    _setup_provider()
+
+
+def flush() -> None:
+    """Exporta o que está na fila (saída do worker, comandos CLI)."""
+    if _provider is not None:
+        _provider.force_flush()
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import base64
+import os
+from typing import Any, Dict, Sequence
+
+from google.protobuf.json_format import MessageToDict
+from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+from opentelemetry.sdk.trace import ReadableSpan
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+from app.services import json_codec, metrics
+
+# Importado só com TRACING_ENABLED=true (tracing._setup_provider): o SDK fica fora do boot dos workers.
+
+
+def otlp_json(request) -> Dict[str, Any]:
+    """ExportTraceServiceRequest (protobuf) -> OTLP/JSON, com ids em hex como na especificação."""
+    data = MessageToDict(request, use_integers_for_enums=True)
+    for rs in data.get("resourceSpans", []):
+        for ss in rs.get("scopeSpans", []):
+            for span in ss.get("spans", []):
+                for key in ("traceId", "spanId", "parentSpanId"):
+                    if span.get(key):
+                        span[key] = base64.b64decode(span[key]).hex()
+    return data
+
+
+class FileExporter(SpanExporter):
+    """Uma linha OTLP/JSON por lote (lida por manage.py trace-show); gira ao passar de max_bytes."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        try:
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except OSError:
+            pass
+        with open(self.path, "ab") as f:
+            f.write(json_codec.dumps(otlp_json(encode_spans(spans))) + b"\n")
+        return SpanExportResult.SUCCESS
+
+
+class CountingExporter(SpanExporter):
+    """Envolve o exportador real: tracing.exported_spans / tracing.export_errors em /api/metrics."""
+
+    def __init__(self, inner: SpanExporter):
+        self.inner = inner
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        try:
+            result = self.inner.export(spans)
+        except Exception:
+            result = SpanExportResult.FAILURE
+        if result is SpanExportResult.SUCCESS:
+            metrics.incr("tracing.exported_spans", len(spans))
+        else:
+            metrics.incr("tracing.export_errors")
+        return result
+
+    def shutdown(self) -> None:
+        self.inner.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.inner.force_flush(timeout_millis)
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import base64
+import datetime
+import hashlib
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from app.config import PROJECT_ROOT
+from app.services import json_codec, tracing
+
+# =========================
+# Config (env)
+# =========================
+# live: chamadas reais | record: reais + grava em cassete | replay: responde do cassete, sem rede
+HTTP_TRANSPORT = os.getenv("HTTP_TRANSPORT", "live").strip().lower()
+TRANSPORT_CASSETTE_DIR = os.getenv("TRANSPORT_CASSETTE_DIR", os.path.join(PROJECT_ROOT, "instance", "cassettes"))
+TRANSPORT_CASSETTE = os.getenv("TRANSPORT_CASSETTE", "default").strip()
+# replay: atraso = tempo gravado x fator (1 = como gravado, 0.1 = 10x mais rápido, 0 = sem espera)
+TRANSPORT_LATENCY_SCALE = float(os.getenv("TRANSPORT_LATENCY_SCALE", "1"))
+# replay sem gravação correspondente: error (levanta TransportMiss) | live (vai à rede)
+TRANSPORT_REPLAY_MISS = os.getenv("TRANSPORT_REPLAY_MISS", "error").strip().lower()
+# false: ignora o corpo ao casar requisições (prompts com data/hora mudam a cada execução)
+TRANSPORT_MATCH_BODY = os.getenv("TRANSPORT_MATCH_BODY", "true").strip().lower() in ("1", "true", "yes", "y")
+
+# nunca gravados: credenciais em query string (Gemini ?key=) e cabeçalhos de resposta irrelevantes
+_SECRET_PARAMS = {"key", "access_token", "code", "client_secret"}
+_DROP_RESPONSE_HEADERS = {"set-cookie", "date", "content-encoding", "transfer-encoding", "connection"}
+
+
+class TransportMiss(requests.ConnectionError):
+    """Replay sem gravação para a requisição (tratada pelos chamadores como falha de rede)."""
+
+
+def _canonical_url(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True) + [
+        (k, str(v)) for k, v in (params or {}).items() if v is not None
+    ]
+    query = sorted((k, "REDACTED" if k in _SECRET_PARAMS else v) for k, v in query)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def _body_hash(kwargs: Dict[str, Any]) -> str:
+    if "json" in kwargs and kwargs["json"] is not None:
+        raw = json_codec.dumps(kwargs["json"], sort_keys=True)
+    else:
+        raw = kwargs.get("data") or b""
+        raw = raw.encode() if isinstance(raw, str) else bytes(raw)
+    return hashlib.sha256(raw).hexdigest()[:16] if raw else ""
+
+
+def _match_target(canonical_url: str) -> str:
+    # sem esquema/host: o cassete gravado contra o Graph real também serve com GRAPH_BASE_URL de um stub
+    parts = urlsplit(canonical_url)
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+
+def request_key(method: str, url: str, kwargs: Dict[str, Any]) -> Tuple[str, str, str]:
+    body = _body_hash(kwargs) if TRANSPORT_MATCH_BODY else ""
+    return method.upper(), _match_target(_canonical_url(url, kwargs.get("params"))), body
+
+
+def _build_response(entry: Dict[str, Any], url: str) -> requests.Response:
+    r = requests.Response()
+    r.status_code = entry["status"]
+    r.reason = entry.get("reason") or ""
+    r.headers = CaseInsensitiveDict(entry.get("headers") or {})
+    r.url = url
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+    r._content = base64.b64decode(entry["body_b64"]) if "body_b64" in entry else entry.get("body", "").encode()
+    # corpo já em memória: iter_content()/close() funcionam como num stream lido
+    r._content_consumed = True
+    r.elapsed = datetime.timedelta(seconds=entry.get("elapsed", 0.0))
+    return r
+
+
+# =========================
+# Transportes
+# =========================
+class LiveTransport:
+    name = "live"
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        return requests.request(method, url, **kwargs)
+
+
+class Cassette:
+    """Arquivo JSONL (uma interação por linha) em TRANSPORT_CASSETTE_DIR/<nome>.jsonl."""
+
+    def __init__(self, name: str = TRANSPORT_CASSETTE, directory: str = TRANSPORT_CASSETTE_DIR):
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self._lock = threading.Lock()
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        line = json_codec.dumps(entry) + b"\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(line)
+
+    def load(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.path, "rb") as f:
+                return [json_codec.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+
+class RecordingTransport:
+    """Chama o serviço real e grava requisição/resposta/tempo no cassete."""
+
+    name = "record"
+
+    def __init__(self, cassette: Cassette, inner: Optional[LiveTransport] = None):
+        self.cassette = cassette
+        self.inner = inner or LiveTransport()
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        started = time.perf_counter()
+        r = self.inner.request(method, url, **kwargs)
+        # streams também são lidos por inteiro para a gravação
+        content = r.content
+        elapsed = time.perf_counter() - started
+        entry = {
+            "method": method.upper(),
+            "url": _canonical_url(url, kwargs.get("params")),
+            "body_hash": _body_hash(kwargs),
+            "status": r.status_code,
+            "reason": r.reason,
+            "headers": {k: v for k, v in r.headers.items() if k.lower() not in _DROP_RESPONSE_HEADERS},
+            "elapsed": round(elapsed, 6),
+        }
+        try:
+            entry["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["body_b64"] = base64.b64encode(content).decode()
+        self.cassette.append(entry)
+        return _build_response(entry, r.url)
+
+
+class ReplayTransport:
+    """
+    Responde do cassete, sem rede. Requisições repetidas recebem as respostas gravadas na ordem
+    (a última se repete), e cada uma espera o tempo gravado x latency_scale.
+    """
+
+    name = "replay"
+
+    def __init__(self, cassette: Cassette, latency_scale: float = TRANSPORT_LATENCY_SCALE,
+                 on_miss: str = TRANSPORT_REPLAY_MISS):
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+        self.on_miss = on_miss
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = defaultdict(list)
+        self._cursor: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        for entry in cassette.load():
+            key = (entry["method"], _match_target(entry["url"]),
+                   entry.get("body_hash", "") if TRANSPORT_MATCH_BODY else "")
+            self._entries[key].append(entry)
+        self.misses = 0
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        key = request_key(method, url, kwargs)
+        with self._lock:
+            entries = self._entries.get(key)
+            if entries:
+                i = self._cursor[key]
+                self._cursor[key] = min(i + 1, len(entries) - 1)
+                entry = entries[i]
+            else:
+                entry = None
+                self.misses += 1
+        if entry is None:
+            if self.on_miss == "live":
+                return LiveTransport().request(method, url, **kwargs)
+            raise TransportMiss(f"sem gravação em {self.cassette.path} para {key[0]} {key[1]}")
+        delay = entry.get("elapsed", 0.0) * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+        return _build_response(entry, url)
+
+
+def _make_transport(kind: str):
+    if kind == "record":
+        return RecordingTransport(Cassette())
+    if kind == "replay":
+        return ReplayTransport(Cassette())
+    return LiveTransport()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Transporte do processo, criado na primeira chamada conforme HTTP_TRANSPORT."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = _make_transport(HTTP_TRANSPORT)
+    return _transport
+
+
+def set_transport(transport) -> None:
+    """Troca o transporte do processo (ex.: comandos de benchmark com um cassete específico)."""
+    global _transport
+    _transport = transport
+
+
+# =========================
+# Mesma forma de chamada do módulo requests
+# =========================
+_tracer = tracing.get_tracer("app.transport")
+
+
+def request(method: str, url: str, **kwargs: Any) -> requests.Response:
+    if not tracing.TRACING_ENABLED:
+        return get_transport().request(method, url, **kwargs)
+    parts = urlsplit(url)
+    # só o caminho: a query do Gemini leva a API key
+    with _tracer.start_as_current_span(f"HTTP {method.upper()} {parts.hostname}", kind=tracing.SpanKind.CLIENT,
+                                       attributes={"http.request.method": method.upper(),
+                                                   "server.address": parts.hostname, "url.path": parts.path}) as span:
+        transport = get_transport()
+        span.set_attribute("transport.mode", transport.name)
+        kwargs["headers"] = tracing.inject(dict(kwargs.get("headers") or {}))
+        r = transport.request(method, url, **kwargs)
+        span.set_attribute("http.response.status_code", r.status_code)
+        # ids do Graph: request-id identifica a chamada no suporte da Microsoft
+        for attr, header in (("graph.request_id", "request-id"), ("graph.client_request_id", "client-request-id")):
+            if r.headers.get(header):
+                span.set_attribute(attr, r.headers[header])
+        if r.status_code >= 400:
+            span.set_status(tracing.StatusCode.ERROR, f"HTTP {r.status_code}")
+        return r
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def patch(url: str, **kwargs: Any) -> requests.Response:
+    return request("PATCH", url, **kwargs)
+
+
+def delete(url: str, **kwargs: Any) -> requests.Response:
+    return request("DELETE", url, **kwargs)
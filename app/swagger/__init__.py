@@ -0,0 +1,9 @@
+def swag_from(specs: dict):
+    """
+    Equivalente ao flasgger.swag_from para specs em dict (sem validação): só anexa o spec à view,
+    que o flasgger lê ao montar o /api/docs.json. Evita importar o flasgger no boot das rotas.
+    """
+    def decorator(function):
+        function.specs_dict = specs
+        return function
+    return decorator
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import threading
+from functools import cached_property
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import request
+
+from app.config import PROJECT_ROOT
+from app.services import json_codec
+
+# =========================
+# Config (env)
+# =========================
+# live: flasgger monta o spec a cada processo | cached: spec em disco, servido com ETag | off: sem docs
+SWAGGER_MODE = os.getenv("SWAGGER_MODE", "cached").strip().lower()
+# false em produção: só /api/docs.json, sem a UI (templates e estáticos do flasgger)
+SWAGGER_UI = os.getenv("SWAGGER_UI", "true").lower() in ("1", "true", "yes", "y")
+SWAGGER_SPEC_DIR = os.getenv("SWAGGER_SPEC_DIR", os.path.join(PROJECT_ROOT, "instance"))
+
+APP_DIR = os.path.join(PROJECT_ROOT, "app")
+# o spec sai das docstrings/swag_from das rotas e do template base
+_SOURCE_GLOBS = ("routes/*.py", "swagger/*.py", "main.py")
+
+
+def source_hash(extra: str = "") -> str:
+    """Hash do conteúdo dos arquivos que definem o spec; muda quando alguma rota muda."""
+    from importlib.metadata import version
+
+    h = hashlib.sha256(f"flasgger={version('flasgger')}\0{extra}".encode())
+    for pattern in _SOURCE_GLOBS:
+        for path in sorted(glob.glob(os.path.join(APP_DIR, pattern))):
+            h.update(os.path.relpath(path, APP_DIR).encode())
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class SpecCache:
+    """Gera o spec uma vez por versão do código e guarda em SWAGGER_SPEC_DIR/openapi-<hash>.json."""
+
+    def __init__(self, app, swagger_factory: Callable[[], Any], endpoint: str):
+        self.app = app
+        # o flasgger só é importado/instanciado se o spec precisar ser montado
+        self.swagger_factory = swagger_factory
+        self.endpoint = endpoint
+        self._lock = threading.Lock()
+        self._data: Optional[Tuple[bytes, str]] = None
+
+    @cached_property
+    def path(self) -> str:
+        # calculado no primeiro acesso, não no boot
+        version = source_hash(json_codec.dumps(self.app.config.get("SWAGGER", {}), sort_keys=True).decode())
+        return os.path.join(SWAGGER_SPEC_DIR, f"openapi-{version[:16]}.json")
+
+    def get(self) -> Tuple[bytes, str]:
+        """(bytes do spec, etag)."""
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    data = self._read() or self.build()
+                    self._data = (data, hashlib.sha256(data).hexdigest()[:32])
+        return self._data
+
+    def _read(self) -> Optional[bytes]:
+        try:
+            with open(self.path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def build(self) -> bytes:
+        """Monta o spec pelo flasgger e grava em disco (apaga versões antigas)."""
+        with self.app.app_context():
+            data = json_codec.dumps(self.swagger_factory().get_apispecs(self.endpoint), sort_keys=True)
+        try:
+            os.makedirs(SWAGGER_SPEC_DIR, exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+            for old in glob.glob(os.path.join(SWAGGER_SPEC_DIR, "openapi-*.json")):
+                if old != self.path:
+                    os.remove(old)
+        except OSError:
+            # disco somente leitura: segue servindo da memória
+            pass
+        return data
+
+    def view(self):
+        data, etag = self.get()
+        resp = json_codec.raw_json_response(data)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "public, no-cache"
+        return resp.make_conditional(request)
+
+
+def init_swagger(app, template: Dict[str, Any], config: Dict[str, Any]) -> None:
+    """
+    Liga a documentação conforme SWAGGER_MODE/SWAGGER_UI.
+    Em 'cached' sem UI o flasgger nem é importado no boot: só quando o spec precisar ser montado.
+    """
+    if SWAGGER_MODE == "off":
+        return
+    config = dict(config, swagger_ui=SWAGGER_UI)
+    spec = config["specs"][0]
+    if SWAGGER_MODE == "live" or SWAGGER_UI:
+        from flasgger import Swagger
+
+        swagger = Swagger(app, template=template, config=config)
+        if SWAGGER_MODE == "cached":
+            cache = SpecCache(app, lambda: swagger, spec["endpoint"])
+            app.view_functions[f"flasgger.{spec['endpoint']}"] = cache.view
+            app.extensions["openapi_spec"] = cache
+        return
+
+    def detached_swagger():
+        from flasgger import Swagger
+
+        swagger = Swagger(template=template, config=config)
+        swagger.app = app
+        swagger.load_config(app)
+        return swagger
+
+    cache = SpecCache(app, detached_swagger, spec["endpoint"])
+    app.add_url_rule(spec["route"], spec["endpoint"], cache.view)
+    app.extensions["openapi_spec"] = cache
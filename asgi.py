@@ -0,0 +1,6 @@
+# Usado só com GUNICORN_WORKER_CLASS=uvicorn (requer uvicorn e asgiref instalados).
+from asgiref.wsgi import WsgiToAsgi
+
+from wsgi import app as wsgi_app
+
+app = WsgiToAsgi(wsgi_app)
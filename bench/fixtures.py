@@ -0,0 +1,47 @@
+"""
+Dados sintéticos para os comandos de benchmark do manage.py.
+Fica fora de app/: nada aqui é importado pelos workers.
+"""
+from __future__ import annotations
+
+import json
+
+
+def synthetic_email(i: int, target_bytes: int) -> str:
+    """E-mail HTML 'de Outlook': estilos inline, tabelas, pixel de rastreio, assinatura e cadeia de respostas."""
+    para = ('<p style="margin:0;font-family:Calibri,sans-serif;font-size:11pt;color:#1f1f1f">'
+            f'Segue a atualização {i} do projeto, com prazos e responsáveis. '
+            '<a href="https://exemplo.com/relatorio">relatório</a></p>')
+    head = ('<html><head><style>p{margin:0} .x{color:red}</style></head><body>'
+            '<img src="https://t.exemplo.com/o.gif" width="1" height="1">'
+            + para * 5 + '<div id="Signature"><p>Fulano de Tal | Gerente</p></div>')
+    quoted = ('<div id="divRplyFwdMsg"><b>De:</b> Ciclano<br><b>Enviado:</b> segunda-feira</div>'
+              '<blockquote style="border-left:1px solid #ccc">'
+              + '<table><tr><td style="padding:4px">' + para + '</td></tr></table>')
+    body = [head]
+    size = len(head)
+    while size < target_bytes:
+        body.append(quoted)
+        size += len(quoted)
+    body.append("</blockquote>" * (len(body) - 1) + "</body></html>")
+    return "".join(body)
+
+
+def synthetic_inbox(count: int) -> bytes:
+    """Resposta do Graph para /me/mailFolders/Inbox/messages com 'count' mensagens."""
+    items = [{
+        "@odata.etag": f'W/"CQAAABYAAAB{i:08d}"',
+        "id": f"AAMkAGI2TG93AAA{i:032d}=",
+        "subject": f"Re: Atualização do projeto {i} — revisão de orçamento",
+        "from": {"emailAddress": {"name": f"Remetente {i}", "address": f"pessoa{i}@exemplo.com.br"}},
+        "toRecipients": [{"emailAddress": {"name": "Você", "address": "voce@exemplo.com.br"}}],
+        "receivedDateTime": f"2024-05-{1 + i % 28:02d}T12:{i % 60:02d}:00Z",
+        "bodyPreview": ("Olá, segue a versão revisada com os ajustes combinados na reunião. " * 4)[:255],
+        "isRead": i % 3 == 0,
+        "webLink": f"https://outlook.office365.com/owa/?ItemID=AAMkAGI2TG93AAA{i:032d}%3D&exvsurl=1",
+    } for i in range(count)]
+    return json.dumps({
+        "@odata.context": "https://graph.microsoft.com/v1.0/$metadata#users('me')/mailFolders('Inbox')/messages",
+        "value": items,
+        "@odata.nextLink": "https://graph.microsoft.com/v1.0/me/mailFolders/Inbox/messages?$skip=100",
+    }).encode()
@@ -0,0 +1,110 @@
+"""
+Configuração do Gunicorn (gunicorn -c gunicorn.conf.py, sem wsgi:app: o app é definido aqui).
+
+A carga é quase toda espera de I/O (Graph e Gemini): poucos processos, muitas threads.
+Tudo pode ser ajustado por variáveis de ambiente GUNICORN_*.
+"""
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    raw = os.getenv(name, "").strip()
+    return int(raw) if raw else default
+
+
+def _available_cpus():
+    """CPUs efetivas do container (cota do cgroup v2/v1), não as do host."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else multiprocessing.cpu_count()
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                cpus = min(cpus, max(1, quota // period))
+        except (OSError, ValueError):
+            pass
+    return cpus
+
+
+# =========================
+# Classe de worker: gthread (padrão) | gevent | uvicorn
+# =========================
+WORKER_KIND = os.getenv("GUNICORN_WORKER_CLASS", "gthread").strip().lower()
+# o app é escolhido só aqui: rode "gunicorn -c gunicorn.conf.py" sem argumento posicional,
+# que teria precedência sobre wsgi_app (e daria o app WSGI ao UvicornWorker)
+wsgi_app = "wsgi:app"
+
+if WORKER_KIND == "gevent":
+    # com preload o app é importado no master: o patch precisa vir antes de qualquer import de rede
+    from gevent import monkey
+
+    monkey.patch_all()
+    worker_class = "gevent"
+    worker_connections = _env_int("GUNICORN_WORKER_CONNECTIONS", 1000)
+elif WORKER_KIND == "uvicorn":
+    # Flask é WSGI: roda adaptado por asgi.py (requer uvicorn e asgiref)
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "asgi:app"
+else:
+    worker_class = "gthread"
+    threads = _env_int("GUNICORN_THREADS", 16)
+
+# =========================
+# Processos, limites e timeouts
+# =========================
+bind = os.getenv("GUNICORN_BIND", f":{os.getenv('PORT', '8080')}")
+workers = _env_int("GUNICORN_WORKERS", max(2, _available_cpus()))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes", "y")
+# recicla o worker depois de N requisições (com jitter para não reiniciarem todos juntos)
+max_requests = _env_int("GUNICORN_MAX_REQUESTS", 2000)
+max_requests_jitter = _env_int("GUNICORN_MAX_REQUESTS_JITTER", max_requests // 10)
+# chamadas ao Gemini podem demorar; o timeout do worker precisa cobrir a mais lenta
+timeout = _env_int("GUNICORN_TIMEOUT", 120)
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+if preload_app:
+    # wsgi.py aquece o app no master (ver app.main.preload_app)
+    os.environ["APP_PRELOAD"] = "true"
+
+
+# =========================
+# Hooks
+# =========================
+def _flask_app(worker):
+    app = getattr(worker, "wsgi", None)
+    # uvicorn: o app Flask fica dentro do adaptador WsgiToAsgi
+    return getattr(app, "wsgi_application", app)
+
+
+def post_fork(server, worker):
+    from app.main import reset_after_fork
+
+    reset_after_fork()
+
+
+def worker_exit(server, worker):
+    from app.main import shutdown_background
+
+    app = _flask_app(worker)
+    if app is not None and hasattr(app, "app_context"):
+        shutdown_background(app)
+
+
+def when_ready(server):
+    server.log.info(
+        "gunicorn: %s workers, classe %s%s, preload=%s, max_requests=%s±%s",
+        workers, worker_class, f", {threads} threads" if worker_class == "gthread" else "",
+        preload_app, max_requests, max_requests_jitter,
+    )
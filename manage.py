@@ -1,3 +1,10 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import click
 from flask.cli import FlaskGroup
 from app.main import create_app
 
@@ -6,5 +13,603 @@ def create_app_wrapper():
 
 cli = FlaskGroup(create_app=create_app_wrapper)
 
+
+@cli.command("bench-db")
+@click.option("--url", help="Banco de teste (padrão: SQLite temporário); só cria/apaga bench_request_logs. "
+              "Ex.: postgresql://user:pw@localhost/bench")
+@click.option("--threads", default=8, show_default=True)
+@click.option("--writes", default=200, show_default=True, help="Inserções por thread")
+def bench_db(url, threads, writes):
+    """
+    Escritas concorrentes com o esquema do request_logs: engine padrão x perfil de produção.
+    Usa uma tabela própria (bench_request_logs, apagada no fim): com --url apontando para
+    um banco real, os logs de verdade não são tocados.
+    """
+    from sqlalchemy import Index, MetaData, Table, create_engine, insert
+    from sqlalchemy.orm import Session
+
+    from app.config import engine_options, normalize_database_url
+    from app.extensions import apply_sqlite_pragmas
+    from app.models.request_log import RequestLog
+
+    # mesmas colunas e índices do request_logs, com nomes próprios (índices são globais no Postgres)
+    source = RequestLog.__table__
+    bench_table = Table("bench_request_logs", MetaData(), *(c._copy() for c in source.columns))
+    for ix in source.indexes:
+        Index(f"bench_{ix.name}", *(bench_table.c[c.name] for c in ix.columns))
+
+    tmp_dir = None
+    if not url:
+        tmp_dir = tempfile.mkdtemp(prefix="bench-db-")
+    for profile in ("padrão", "produção"):
+        target = normalize_database_url(url) if url else f"sqlite:///{os.path.join(tmp_dir, profile + '.db')}"
+        if profile == "padrão":
+            engine = create_engine(target)
+        else:
+            engine = create_engine(target, **engine_options(target))
+            apply_sqlite_pragmas(engine)
+        bench_table.drop(engine, checkfirst=True)
+        bench_table.create(engine)
+
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def worker(n):
+            mine = []
+            for i in range(writes):
+                started = time.perf_counter()
+                try:
+                    # mesmo padrão do request logger: uma sessão e um commit por requisição
+                    with Session(engine) as s:
+                        s.execute(insert(bench_table).values(method="GET", path=f"/bench/{n}/{i}", status_code=200,
+                                                             ip="127.0.0.1", message='{"status":"ok"}'))
+                        s.commit()
+                except Exception as e:
+                    with lock:
+                        errors.append(type(e).__name__)
+                    continue
+                mine.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(mine)
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+        bench_table.drop(engine, checkfirst=True)
+        engine.dispose()
+
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+        click.echo(
+            f"{profile:<9} {len(latencies) / elapsed:8.0f} escritas/s  "
+            f"p50 {statistics.median(latencies or [0]) * 1000:6.2f} ms  p95 {p95 * 1000:6.2f} ms  "
+            f"erros {len(errors)}{' (' + ', '.join(sorted(set(errors))) + ')' if errors else ''}"
+        )
+
+@cli.command("bench-html")
+@click.option("--corpus", type=click.Path(exists=True, file_okay=False), help="Diretório com arquivos .html/.eml")
+@click.option("--count", default=200, show_default=True, help="Mensagens sintéticas (sem --corpus)")
+@click.option("--size-kb", default=200, show_default=True, help="Tamanho de cada mensagem sintética")
+@click.option("--max-chars", type=int, default=None, help="Limite do texto (padrão MAIL_TEXT_MAX_CHARS)")
+def bench_html(corpus, count, size_kb, max_chars):
+    """Mede throughput e pico de memória da extração HTML -> texto."""
+    import tracemalloc
+
+    from app.services.html_text import html_to_text
+    from bench.fixtures import synthetic_email
+
+    if corpus:
+        docs = []
+        for name in sorted(os.listdir(corpus)):
+            with open(os.path.join(corpus, name), "r", encoding="utf-8", errors="replace") as f:
+                docs.append(f.read())
+    else:
+        docs = [synthetic_email(i, size_kb * 1024) for i in range(count)]
+    if not docs:
+        raise click.ClickException("Corpus vazio.")
+
+    total_in = sum(len(d) for d in docs)
+    total_out = consumed = 0
+    started = time.perf_counter()
+    for d in docs:
+        out = html_to_text(d, max_chars=max_chars)
+        total_out += len(out["text"])
+        consumed += out["consumed_chars"]
+    elapsed = time.perf_counter() - started
+
+    # pico medido em uma segunda passada: o tracemalloc distorce o tempo
+    peak = 0
+    tracemalloc.start()
+    for d in docs:
+        tracemalloc.reset_peak()
+        html_to_text(d, max_chars=max_chars)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    click.echo(f"mensagens:        {len(docs)}")
+    click.echo(f"entrada:          {total_in / 1e6:.1f} MB (lidos {consumed / 1e6:.1f} MB)")
+    click.echo(f"saída:            {total_out / 1e3:.1f} KB de texto")
+    click.echo(f"tempo:            {elapsed * 1000 / len(docs):.2f} ms/mensagem")
+    click.echo(f"throughput:       {total_in / 1e6 / elapsed:.1f} MB/s")
+    click.echo(f"pico de memória:  {peak / 1e6:.2f} MB por mensagem")
+
+
+@cli.command("bench-json")
+@click.option("--messages", default=100, show_default=True, help="Mensagens na resposta simulada do Graph")
+@click.option("--requests", "iterations", default=300, show_default=True, help="Requisições por modo")
+def bench_json(messages, iterations):
+    """CPU por requisição: jsonify stdlib x provider rápido x repasse bruto, com e sem compressão."""
+    import json
+
+    from flask import current_app
+    from flask.json.provider import DefaultJSONProvider
+
+    from app.middleware.compression import choose_encoding, compress_response
+    from app.services import json_codec
+    from app.services.json_codec import FastJSONProvider, raw_json_response
+    from bench.fixtures import synthetic_inbox
+
+    app = current_app._get_current_object()
+    raw = synthetic_inbox(messages)
+    stdlib = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    modes = {
+        "jsonify stdlib": lambda: stdlib.response(json.loads(raw)),
+        f"jsonify {json_codec.BACKEND_NAME}": lambda: fast.response(json_codec.loads(raw)),
+        "repasse bruto": lambda: raw_json_response(raw),
+    }
+    encodings = [None, "gzip"] + (["br"] if choose_encoding("br") == "br" else [])
+
+    click.echo(f"payload: {len(raw) / 1024:.1f} KB ({messages} mensagens), {iterations} requisições por modo")
+    with app.test_request_context():
+        for name, build in modes.items():
+            for enc in encodings:
+                started = time.process_time()
+                for _ in range(iterations):
+                    resp = compress_response(build(), enc)
+                    size = len(resp.get_data())
+                cpu_ms = (time.process_time() - started) * 1000 / iterations
+                click.echo(f"{name:<18} {enc or 'identity':<9} {cpu_ms:7.3f} ms CPU/req  {size / 1024:7.1f} KB")
+
+
+@cli.command("openapi-build")
+def openapi_build():
+    """Gera o spec OpenAPI em disco (SWAGGER_SPEC_DIR) para os workers não montarem no boot."""
+    from flask import current_app
+
+    cache = current_app.extensions.get("openapi_spec")
+    if cache is None:
+        raise click.ClickException("SWAGGER_MODE precisa ser 'cached'.")
+    data = cache.build()
+    click.echo(f"{cache.path} ({len(data) / 1024:.1f} KB)")
+
+_STARTUP_PROBE = """
+import json, time
+t0 = time.perf_counter()
+from app.main import create_app
+t1 = time.perf_counter()
+app = create_app()
+t2 = time.perf_counter()
+app.test_client().get("/api/health")
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "factory": t2 - t1, "first_request": t3 - t2}))
+"""
+
+
+@cli.command("profile-startup")
+@click.option("--min-ms", default=5.0, show_default=True, help="Omite módulos com tempo acumulado menor")
+@click.option("--depth", default=4, show_default=True, help="Profundidade máxima da árvore")
+def profile_startup(min_ms, depth):
+    """Árvore de tempo de import (python -X importtime) e tempo da factory, num processo novo."""
+    import json
+    import subprocess
+    import sys
+
+    env = dict(os.environ)
+    env.pop("FLASK_RUN_FROM_CLI", None)  # mede como no Gunicorn (sem Flask-Migrate)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _STARTUP_PROBE],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise click.ClickException(proc.stderr[-2000:])
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:]  # espaço depois do '|'; o resto da indentação é 2 por nível
+        level = (len(name) - len(name.lstrip())) // 2
+        rows.append((level, int(cumulative), name.strip()))
+
+    # -X importtime imprime em pós-ordem (filhos antes do pai); invertido vira árvore legível
+    click.echo("módulo (tempo acumulado)")
+    for level, cumulative, name in reversed(rows):
+        if level < depth and cumulative / 1000 >= min_ms:
+            click.echo(f"{'  ' * level}{name:<{48 - 2 * level}} {cumulative / 1000:8.1f} ms")
+
+    timing = json.loads(proc.stdout.strip().splitlines()[-1])
+    click.echo("")
+    click.echo(f"import app.main   {timing['import'] * 1000:8.1f} ms")
+    click.echo(f"create_app()      {timing['factory'] * 1000:8.1f} ms")
+    click.echo(f"1a requisição     {timing['first_request'] * 1000:8.1f} ms")
+
+def _stub_graph_server(port: int, delay_ms: int, messages: int):
+    """Graph falso (ThreadingHTTPServer, ainda não iniciado) com a Inbox sintética."""
+    import json
+    import uuid
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from bench.fixtures import synthetic_inbox
+
+    inbox = synthetic_inbox(messages)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(delay_ms / 1000)
+            path = self.path.split("?", 1)[0]
+            if path == "/v1.0/me":
+                # um usuário por token, para o teste não cair todo no mesmo namespace de cache
+                token = self.headers.get("Authorization", "")[-12:]
+                body = json.dumps({"id": f"stub-{token}", "mail": "stub@exemplo.com"}).encode()
+            elif path.startswith("/v1.0/me/mailFolders/") or path.startswith("/v1.0/me/messages"):
+                body = inbox
+            else:
+                body = b'{"value": []}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            # como o Graph: request-id próprio e client-request-id devolvido quando pedido
+            self.send_header("request-id", str(uuid.uuid4()))
+            if self.headers.get("return-client-request-id") == "true" and self.headers.get("client-request-id"):
+                self.send_header("client-request-id", self.headers["client-request-id"])
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+@cli.command("stub-graph")
+@click.option("--port", default=9900, show_default=True)
+@click.option("--delay-ms", default=100, show_default=True, help="Latência simulada por chamada")
+@click.option("--messages", default=25, show_default=True, help="Mensagens na resposta da Inbox")
+def stub_graph(port, delay_ms, messages):
+    """Graph falso para teste de carga (use GRAPH_BASE_URL=http://127.0.0.1:<port>/v1.0 no app)."""
+    server = _stub_graph_server(port, delay_ms, messages)
+    click.echo(f"stub do Graph em http://127.0.0.1:{port}/v1.0 (latência {delay_ms} ms)")
+    server.serve_forever()
+
+
+@cli.command("memcheck")
+@click.option("--requests", "n", default=1000, show_default=True, help="Requisições medidas (depois do aquecimento)")
+@click.option("--tokens", default=32, show_default=True, help="Tokens distintos (enche o cache como em produção)")
+@click.option("--messages", default=25, show_default=True, help="Mensagens na resposta da Inbox")
+@click.option("--max-growth-kb", default=512, show_default=True, help="Crescimento máximo aceito")
+def memcheck(n, tokens, messages, max_growth_kb):
+    """
+    Teste de regressão de memória: repete GET /mail/inbox contra o stub do Graph e falha
+    (código de saída 1) se a memória rastreada crescer mais que --max-growth-kb depois do aquecimento.
+    Grava no request_logs do DATABASE_URL: use um banco descartável.
+    """
+    import gc
+    import tracemalloc
+
+    from flask import current_app
+
+    from app.services import memory_diag, ms_oauth, ratelimit
+
+    app = current_app._get_current_object()
+    # todas as requisições saem do mesmo IP: o rate limit não entra na medição
+    saved_limiter = ratelimit._limiter
+    ratelimit._limiter = ratelimit.RateLimiter(ratelimit.MemoryStore(), rules="", default="")
+    server = _stub_graph_server(0, 0, messages)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    saved_base = ms_oauth.GRAPH_BASE
+    ms_oauth.GRAPH_BASE = f"http://127.0.0.1:{server.server_address[1]}/v1.0"
+    client = app.test_client()
+
+    def replay(count):
+        for i in range(count):
+            r = client.get("/mail/inbox", headers={"Authorization": f"Bearer memcheck-token-{i % tokens:04d}"})
+            if r.status_code != 200:
+                raise click.ClickException(f"/mail/inbox respondeu {r.status_code}: {r.get_data(as_text=True)[:300]}")
+
+    try:
+        tracemalloc.start(memory_diag.MEMORY_TRACE_FRAMES)
+        # aquecimento: imports tardios, pools, cache cheio para todos os tokens
+        replay(max(200, tokens * 4))
+        gc.collect()
+        before, rss_before = tracemalloc.take_snapshot(), memory_diag.rss_bytes()
+        started = time.perf_counter()
+        replay(n)
+        elapsed = time.perf_counter() - started
+        gc.collect()
+        after, rss_after = tracemalloc.take_snapshot(), memory_diag.rss_bytes()
+    finally:
+        tracemalloc.stop()
+        ms_oauth.GRAPH_BASE = saved_base
+        ratelimit._limiter = saved_limiter
+        server.shutdown()
+
+    diff = after.compare_to(before, "lineno")
+    growth = sum(d.size_diff for d in diff)
+    click.echo(f"{n} requisições em {elapsed:.1f}s; memória rastreada {growth / 1024:+.1f} KB "
+               f"({growth / n:+.1f} B/requisição); RSS {((rss_after or 0) - (rss_before or 0)) / 1024:+.0f} KB")
+    for d in diff[:10]:
+        frame = d.traceback[0]
+        click.echo(f"  {d.size_diff / 1024:+8.1f} KB {d.count_diff:+6d} objs  {frame.filename}:{frame.lineno}")
+    if growth > max_growth_kb * 1024:
+        raise click.ClickException(f"crescimento de {growth / 1024:.1f} KB acima do limite de {max_growth_kb} KB")
+    click.echo("ok")
+
+
+@cli.command("replay-bench")
+@click.option("--cassette", default="default", show_default=True, help="Nome do cassete em TRANSPORT_CASSETTE_DIR")
+@click.option("--path", default="/mail/inbox", show_default=True)
+@click.option("--method", default="GET", show_default=True)
+@click.option("--json-body", help="Corpo JSON da requisição (ex.: para POST /ai/)")
+@click.option("--requests", "n", default=200, show_default=True)
+@click.option("--tokens", default=16, show_default=True, help="Tokens distintos (evita servir tudo do cache)")
+@click.option("--scale", "scales", default="0,0.1,1", show_default=True, help="Fatores de latência a medir")
+def replay_bench(cassette, path, method, json_body, n, tokens, scales):
+    """Repete uma rota com Graph/Gemini respondidos do cassete (sem rede), em vários fatores de latência."""
+    import json
+
+    from flask import current_app
+
+    from app.services import ratelimit, transport
+    from app.services.cache import reset_cache
+
+    app = current_app._get_current_object()
+    body = json.loads(json_body) if json_body else None
+    saved_transport, saved_limiter = transport._transport, ratelimit._limiter
+    ratelimit._limiter = ratelimit.RateLimiter(ratelimit.MemoryStore(), rules="", default="")
+    client = app.test_client()
+    try:
+        for scale in (float(s) for s in scales.split(",")):
+            replay = transport.ReplayTransport(transport.Cassette(cassette), latency_scale=scale, on_miss="error")
+            transport.set_transport(replay)
+            reset_cache()
+            latencies, statuses = [], {}
+            started = time.perf_counter()
+            for i in range(n):
+                t0 = time.perf_counter()
+                r = client.open(path, method=method, json=body,
+                                headers={"Authorization": f"Bearer replay-token-{i % tokens:04d}"})
+                latencies.append(time.perf_counter() - t0)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+            elapsed = time.perf_counter() - started
+            latencies.sort()
+            click.echo(
+                f"escala {scale:<5g} {n / elapsed:8.1f} req/s  p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms  status {statuses}  "
+                f"sem gravação {replay.misses}"
+            )
+    finally:
+        transport.set_transport(saved_transport)
+        ratelimit._limiter = saved_limiter
+
+
+def _read_spans(path):
+    """Spans de um arquivo OTLP/JSON (uma exportação por linha), achatados."""
+    import json
+
+    spans = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for rs in json.loads(line).get("resourceSpans", []):
+                for ss in rs.get("scopeSpans", []):
+                    spans.extend(ss.get("spans", []))
+    return spans
+
+
+@cli.command("trace-show")
+@click.argument("trace_id", required=False)
+@click.option("--file", "path", help="Arquivo OTLP/JSON (padrão: TRACING_FILE)")
+@click.option("--slowest", default=10, show_default=True, help="Sem TRACE_ID: lista os N traces mais lentos")
+def trace_show(trace_id, path, slowest):
+    """Árvore de spans de um trace (o trace_id está no request_logs e no cabeçalho X-Trace-Id)."""
+    from app.services.tracing import TRACING_FILE
+
+    path = path or TRACING_FILE
+    if not os.path.exists(path):
+        raise click.ClickException(f"{path} não existe (TRACING_ENABLED=true e TRACING_EXPORTER=file?)")
+    spans = _read_spans(path)
+
+    def duration(s):
+        return (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e6
+
+    def attrs(s):
+        return {a["key"]: next(iter(a["value"].values())) for a in s.get("attributes", [])}
+
+    if not trace_id:
+        ids = {s["spanId"] for s in spans}
+        roots = sorted((s for s in spans if (s.get("parentSpanId") or "") not in ids), key=duration, reverse=True)
+        for s in roots[:slowest]:
+            click.echo(f"{s['traceId']}  {duration(s):8.1f} ms  {s['name']}")
+        return
+
+    mine = [s for s in spans if s["traceId"] == trace_id]
+    if not mine:
+        raise click.ClickException(f"trace {trace_id} não encontrado em {path}")
+    children = {}
+    for s in mine:
+        children.setdefault(s.get("parentSpanId") or "", []).append(s)
+    ids = {s["spanId"] for s in mine}
+    t0 = min(int(s["startTimeUnixNano"]) for s in mine)
+
+    def show(span, depth):
+        a = attrs(span)
+        extra = " ".join(f"{k}={a[k]}" for k in ("http.response.status_code", "graph.request_id", "code.arg.endpoint",
+                                                  "gemini.model") if k in a)
+        error = " ERRO" if span.get("status", {}).get("code") == 2 else ""
+        click.echo(f"{(int(span['startTimeUnixNano']) - t0) / 1e6:8.1f} ms {duration(span):8.1f} ms  "
+                   f"{'  ' * depth}{span['name']}{error}  {extra}".rstrip())
+        for child in sorted(children.get(span["spanId"], []), key=lambda c: int(c["startTimeUnixNano"])):
+            show(child, depth + 1)
+
+    # raízes: sem pai, ou com pai fora do arquivo (traceparent vindo de fora)
+    for root in [s for s in mine if (s.get("parentSpanId") or "") not in ids]:
+        show(root, 0)
+
+
+@cli.command("trace-collector")
+@click.option("--port", default=4318, show_default=True)
+@click.option("--out", default="traces-collected.jsonl", show_default=True, help="Arquivo onde os lotes são gravados")
+def trace_collector(port, out):
+    """Coletor OTLP/HTTP mínimo (/v1/traces) para testes: use TRACING_EXPORTER=otlp; grava OTLP/JSON."""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceRequest
+
+    from app.services.tracing_export import otlp_json
+
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path != "/v1/traces":
+                self.send_response(404)
+            else:
+                if "json" not in (self.headers.get("Content-Type") or ""):
+                    # o exportador do SDK manda protobuf; no arquivo fica o mesmo JSON do TRACING_EXPORTER=file
+                    body = json.dumps(otlp_json(ExportTraceServiceRequest.FromString(body))).encode()
+                with lock, open(out, "ab") as f:
+                    f.write(body.replace(b"\n", b"") + b"\n")
+                self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    click.echo(f"coletor em http://127.0.0.1:{port}/v1/traces gravando em {out} (leia com trace-show --file)")
+    server.serve_forever()
+
+
+@cli.command("loadtest")
+@click.option("--url", default="http://127.0.0.1:8080/mail/inbox", show_default=True)
+@click.option("--concurrency", default=64, show_default=True)
+@click.option("--duration", default=15.0, show_default=True, help="Segundos")
+@click.option("--tokens", default=16, show_default=True, help="Tokens distintos (evita coalescer tudo num usuário)")
+def loadtest(url, concurrency, duration, tokens):
+    """Gera carga concorrente contra um app rodando e mede throughput e latência."""
+    import requests
+
+    from collections import Counter
+
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(n):
+        session = requests.Session()
+        headers = {"Authorization": f"Bearer loadtest-token-{n % tokens:04d}"}
+        mine, seen = [], Counter()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = session.get(url, headers=headers, timeout=60).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            seen[status] += 1
+            # 401/429 são baratos: contados como sucesso inflariam o req/s
+            if isinstance(status, int) and 200 <= status < 300:
+                mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+            statuses.update(seen)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    failed = sum(statuses.values()) - len(latencies)
+    click.echo(
+        f"{len(latencies) / elapsed:7.1f} req/s (2xx)  p50 {pct(0.50):6.0f} ms  p95 {pct(0.95):6.0f} ms  "
+        f"p99 {pct(0.99):6.0f} ms  erros {failed}"
+    )
+    click.echo("status: " + "  ".join(f"{k}={v}" for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))))
+    if failed > sum(statuses.values()) * 0.01:
+        click.echo("atenção: mais de 1% das respostas não foi 2xx (rate limit? token do stub?); o req/s acima só conta 2xx")
+
+@cli.command("bench-ratelimit")
+@click.option("--requests", "n", default=20000, show_default=True)
+@click.option("--processes", default=4, show_default=True, help="Processos disputando o mesmo balde (teste do shm)")
+def bench_ratelimit(n, processes):
+    """Custo por requisição do rate limit (hooks before/after) e contagem correta entre processos."""
+    from flask import current_app
+
+    from app.middleware.rate_limit import add_headers, check_request
+    from app.services import ratelimit
+
+    app = current_app._get_current_object()
+    tmp_dir = tempfile.mkdtemp(prefix="bench-rl-")
+    rules = "POST /ai/=user:1000000000/60+ip:1000000000/60"
+    stores = {
+        "memory": lambda: ratelimit.MemoryStore(),
+        "shm": lambda: ratelimit.SharedMemoryStore(os.path.join(tmp_dir, "rl.shm")),
+    }
+    saved = ratelimit._limiter
+    try:
+        for name, factory in stores.items():
+            ratelimit._limiter = ratelimit.RateLimiter(factory(), rules=rules, default="")
+            resp = app.response_class("{}", mimetype="application/json")
+            timings = []
+            with app.test_request_context("/ai/", method="POST", headers={"Authorization": "Bearer bench-token"}):
+                for _ in range(5):
+                    started = time.perf_counter()
+                    for _ in range(n):
+                        check_request()
+                        add_headers(resp)
+                    timings.append((time.perf_counter() - started) / n)
+            click.echo(f"{name:<7} {min(timings) * 1e6:6.1f} µs/requisição (2 baldes: IP + usuário)")
+
+        # N processos, 1 balde de 100: no total só 100 podem passar
+        path = os.path.join(tmp_dir, "shared.shm")
+        ratelimit.SharedMemoryStore(path).close()
+        limit = ratelimit.Limit("ip", 100, 3600)
+        pids = []
+        for _ in range(processes):
+            pid = os.fork()
+            if pid == 0:
+                store = ratelimit.SharedMemoryStore(path)
+                allowed = sum(store.take("bench|ip|1.2.3.4", limit).allowed for _ in range(100))
+                os._exit(allowed)
+            pids.append(pid)
+        allowed = sum(os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) for pid in pids)
+        click.echo(f"shm     {processes} processos x 100 tentativas, limite 100: {allowed} permitidas")
+    finally:
+        ratelimit._limiter = saved
+
 if __name__ == "__main__":
-    cli()
\ No newline at end of file
+    cli()
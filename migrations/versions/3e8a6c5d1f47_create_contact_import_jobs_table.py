@@ -0,0 +1,30 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "3e8a6c5d1f47"
+down_revision = "7b1d4f2a9c30"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "contact_import_jobs",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("owner", sa.String(length=255), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("format", sa.String(length=10), nullable=False),
+        sa.Column("rows_read", sa.Integer(), nullable=False),
+        sa.Column("rows_committed", sa.Integer(), nullable=False),
+        sa.Column("created", sa.Integer(), nullable=False),
+        sa.Column("failed", sa.Integer(), nullable=False),
+        sa.Column("invalid", sa.Integer(), nullable=False),
+        sa.Column("errors", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("updated_at", sa.DateTime()),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_contact_import_jobs_owner", "contact_import_jobs", ["owner"])
+
+def downgrade():
+    op.drop_index("ix_contact_import_jobs_owner", table_name="contact_import_jobs")
+    op.drop_table("contact_import_jobs")
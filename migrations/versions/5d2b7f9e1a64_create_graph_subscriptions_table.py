@@ -0,0 +1,29 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "5d2b7f9e1a64"
+down_revision = "9a4c2e7b5d18"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "graph_subscriptions",
+        sa.Column("id", sa.String(length=255), primary_key=True),
+        sa.Column("owner", sa.String(length=255), nullable=False),
+        sa.Column("category", sa.String(length=20), nullable=False),
+        sa.Column("resource", sa.Text(), nullable=False),
+        sa.Column("client_state", sa.String(length=255), nullable=False),
+        sa.Column("status", sa.String(length=30), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("renewed_at", sa.DateTime(), nullable=True),
+        sa.Column("last_notification_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_graph_subscriptions_owner", "graph_subscriptions", ["owner"])
+    op.create_index("ix_graph_subscriptions_expires_at", "graph_subscriptions", ["expires_at"])
+
+def downgrade():
+    op.drop_index("ix_graph_subscriptions_expires_at", table_name="graph_subscriptions")
+    op.drop_index("ix_graph_subscriptions_owner", table_name="graph_subscriptions")
+    op.drop_table("graph_subscriptions")
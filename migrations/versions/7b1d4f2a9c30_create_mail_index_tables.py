@@ -0,0 +1,49 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "7b1d4f2a9c30"
+down_revision = "xxxxxxxxx""  # mantém o mesmo hash"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "mail_index",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("owner", sa.String(length=255), nullable=False),
+        sa.Column("folder", sa.String(length=50), nullable=False),
+        sa.Column("message_id", sa.String(length=255), nullable=False),
+        sa.Column("subject", sa.Text(), nullable=True),
+        sa.Column("sender", sa.Text(), nullable=True),
+        sa.Column("recipients", sa.Text(), nullable=True),
+        sa.Column("body_preview", sa.Text(), nullable=True),
+        sa.Column("received_at", sa.DateTime(), nullable=True),
+        sa.Column("indexed_at", sa.DateTime()),
+        sa.UniqueConstraint("owner", "message_id", name="uq_mail_index_owner_message"),
+    )
+    op.create_index("ix_mail_index_owner", "mail_index", ["owner"])
+    op.create_index("ix_mail_index_received_at", "mail_index", ["received_at"])
+
+    op.create_table(
+        "mail_sync_state",
+        sa.Column("owner", sa.String(length=255), primary_key=True),
+        sa.Column("folder", sa.String(length=50), primary_key=True),
+        sa.Column("delta_link", sa.Text(), nullable=True),
+        sa.Column("synced_at", sa.DateTime(), nullable=True),
+    )
+
+    # Índice full-text só existe no SQLite (FTS5); nos demais bancos a busca cai no LIKE.
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS mail_index_fts USING fts5("
+            "owner UNINDEXED, message_id UNINDEXED, subject, sender, recipients, body_preview, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+def downgrade():
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TABLE IF EXISTS mail_index_fts")
+    op.drop_table("mail_sync_state")
+    op.drop_index("ix_mail_index_received_at", table_name="mail_index")
+    op.drop_index("ix_mail_index_owner", table_name="mail_index")
+    op.drop_table("mail_index")
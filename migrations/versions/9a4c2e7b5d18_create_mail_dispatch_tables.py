@@ -0,0 +1,52 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "9a4c2e7b5d18"
+down_revision = "3e8a6c5d1f47"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "mail_dispatch_jobs",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("owner", sa.String(length=255), nullable=False),
+        sa.Column("idempotency_key", sa.String(length=255), nullable=True),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("updated_at", sa.DateTime()),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.UniqueConstraint("owner", "idempotency_key", name="uq_mail_dispatch_jobs_owner_key"),
+    )
+    op.create_index("ix_mail_dispatch_jobs_owner", "mail_dispatch_jobs", ["owner"])
+
+    op.create_table(
+        "mail_dispatch_messages",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("job_id", sa.String(), sa.ForeignKey("mail_dispatch_jobs.id"), nullable=False),
+        sa.Column("owner", sa.String(length=255), nullable=False),
+        sa.Column("to_address", sa.String(length=320), nullable=False),
+        sa.Column("subject", sa.Text(), nullable=False),
+        sa.Column("body_html", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("draft_id", sa.Text(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("next_attempt_at", sa.DateTime()),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+    op.create_index("ix_mail_dispatch_messages_job_id", "mail_dispatch_messages", ["job_id"])
+    op.create_index("ix_mail_dispatch_messages_owner", "mail_dispatch_messages", ["owner"])
+    op.create_index("ix_mail_dispatch_messages_status", "mail_dispatch_messages", ["status"])
+    op.create_index("ix_mail_dispatch_messages_sent_at", "mail_dispatch_messages", ["sent_at"])
+
+def downgrade():
+    op.drop_index("ix_mail_dispatch_messages_sent_at", table_name="mail_dispatch_messages")
+    op.drop_index("ix_mail_dispatch_messages_status", table_name="mail_dispatch_messages")
+    op.drop_index("ix_mail_dispatch_messages_owner", table_name="mail_dispatch_messages")
+    op.drop_index("ix_mail_dispatch_messages_job_id", table_name="mail_dispatch_messages")
+    op.drop_table("mail_dispatch_messages")
+    op.drop_index("ix_mail_dispatch_jobs_owner", table_name="mail_dispatch_jobs")
+    op.drop_table("mail_dispatch_jobs")
@@ -0,0 +1,17 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "c4f1a8d2e6b9"
+down_revision = "5d2b7f9e1a64"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table("request_logs") as batch:
+        batch.add_column(sa.Column("trace_id", sa.String(length=32), nullable=True))
+    op.create_index("ix_request_logs_trace_id", "request_logs", ["trace_id"])
+
+def downgrade():
+    op.drop_index("ix_request_logs_trace_id", table_name="request_logs")
+    with op.batch_alter_table("request_logs") as batch:
+        batch.drop_column("trace_id")
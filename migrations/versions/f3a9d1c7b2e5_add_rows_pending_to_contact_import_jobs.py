@@ -0,0 +1,15 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "f3a9d1c7b2e5"
+down_revision = "c4f1a8d2e6b9"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table("contact_import_jobs") as batch:
+        batch.add_column(sa.Column("rows_pending", sa.Text(), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table("contact_import_jobs") as batch:
+        batch.drop_column("rows_pending")
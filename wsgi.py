@@ -1,3 +1,9 @@
-from app.main import create_app
+import os
 
-app = create_app()
\ No newline at end of file
+from app.main import create_app, preload_app
+
+app = create_app()
+
+# com 'gunicorn --preload' este módulo roda só no master; os workers herdam o app já aquecido
+if os.getenv("APP_PRELOAD", "false").lower() in ("1", "true", "yes", "y"):
+    preload_app(app)